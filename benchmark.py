@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Generates synthetic instances of growing size and measures how swsched.py
+# scales on them (build time, model size before and after presolve, time to
+# first solution, final objective, peak memory), optionally on growing
+# calendars too.
+
+import sys
+import os
+import csv
+import json
+import random
+import argparse
+import subprocess
+import tempfile
+import shutil
+import time
+
+parser = argparse.ArgumentParser(description="Scaling benchmark of swsched.py on synthetic instances.")
+parser.add_argument("--sizes", default="20x15,40x30,60x45",
+    help="comma separated list of TEACHERSxCOURSES instance sizes (default: 20x15,40x30,60x45)")
+parser.add_argument("--days", type=int, default=4,
+    help="number of days (default: 4)")
+parser.add_argument("--times", type=int, default=3,
+    help="number of time slots a day (default: 3)")
+parser.add_argument("--rooms", type=int, default=0,
+    help="number of rooms (default: enough for the courses)")
+parser.add_argument("--calendars", default="",
+    help="comma separated list of DAYSxTIMESxROOMS calendars (ROOMS 0 for enough, TIMES also as times of every day separated by /) to run every size on instead of --days, --times and --rooms, e.g. 4x3x3,5x4x5,7x6x10,5x6/6/6/6/3x8")
+parser.add_argument("--seeds", default="1",
+    help="comma separated list of generator seeds (default: 1)")
+parser.add_argument("--time-limit", type=float, default=30,
+    help="time limit of one solve in seconds (default: 30)")
+parser.add_argument("--workers", type=int, default=0,
+    help="number of search workers passed to swsched.py")
+parser.add_argument("--extra", default="",
+    help="additional swsched.py options, e.g. \"--formulation interval\"")
+parser.add_argument("--encodings", default="",
+    help="comma separated list of swsched.py --encoding values to compare on every instance, e.g. reified,compact")
+parser.add_argument("--output", metavar="FILE", default="benchmark.csv",
+    help="results table (CSV, default: benchmark.csv)")
+parser.add_argument("--keep", metavar="DIR",
+    help="keep generated instances, forms and solver logs in DIR")
+parser.add_argument("--generate-only", action="store_true",
+    help="only generate the instances (into --keep DIR)")
+args = parser.parse_args()
+
+SWSCHED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "swsched.py")
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+PREFERENCE_VALUES = ["0 - not possible", "1 - only if needed", "2 - fine", "3 - perfect!"]
+FAKE_PER_ROLE = 3
+
+def error(m):
+    print(f"ERROR: {m}")
+    sys.exit(1)
+
+def parse_size(size):
+    (nteachers, ncourses) = size.lower().split("x")
+    return (int(nteachers), int(ncourses))
+
+def parse_calendar(calendar):
+    # -> (days, [times of every day], rooms)
+    (ndays, ntimes, nrooms) = calendar.lower().split("x")
+    ntimes = [int(n) for n in ntimes.split("/")]
+    if len(ntimes) == 1:
+        ntimes *= int(ndays)
+    if len(ntimes) != int(ndays) or min(ntimes) < 1:
+        error(f"calendar {calendar} needs one or {ndays} numbers of times")
+    return (int(ndays), ntimes, int(nrooms))
+
+def generate(nteachers, ncourses, ndays, ntimes, nrooms, seed):
+    """Returns (instance, form rows) of a random instance of the given size."""
+    rnd = random.Random(seed)
+    if ndays > len(DAY_NAMES):
+        error(f"at most {len(DAY_NAMES)} days supported")
+
+    days = DAY_NAMES[:ndays]
+    form_days = [D[:3] for D in days]
+    form_times = []
+    times = []
+    first = 17*60 + 30 if max(ntimes) <= 3 else 10*60 # evenings, or whole days of a festival
+    for i in range(max(ntimes)):
+        start = first + i*75
+        form_times.append(f"{start//60}:{start%60:02}")
+        times.append(f"{start//60}:{start%60:02}-{(start+70)//60}:{(start+70)%60:02}")
+    if len(set(ntimes)) > 1:
+        # shorter days end earlier
+        times = {D: times[:n] for (D, n) in zip(days, ntimes)}
+        form_times = {D: form_times[:n] for (D, n) in zip(form_days, ntimes)}
+
+    # courses: families of regular courses with one or more groups, some solo and open courses
+    courses_regular = []
+    courses_solo = []
+    courses_open = []
+    courses_different = []
+    families = []
+    n = 0
+    while len(courses_regular) + len(courses_solo) + len(courses_open) < ncourses:
+        n += 1
+        kind = rnd.random()
+        if kind < 0.08:
+            courses_open.append(f"Open {n:02}")
+            continue
+        if kind < 0.2:
+            courses_solo.append(f"Solo {n:02}")
+            families.append(f"Solo {n:02}")
+            continue
+        family = f"Course {n:02}"
+        families.append(family)
+        ngroups = min(rnd.choice([1, 1, 1, 2, 2, 3]), ncourses - len(courses_regular) - len(courses_solo) - len(courses_open))
+        if ngroups == 1:
+            courses_regular.append(family)
+        else:
+            group = [f"{family} /{g+1}" for g in range(ngroups)]
+            courses_regular += group
+            courses_different.append(group)
+    ncourses = len(courses_regular) + len(courses_solo) + len(courses_open)
+
+    if not nrooms:
+        nrooms = max(2, -(-ncourses * 5 // (4 * sum(ntimes))))
+    if ncourses > nrooms * sum(ntimes):
+        error(f"{ncourses} courses do not fit into {nrooms} rooms")
+    venue_rooms = {"mosilana": 1, "koliste": nrooms - 1}
+
+    # teachers: leads first, then follows (print_solution relies on it)
+    nlead = (nteachers + 1) // 2
+    teachers = []
+    for i in range(nteachers):
+        role = "lead" if i < nlead else "follow"
+        teachers.append((f"{role.capitalize()}-{i:03}", role, rnd.random() < 0.2))
+    fake_lead = [f"LEAD-{i+1}" for i in range(FAKE_PER_ROLE)]
+    fake_follow = [f"FOLL-{i+1}" for i in range(FAKE_PER_ROLE)]
+    teachers = [T for T in teachers if T[1] == "lead"] + [(T, "lead", False) for T in fake_lead] \
+        + [T for T in teachers if T[1] == "follow"] + [(T, "follow", False) for T in fake_follow]
+
+    instance = {
+        "days": days,
+        "times": times,
+        "form_days": form_days,
+        "form_times": form_times,
+        "venue_rooms": venue_rooms,
+        "teachers": teachers,
+        "fake_teachers": fake_lead + fake_follow,
+        "courses_regular": courses_regular,
+        "courses_solo": courses_solo,
+        "courses_open": courses_open,
+        "teacher_names": {},
+        "courses_different": courses_different,
+    }
+
+    # preferences form answers of every real teacher
+    courses = courses_regular + courses_solo + courses_open
+    rows = []
+    for (T, role, community) in teachers:
+        if T in instance["fake_teachers"]:
+            continue
+        row = {}
+        row["Timestamp"] = ""
+        row["Who are you?"] = T
+        nmax = rnd.choice([0, 1, 1, 2, 2, 2, 3])
+        row["How many courses would you ideally like to teach?"] = str(rnd.randint(min(nmax, 1), nmax))
+        row["How many courses are you able to teach at most?"] = str(nmax)
+        for D in form_days:
+            for H in (form_times[D] if isinstance(form_times, dict) else form_times):
+                row[f"What days and times are convenient for you? [{D} {H}]"] = rnd.choices(PREFERENCE_VALUES, weights=[3, 2, 3, 2])[0]
+        row["Are you fine with teaching in Mosilana?"] = "Yes" if rnd.random() < 0.8 else "No"
+        for F in families:
+            row[f"What courses would you like to teach? [{F}]"] = rnd.choices(PREFERENCE_VALUES, weights=[4, 1, 3, 2])[0]
+        row["What courses and trainings would you like to attend?"] = ";".join(rnd.sample(courses, min(len(courses), rnd.randint(0, 2))))
+        row["Who would you like to teach with?"] = ""
+        row["Are there any people you cannot teach with?"] = ""
+        rows.append(row)
+
+    return (instance, rows)
+
+def write_instance(directory, name, instance, rows):
+    instance_file = os.path.join(directory, f"{name}.json")
+    with open(instance_file, mode="w") as f:
+        json.dump(instance, f, indent=1, ensure_ascii=False)
+    form_file = os.path.join(directory, f"{name}.csv")
+    with open(form_file, mode="w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()), quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+    return (instance_file, form_file)
+
+def run(instance_file, form_file, log_file, encoding=""):
+    """Runs swsched.py and returns its measurements parsed from the output."""
+    command = [sys.executable, SWSCHED, "--instance", instance_file, "--input", form_file,
+        "--time-limit", str(args.time_limit), "--workers", str(args.workers), "--log"] + args.extra.split()
+    if encoding:
+        command += ["--encoding", encoding]
+    start = time.time()
+    with open(log_file, mode="w") as f:
+        process = subprocess.Popen(command, stdout=f, stderr=subprocess.STDOUT)
+        (_, status, rusage) = os.wait4(process.pid, 0)
+    result = {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "wall_time": round(time.time() - start, 2),
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1), # kilobytes on Linux
+        "build_time": "",
+        "variables": "",
+        "constraints": "",
+        "presolved_variables": "",
+        "presolved_constraints": "",
+        "first_solution_time": "",
+        "solve_time": "",
+        "status": "",
+        "objective": "",
+        "build_time_per_kvar": "",
+        "first_solution_per_kvar": "",
+    }
+    constraints = {"": 0, "presolved_": 0}
+    block = None # model stats block: "" printed by swsched.py, "presolved_" in the solver log
+    with open(log_file, mode="r") as f:
+        for line in f:
+            line = line.strip()
+            if " model '" in line:
+                block = "presolved_" if line.startswith("Presolved ") else "" if block is None else "other"
+            elif not line and block is not None:
+                block = "other"
+            if line.startswith("Model built in") or line.startswith("Model loaded in"):
+                result["build_time"] = float(line.split()[3])
+            elif line.startswith("#Variables:") and block in constraints:
+                result[block + "variables"] = int(line.split()[1].replace("'", ""))
+            elif line.startswith("#k") and ":" in line and block in constraints:
+                constraints[block] += int(line.split(":")[1].split()[0].replace("'", ""))
+            elif line.startswith("Wall time:") and result["first_solution_time"] == "":
+                result["first_solution_time"] = round(float(line.split()[2]), 2)
+            elif line.startswith("Objective value:"):
+                result["objective"] = float(line.split()[2])
+            elif " finished in " in line and " with status " in line:
+                result["solve_time"] = round(float(line.split(" finished in ")[1].split()[0]), 2)
+                result["status"] = line.split(" - ")[-1]
+    result["constraints"] = constraints[""]
+    result["presolved_constraints"] = constraints["presolved_"] if result["presolved_variables"] != "" else ""
+    # per thousand variables left after presolve, close to constant if the scaling is linear
+    if result["presolved_variables"] and result["build_time"] != "":
+        result["build_time_per_kvar"] = round(result["build_time"] / result["presolved_variables"] * 1000, 4)
+    if result["presolved_variables"] and result["first_solution_time"] != "":
+        result["first_solution_per_kvar"] = round(result["first_solution_time"] / result["presolved_variables"] * 1000, 4)
+    return result
+
+directory = args.keep or tempfile.mkdtemp(prefix="swsched-benchmark-")
+os.makedirs(directory, exist_ok=True)
+
+if args.calendars:
+    calendars = [parse_calendar(calendar) for calendar in args.calendars.split(",")]
+else:
+    calendars = [(args.days, [args.times] * args.days, args.rooms)]
+
+results = []
+for size in args.sizes.split(","):
+    (nteachers, ncourses) = parse_size(size)
+    for (ndays, ntimes, nrooms) in calendars:
+        for seed in [int(x) for x in args.seeds.split(",")]:
+            calendar = f"{ndays}x{ntimes[0] if len(set(ntimes)) == 1 else '_'.join(map(str, ntimes))}x{nrooms}"
+            name = f"synthetic-{nteachers}x{ncourses}" + (f"-{calendar}" if args.calendars else "") + f"-s{seed}"
+            (instance, rows) = generate(nteachers, ncourses, ndays, ntimes, nrooms, seed)
+            (instance_file, form_file) = write_instance(directory, name, instance, rows)
+            if args.generate_only:
+                print(f"Generated {instance_file} and {form_file}")
+                continue
+            for encoding in args.encodings.split(","):
+                print(f"Running {name} ({len(instance['teachers'])} teachers, {ncourses} courses, {sum(instance['venue_rooms'].values())} rooms)"
+                    + (f" with {encoding} encoding" if encoding else ""), flush=True)
+                log_file = os.path.join(directory, f"{name}-{encoding}.log" if encoding else f"{name}.log")
+                result = run(instance_file, form_file, log_file, encoding)
+                result = {"instance": name, "teachers": nteachers, "courses": ncourses,
+                    "days": ndays, "slots": sum(ntimes), "rooms": sum(instance["venue_rooms"].values()), "seed": seed, "encoding": encoding, **result}
+                print("  " + ", ".join(f"{k}={v}" for (k, v) in result.items() if k not in ["instance", "seed", "encoding"]), flush=True)
+                results.append(result)
+
+if results:
+    with open(args.output, mode="w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Results written to {args.output}")
+
+if not args.keep:
+    shutil.rmtree(directory)
@@ -2,9 +2,118 @@
 
 import sys
 import csv
-from ortools.sat.python import cp_model
+import argparse
+import os
+import pickle
+import hashlib
+import json
+import time
+import threading
+import copy
+
+# the module can be imported and used as a library, e.g.
+#
+#   import swsched
+#   swsched.configure(["--time-limit", "60"])
+#   swsched.load_instance()
+#   swsched.load_input("input.csv")
+#   swsched.build_model()
+#   (src, tc, penalties) = swsched.solve()
+#   swsched.report(src, tc)
+#
+# importing it has no side effects; NumPy and OR-Tools are imported on first use
+np = None
+ortools = None
+cp_model = None
+
+def import_numpy():
+    global np
+    if np is None:
+        import numpy as np
+
+def import_ortools():
+    global ortools, cp_model
+    if cp_model is None:
+        import_numpy()
+        import ortools
+        from ortools.sat.python import cp_model
+        define_solution_printer()
+
+parser = argparse.ArgumentParser(description="Generate schedules based on hard and soft constraints.")
+parser.add_argument("--input", metavar="FILE", nargs="+", default="input.csv",
+    help="preferences form exports (CSV, default: input.csv), later answers of a teacher replace earlier ones")
+parser.add_argument("--instance", metavar="FILE",
+    help="JSON file replacing the built-in calendar, teachers, courses and rules")
+parser.add_argument("--formulation", choices=["bool", "interval"], default="bool",
+    help="model engine: boolean slot x room x course tensor, or course intervals with NoOverlap per person and room")
+parser.add_argument("--workers", type=int, default=0,
+    help="number of parallel search workers of one solve (default: solver default)")
+parser.add_argument("--time-limit", type=float, default=0,
+    help="time limit of one solve in seconds (default: no limit)")
+parser.add_argument("--seed", type=int, default=1,
+    help="random seed of the solver (first seed in portfolio mode)")
+parser.add_argument("--log", action="store_true",
+    help="log search progress of the solver")
+parser.add_argument("--progress-interval", type=float, default=0,
+    help="print intermediate solutions at most every SECONDS (default: every solution, the last one is always printed)")
+parser.add_argument("--progress-improvement", type=float, default=0,
+    help="print an intermediate solution only if it improves the last printed objective by more than this")
+parser.add_argument("--portfolio", type=int, default=0,
+    help="run N independently seeded solves in parallel processes and keep the best schedule")
+parser.add_argument("--two-phase", action="store_true",
+    help="first assign teachers to courses, then place courses into slots and rooms with the assignment fixed")
+parser.add_argument("--reopen", action="store_true",
+    help="with --two-phase, finally re-solve the full model hinted with the two-phase schedule")
+parser.add_argument("--encoding", metavar="[PENALTY=]ENCODING", nargs="+",
+    help="encoding (reified or compact) of all penalties or of the given ones, e.g. \"compact days=reified\"")
+parser.add_argument("--lexicographic", action="store_true",
+    help="minimize the penalties in stages (fake teachers, then the bad ones, then the rest), fixing the optimum of every stage")
+parser.add_argument("--decompose", metavar="N", type=int, default=0,
+    help="assign teachers, days and venues first, then place the courses of every venue and day in N parallel processes and repair the combined schedule")
+parser.add_argument("--pool", metavar="K", type=int, default=0,
+    help="find K schedules one after another, each differing from the previous ones (see --pool-distance), and rank them")
+parser.add_argument("--pool-distance", metavar="N", type=int, default=10,
+    help="with --pool, minimum number of courses moved to another slot plus changed teacher assignments between two schedules (default: 10)")
+parser.add_argument("--previous", metavar="FILE",
+    help="schedule of the previous semester (as written by --output) used as a solution hint and for the stability penalty")
+parser.add_argument("--output", metavar="FILE",
+    help="write the resulting schedule to FILE (CSV)")
+parser.add_argument("--parameters", metavar="TEXT",
+    help="additional CP-SAT parameters in text format, e.g. \"num_workers:16 linearization_level:2\"")
+parser.add_argument("--export", metavar="MODEL",
+    help="only build the model and write it to MODEL (CpModelProto) with the decoding manifest MODEL.json")
+parser.add_argument("--solve-exported", metavar=("MODEL", "RESPONSE"), nargs=2,
+    help="solve an exported MODEL (no instance or input needed) and write the raw CpSolverResponse to RESPONSE")
+parser.add_argument("--import", dest="import_response", metavar=("MODEL", "RESPONSE"), nargs=2,
+    help="decode RESPONSE of the exported MODEL and report it (with the same instance and input)")
+parser.add_argument("--verify", metavar="FILE",
+    help="only check the schedule in FILE (as written by --output) against the hard rules and print its penalties")
+parser.add_argument("--diagnose", action="store_true",
+    help="if the rules cannot be satisfied, find a minimal set of conflicting rules instead of solving")
+parser.add_argument("--no-symmetry-breaking", dest="symmetry_breaking", action="store_false",
+    help="do not order interchangeable courses, rooms and placeholder teachers")
+parser.add_argument("--model-cache", metavar="DIR",
+    help="reuse the built model from DIR if nothing it is built from has changed, store it there otherwise")
+parser.add_argument("--result-cache", metavar="DIR",
+    help="return the schedule stored in DIR for the same instance, preferences, rules and penalties if it is proven optimal, resume from it otherwise")
+parser.add_argument("--profile", metavar="FILE",
+    help="time every section of the model build, count variables and constraints it adds and write a JSON report to FILE")
+args = parser.parse_args([]) # defaults, see configure()
+
+def configure(argv=None, **options):
+    # set the options from command line arguments and keyword arguments (dashes as underscores)
+    global args
+    args = parser.parse_args([] if argv is None else argv)
+    for (name, value) in options.items():
+        if not hasattr(args, name):
+            raise ValueError(f"Unknown option: {name}")
+        setattr(args, name, value)
+    return args
 
 VERBOSE = True
+# only create decision variables for teacher-course pairs allowed by ct_possible
+# and for slots the teacher did not rule out (dense tensors otherwise)
+SPARSE = True
 
 def debug(m):
     if not VERBOSE:
@@ -14,16 +123,22 @@ def debug(m):
 def warn(m):
     print(f"WARNING: {m}")
 
+class ScheduleError(Exception):
+    pass
+
 def error(m):
     print(f"ERROR: {m}")
-    sys.exit(1)
+    raise ScheduleError(m)
+
+# BUILT-IN INSTANCE
+# load_instance() makes the data used by the rest of the script from it (or from
+# an instance file with the same names)
 
 days = ["Monday", "Tuesday", "Wednesday", "Thursday"]
-Days = {}
-for i, D in enumerate(days):
-    Days[D] = i
 times = ["17:30-18:40", "18:45-19:55", "20:00-21:10"]
-slots = [ d + " " + t for d in days for t in times ]
+# days and times as labeled in the preferences form
+FORM_DAYS = ["Mon", "Tue", "Wed", "Thu"]
+FORM_TIMES = ["17:30", "18:45", "20:00"]
 
 rooms = [
     "big",
@@ -31,14 +146,10 @@ rooms = [
     "koli-3",
     "koli-4",
 ]
-Rooms = {}
-for i, R in enumerate(rooms):
-    Rooms[R] = i
 
 venues = ["mosilana", "koliste"]
-Venues = {}
-for i, V in enumerate(venues):
-    Venues[V] = i
+# venues whose unused capacity is penalized (the mosilana penalty)
+venues_preferred = ["koliste"]
 
 # name, role, community
 TEACHERS = [
@@ -85,24 +196,6 @@ TEACHERS = [
     ]
 FAKE_TEACHERS = ["LEAD-1", "LEAD-2", "LEAD-3", "FOLL-1", "FOLL-2", "FOLL-3"]
 
-teachers = [t[0] for t in TEACHERS]
-teachers_lead = [t[0] for t in TEACHERS if t[1] == "lead"]
-teachers_follow = [t[0] for t in TEACHERS if t[1] == "follow"]
-assert(set(teachers) == set(teachers_lead + teachers_follow))
-assert(len(set(teachers_lead) & set(teachers_follow)) == 0)
-teachers_core = [t[0] for t in TEACHERS if not t[2]]
-teachers_community = [t[0] for t in TEACHERS if t[2]]
-print(f"Core teachers: {teachers_core}")
-print(f"Community teachers: {teachers_community}")
-assert(set(teachers) == set(teachers_core + teachers_community))
-assert(len(set(teachers_core) & set(teachers_community)) == 0)
-
-Teachers = {}
-for (i, t) in enumerate(teachers):
-    Teachers[t] = i
-
-people = teachers
-
 rooms_venues = {
     #"small": "mosilana",
     "big": "mosilana",
@@ -148,10 +241,6 @@ courses_regular = [
     "PJ Group /2",
     "PJ Group /3",
     ]
-courses = courses_regular + courses_solo + courses_open
-Courses = {}
-for (i, c) in enumerate(courses):
-    Courses[c] = i
 
 TEACHER_NAMES = {
     "Zuzka": "Zuzana Rabčanová",
@@ -170,23 +259,46 @@ TEACHER_NAMES = {
     "Kuba-Š.": "Kuba Šůstek",
 }
 
-def translate_teacher_name(name):
-    name = name.strip()
-    if name in teachers:
-        return name
-    name_nospace = name.replace(" ", "-")
-    if name_nospace in teachers:
-        return name_nospace
+def normalize_name(name):
+    # case, dashes and repeated spaces do not matter in names from the form
+    return " ".join(name.replace("-", " ").split()).casefold()
+
+def build_name_indices():
+    # built once per instance, used when reading the form and building the model
+    global course_prefix_index, teacher_alias_index
+    # prefix (form course label) -> indices of all courses starting with it
+    course_prefix_index = {}
+    for (c, C) in enumerate(courses):
+        for i in range(len(C)+1):
+            course_prefix_index.setdefault(C[:i], []).append(c)
+    # normalized teacher name or alias -> teacher, teacher names take precedence
+    teacher_alias_index = {}
+    for T in teachers:
+        teacher_alias_index.setdefault(normalize_name(T), T)
+    for (k, v) in TEACHER_NAMES.items():
+        teacher_alias_index.setdefault(normalize_name(v), k)
+
+def courses_prefixed(prefix):
+    # indices of courses whose names start with prefix (course family)
+    return course_prefix_index.get(prefix, [])
+
+def find_teacher_name(name):
+    # teacher of a name from the form (None if unknown)
+    key = normalize_name(name)
+    if key in teacher_alias_index:
+        return teacher_alias_index[key]
+    # part of a known full name, remember the answer
     for k in TEACHER_NAMES:
-        if name in TEACHER_NAMES[k]:
+        if key in normalize_name(TEACHER_NAMES[k]):
+            teacher_alias_index[key] = k
             return k
-    error(f"Unknown teacher name {name}")
+    return None
 
-def check_course(course):
-    for c in courses:
-        if c.startswith(course):
-            return
-    error(f"Unknown course: '{course}'")
+def translate_teacher_name(name):
+    T = find_teacher_name(name)
+    if T is None:
+        error(f"Unknown teacher name {name.strip()}")
+    return T
 
 COURSES_IGNORE = [
     #"Balboa Intermediate",
@@ -194,166 +306,287 @@ COURSES_IGNORE = [
     "",
 ]
 
-def read_input(filename="input.csv"):
+# PREFERENCES FORM
+# the header of an export is compiled into column indices once, then the rows
+# are streamed; all problems are collected and reported together at the end
+
+FORM_NAME = "Who are you?"
+FORM_NCOURSES_IDEAL = "How many courses would you ideally like to teach?"
+FORM_NCOURSES_MAX = "How many courses are you able to teach at most?"
+FORM_SLOTS = "What days and times are convenient for you?"
+FORM_MOSILANA = "Are you fine with teaching in Mosilana?"
+FORM_COURSES_TEACH = "What courses would you like to teach?"
+FORM_COURSES_ATTEND = "What courses and trainings would you like to attend?"
+FORM_TEACH_TOGETHER = "Who would you like to teach with?"
+FORM_TEACH_NOT_TOGETHER = "Are there any people you cannot teach with?"
+# slot and course preferences: 0 (no) ... 3 (yes)
+FORM_PREFERENCES = range(4)
+FORM_QUESTIONS = [FORM_NAME, FORM_NCOURSES_IDEAL, FORM_NCOURSES_MAX, FORM_MOSILANA,
+    FORM_COURSES_ATTEND, FORM_TEACH_TOGETHER, FORM_TEACH_NOT_TOGETHER]
+
+def form_label(column, question):
+    # "question [label]" -> "label", None for other columns
+    if not column.startswith(question + " ["):
+        return None
+    return column.split("[")[1].split("]")[0]
+
+def compile_form_header(header, where, problems):
+    # column names -> {question: column index, FORM_SLOTS: [column of slot s], FORM_COURSES_TEACH: {course label: column}}
+    columns = {}
+    for question in FORM_QUESTIONS:
+        if question in header:
+            columns[question] = header.index(question)
+        else:
+            problems.append(f"{where}: missing column '{question}'")
+    # "day time" labels of the slots in the order of the form
+    slot_columns = {} # label -> column
+    columns[FORM_COURSES_TEACH] = {}
+    for (i, column) in enumerate(header):
+        label = form_label(column, FORM_SLOTS)
+        if label is not None:
+            slot_columns[label] = i
+        label = form_label(column, FORM_COURSES_TEACH)
+        if label is not None and label not in COURSES_IGNORE:
+            # problematic: Balboa Beginners 2
+            if courses_prefixed(label):
+                columns[FORM_COURSES_TEACH][label] = i
+            else:
+                problems.append(f"{where}: unknown course '{label}'")
+    if len(slot_columns) != len(slots):
+        problems.append(f"{where}: form has {len(slot_columns)} slots, expected {len(slots)}")
+    elif list(slot_columns) != FORM_SLOT_LABELS:
+        problems.append(f"{where}: form slots {list(slot_columns)} differ from the instance ({FORM_SLOT_LABELS})")
+    columns[FORM_SLOTS] = []
+    for L in FORM_SLOT_LABELS:
+        if L not in slot_columns:
+            problems.append(f"{where}: missing column '{FORM_SLOTS} [{L}]'")
+        columns[FORM_SLOTS].append(slot_columns.get(L))
+    return columns
+
+def read_form_row(row, columns, where, problems):
+    # one answer of the form -> (teacher, data), None if it cannot be used
+    def value(column, convert=lambda x: int(x[0]), valid=None):
+        try:
+            v = convert(row[column])
+        except (ValueError, IndexError):
+            problems.append(f"{where}: unexpected value '{row[column]}' in column {column+1}")
+            return 0
+        if valid is not None and v not in valid:
+            problems.append(f"{where}: value {v} out of range {valid[0]}-{valid[-1]} in column {column+1}")
+            return 0
+        return v
+
+    name = find_teacher_name(row[columns[FORM_NAME]])
+    if name is None:
+        problems.append(f"{where}: unknown teacher name {row[columns[FORM_NAME]].strip()}")
+        return None
+    debug(f"Reading: name {name}")
+    d = {}
+    d["ncourses_ideal"] = value(columns[FORM_NCOURSES_IDEAL], int)
+    d["ncourses_max"] = value(columns[FORM_NCOURSES_MAX], int)
+    d["slots"] = [value(i, valid=FORM_PREFERENCES) if i is not None else 0 for i in columns[FORM_SLOTS]]
+    d["mosilana"] = row[columns[FORM_MOSILANA]] == "Yes"
+    d["courses_teach"] = {c: value(i, valid=FORM_PREFERENCES) for (c, i) in columns[FORM_COURSES_TEACH].items()}
+    d["courses_attend"] = [c for c in row[columns[FORM_COURSES_ATTEND]].split(";") if c not in COURSES_IGNORE]
+    for c in d["courses_attend"]:
+        if not courses_prefixed(c):
+            problems.append(f"{where}: unknown course '{c}' to attend")
+    # free text answers are replaced by the instance (teach_together)
+    if row[columns[FORM_TEACH_TOGETHER]]:
+        if name in teach_together:
+            d["teach_together"] = list(teach_together[name])
+        else:
+            problems.append(f"{where}: unhandled teach_together preference {name}: {row[columns[FORM_TEACH_TOGETHER]]}")
+            d["teach_together"] = []
+    else:
+        d["teach_together"] = []
+    d["teach_not_together"] = []
+    for x in row[columns[FORM_TEACH_NOT_TOGETHER]].split():
+        if x in ["-", "No", "není"]:
+            continue
+        T = find_teacher_name(x)
+        if T is None:
+            problems.append(f"{where}: unknown teacher name {x} (cannot teach with)")
+        else:
+            d["teach_not_together"].append(T)
+    return (name, d)
+
+def read_input(filenames):
+    # one or more form exports, later answers of the same teacher replace earlier ones
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    result = {}
+    problems = []
+    for filename in filenames:
+        n = 0
+        with open(filename, mode="r", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                problems.append(f"{filename}: empty file")
+                continue
+            columns = compile_form_header(header, filename, problems)
+            if any(question not in columns for question in FORM_QUESTIONS):
+                continue
+            for row in reader:
+                if not row:
+                    continue
+                n += 1
+                where = f"{filename}:{reader.line_num}"
+                if len(row) != len(header):
+                    problems.append(f"{where}: {len(row)} columns, expected {len(header)}")
+                    continue
+                answer = read_form_row(row, columns, where, problems)
+                if answer is None:
+                    continue
+                (name, d) = answer
+                if name in result:
+                    warn(f"{where}: answers of {name} replace earlier ones")
+                result[name] = d
+        debug(f"Number of lines: {n} ({filename})")
+    for m in problems:
+        print(f"ERROR: {m}")
+    if problems:
+        error(f"{len(problems)} problems in the preferences form export")
+    return result
+
+SCHEDULE_COLUMNS = ["Course", "Slot", "Room", "Teachers"]
+
+def read_schedule(filename, what="Previous schedule"):
+    # course C -> (slot S, room R, teachers Ts), unknown entries are skipped
     result = {}
     with open(filename, mode="r") as f:
         reader = csv.DictReader(f)
-        n = 0
-        input_courses = [] # courses
         for row in reader:
-            n += 1
-            if n == 1:
-                # check courses when handling the first row
-                columns = list(row.keys())
-                for col in columns:
-                    if col.startswith("What courses would you like to teach?"):
-                        course = col.split("[")[1].split("]")[0]
-                        if course in COURSES_IGNORE:
-                            continue
-                        check_course(course)
-                        # problematic: Balboa Beginners 2
-                        input_courses.append(course)
-            # handle the input data
-            name = translate_teacher_name(row["Who are you?"])
-            debug(f"Reading: name {name}")
-            d = {}
-            d["ncourses_ideal"] = int(row["How many courses would you ideally like to teach?"])
-            d["ncourses_max"] = int(row["How many courses are you able to teach at most?"])
-            slots = []
-            for day in ["Mon", "Tue", "Wed", "Thu"]:
-                for time in ["17:30", "18:45", "20:00"]:
-                    slots.append(int(row[f"What days and times are convenient for you? [{day} {time}]"][0]))
-            d["slots"] = slots
-            d["mosilana"] = row["Are you fine with teaching in Mosilana?"] == "Yes"
-            courses_teach = {}
-            for c in input_courses:
-                courses_teach[c] = int(row[f"What courses would you like to teach? [{c}]"][0])
-            d["courses_teach"] = courses_teach
-            d["courses_attend"] = row["What courses and trainings would you like to attend?"].split(";")
-            for c in d["courses_attend"]:
-                if c in COURSES_IGNORE:
-                    d["courses_attend"].remove(c)
-            for c in d["courses_attend"]:
-                check_course(c)
-            teach_together = row["Who would you like to teach with?"]
-            if teach_together == "":
-                teach_together = []
-            if teach_together:
-                if name == "Janča":
-                    d["teach_together"] = ["Kepo", "Maťo", "Kuba-Š.", "Jarin"]
-                    # TODO what about teaching as lead?
-                elif name == "Jarin":
-                    d["teach_together"] = ["Ilča"]
-                elif name == "Ilča":
-                    d["teach_together"] = ["Kuba-Š.", "Jarin", "Vojta-S."]
-                elif name == "Kuba-B.":
-                    d["teach_together"] = ["Janča", "Ilča", "Lili"]
-                elif name == "Kuba-Š.":
-                    d["teach_together"] = ["Ilča"] # TODO community teachers
-                elif name == "Vojta-S.":
-                    d["teach_together"] = ["Ilča"]
-                elif name in ["Maťo", "Ivča", "Blaženka"]: # "ignore list"
-                    d["teach_together"] = []
-                else:
-                    error(f"Unhandled teach_together preference {name}: {teach_together}")
-            else:
-                d["teach_together"] = []
-
-            d["teach_not_together"] = [translate_teacher_name(x) for x in row["Are there any people you cannot teach with?"].split() if x not in ["-", "No", "není"]]
-            result[name] = d
-    debug(f"Number of lines: {n}")
-    #print(f"Column names: {columns}")
+            C = row["Course"]
+            if C not in Courses:
+                warn(f"{what}: unknown course '{C}', skipping")
+                continue
+            s = slots.index(row["Slot"]) if row["Slot"] in slots else None
+            r = Rooms.get(row["Room"])
+            if s is None or r is None:
+                warn(f"{what}: unknown slot '{row['Slot']}' or room '{row['Room']}' of course '{C}'")
+            Ts = []
+            for T in row["Teachers"].split("+"):
+                if not T:
+                    continue
+                if T not in Teachers:
+                    warn(f"{what}: unknown teacher '{T}' of course '{C}'")
+                    continue
+                Ts.append(Teachers[T])
+            result[Courses[C]] = (s, r, Ts)
+    debug(f"{what}: {len(result)} courses")
     return result
 
-from pprint import pprint
-
-input_data = read_input()
-for t in input_data.keys():
-    if t not in teachers:
-        error(f"teacher name {t} needs translation")
-pprint(input_data)
+def write_schedule(filename, src, tc):
+    with open(filename, mode="w") as f:
+        writer = csv.writer(f)
+        writer.writerow(SCHEDULE_COLUMNS)
+        for (s,r,c) in zip(*np.nonzero(src)):
+            Ts = [teachers[t] for t in np.flatnonzero(tc[:,c])]
+            writer.writerow([courses[c], slots[s], rooms[r], "+".join(Ts)])
 
 # SPECIFIC HARD CONSTRAINTS
 
-# HARD teacher T can teach maximum N courses
-t_util_max = {}
-# teacher T wants to teach N courses
-t_util_ideal = {}
-# HARD teacher T1 must not teach a course with teacher T2
-tt_not_together = []
-# HARD teacher T cannot do anything in slots Ss
-ts_pref = {}
-# teacher T preference about teaching course C (HARD if 0)
-tc_pref = {}
-
-# course C can be taught only by Ts
-ct_possible = {}
-for C in courses:
-    if C not in courses_open:
-        if C.startswith(("LH 1 ", "LH 2 ", "LH 2.5 ", "LH 3 ")):
-            #ct_possible[C] = list(set(teachers) - set(["Standa", "Míša-Z."]))
-            ct_possible[C] = list(set(teachers) - set(["Míša-Z."]))
-        elif C.startswith("LH 4"):
-            ct_possible[C] = list(set(teachers_core) - set(["Peťa", "Standa"]))
-        elif C.startswith("LH 5"):
-            ct_possible[C] = ["Kuba-Š.", "Ilča"]
-        elif C.startswith("Airsteps"):
-            ct_possible[C] = ["Tom-S.", "Janča"]
-        elif C.startswith("Collegiate Shag"):
-            ct_possible[C] = ["Terka", "Lili", "Standa", "Míša-Z."]
-        elif C.startswith("Saint Louis Shag"):
-            ct_possible[C] = ["Terka", "Janča", "Maťo"]
-        elif C.startswith("Balboa"):
-            ct_possible[C] = ["Peťa", "Jarin", "Kuba-Š.", "Pavli", "Ilča", "Poli"]
-        elif C.startswith("Balboa"):
-            ct_possible[C] = ["Peťa", "Jarin", "Kuba-Š.", "Pavli", "Ilča", "Poli"]
-        elif C.startswith("Solo"):
-            ct_possible[C] = ["Kepo", "Kuba-Š.", "Janča", "Pavli"]
-        elif C.startswith("Blues"):
-            ct_possible[C] = ["Tom-K.", "Ilča"]
-        elif C.startswith("SlowBal"):
-            ct_possible[C] = ["Pavli", "Jarin"]
-        elif C.startswith("Teachers Training"):
-            ct_possible[C] = ["Pavli", "Kuba-Š."]
-        elif C.startswith("Shag/Balboa Open Training"):
-            ct_possible[C] = ["Standa"]
-        elif C.startswith("PJ Group"):
-            ct_possible[C] = ["Kepo", "Janča"]
+def load_preferences(input_files, previous_file=None):
+    # preferences form exports and previous schedule -> data used by the model
+    global input_data, previous, t_util_max, t_util_ideal, tt_not_together, ts_pref, tc_pref, ct_possible, tc_forbidden
+    input_data = read_input(input_files)
+    for t in input_data.keys():
+        if t not in teachers:
+            error(f"teacher name {t} needs translation")
+    if VERBOSE:
+        from pprint import pprint
+        pprint(input_data)
+
+    previous = {}
+    if previous_file:
+        previous = read_schedule(previous_file)
+
+
+    # HARD teacher T can teach maximum N courses
+    t_util_max = {}
+    # teacher T wants to teach N courses
+    t_util_ideal = {}
+    # HARD teacher T1 must not teach a course with teacher T2
+    tt_not_together = []
+    # HARD teacher T cannot do anything in slots Ss
+    ts_pref = {}
+    # teacher T preference about teaching course C (HARD if 0)
+    tc_pref = {}
+    # HARD teacher T does not teach course C (preference 0)
+    tc_forbidden = set()
+
+    # course C can be taught only by Ts
+    # course families: (prefixes, Ts), the first matching family counts
+    if INSTANCE:
+        families = [((prefix,), Ts) for (prefix, Ts) in INSTANCE.get("ct_possible", {}).items()]
+    else:
+        families = [
+            (("LH 1 ", "LH 2 ", "LH 2.5 ", "LH 3 "), list(set(teachers) - set(["Míša-Z."]))),
+            #(("LH 1 ", "LH 2 ", "LH 2.5 ", "LH 3 "), list(set(teachers) - set(["Standa", "Míša-Z."]))),
+            (("LH 4",), list(set(teachers_core) - set(["Peťa", "Standa"]))),
+            (("LH 5",), ["Kuba-Š.", "Ilča"]),
+            (("Airsteps",), ["Tom-S.", "Janča"]),
+            (("Collegiate Shag",), ["Terka", "Lili", "Standa", "Míša-Z."]),
+            (("Saint Louis Shag",), ["Terka", "Janča", "Maťo"]),
+            (("Balboa",), ["Peťa", "Jarin", "Kuba-Š.", "Pavli", "Ilča", "Poli"]),
+            (("Solo",), ["Kepo", "Kuba-Š.", "Janča", "Pavli"]),
+            (("Blues",), ["Tom-K.", "Ilča"]),
+            (("SlowBal",), ["Pavli", "Jarin"]),
+            (("Teachers Training",), ["Pavli", "Kuba-Š."]),
+            (("Shag/Balboa Open Training",), ["Standa"]),
+            (("PJ Group",), ["Kepo", "Janča"]),
+        ]
+    c_family = {} # c -> Ts
+    for (prefixes, Ts) in families:
+        for prefix in prefixes:
+            for c in courses_prefixed(prefix):
+                c_family.setdefault(c, Ts)
+    ct_possible = {}
+    for (c, C) in enumerate(courses):
+        if C in courses_open:
+            continue
+        if c in c_family:
+            ct_possible[C] = list(c_family[c])
+        elif INSTANCE:
+            # other courses can be taught by anybody
+            ct_possible[C] = [T for T in teachers if T not in FAKE_TEACHERS]
         else:
             warn(f"No initial set of teachers for course {C}")
+            ct_possible[C] = []
         ct_possible[C] += FAKE_TEACHERS
 
-# translate input data to variables understood by the rest of the script
-for T in input_data:
-    debug(f"Teacher {T}")
-    data = input_data[T]
-    n_max = data["ncourses_max"]
-    t_util_max[T] = n_max
-    if n_max > 0:
-        t_util_ideal[T] = data["ncourses_ideal"]
-        courses_teach = data["courses_teach"]
-        courses_pref = {}
-        for (Cgen, v) in courses_teach.items():
-            for Cspec in courses_regular + courses_solo:
-                if Cspec.startswith(Cgen):
+    # translate input data to variables understood by the rest of the script
+    for T in input_data:
+        debug(f"Teacher {T}")
+        data = input_data[T]
+        n_max = data["ncourses_max"]
+        t_util_max[T] = n_max
+        if n_max > 0:
+            t_util_ideal[T] = data["ncourses_ideal"]
+            courses_teach = data["courses_teach"]
+            courses_pref = {}
+            for (Cgen, v) in courses_teach.items():
+                for c in courses_prefixed(Cgen):
+                    Cspec = courses[c]
+                    if Cspec in courses_open:
+                        continue
                     courses_pref[Cspec] = v
                     if v == 0:
                         # HARD preference
                         if T in ct_possible[Cspec]:
                             ct_possible[Cspec].remove(T)
                             assert(T not in ct_possible[Cspec])
-                    elif v <= 3:
-                        pass
-                    else:
-                        error(f"Unexpected course preference value: teacher {T} course {Cgen} value {v}")
-        tc_pref[T] = courses_pref
-        for d in data["teach_not_together"]:
-            tt_not_together.append((t, d))
-    ts_pref[T] = data["slots"]
-    assert(len(ts_pref[T]) == len(slots))
-    # attendance done directly through input_data
-
-#pprint(ct_possible)
+                            tc_forbidden.add((T, Cspec))
+            tc_pref[T] = courses_pref
+            for d in data["teach_not_together"]:
+                tt_not_together.append((T, d))
+        ts_pref[T] = data["slots"]
+        assert(len(ts_pref[T]) == len(slots))
+        # attendance done directly through input_data
+
+    #pprint(ct_possible)
 
 # course C must not take place in room R
 # TODO improve - some of these actualy fake course-venues constraints
@@ -421,371 +654,266 @@ courses_same = [
     ["PJ Group /1", "PJ Group /3"], # faking two slot class
     ]
 
+# course C must take place in slot S
+courses_slot = {
+    "Teachers Training": "Thursday 20:00-21:10",
+    }
 
-model = cp_model.CpModel()
+# course C must take place on one of the days Ds
+courses_days = {
+    "PJ Group /1": ["Tuesday"],
+    "PJ Group /2": ["Thursday"],
+    }
 
-# VARIABLES
+# nothing else takes place in parallel with these courses
+courses_alone = ["Teachers Training"]
 
-# course C takes place in slot S in room R
-src = {}
-for s in range(len(slots)):
-    for r in range(len(rooms)):
-        for c in range(len(courses)):
-            src[(s,r,c)] = model.NewBoolVar("CSR:s%ir%ic%i" % (s,r,c))
-# course C is taught by teacher T
-tc = {}
-for c in range(len(courses)):
-    for t in range(len(teachers)):
-        tc[(t,c)] = model.NewBoolVar("CT:t%ic%i" % (t,c))
-# teacher T teaches in slot S course C
-tsc = {}
-for s in range(len(slots)):
-    for t in range(len(teachers)):
-        for c in range(len(courses)):
-            tsc[(t,s,c)] = model.NewBoolVar("TS:t%is%ic%i" % (t,s,c))
-# teacher T teaches in slot S
-ts = {}
-for s in range(len(slots)):
-    for t in range(len(teachers)):
-        ts[(t,s)] = model.NewBoolVar("TS:t%is%i" % (t,s))
-# person P attends course C
-ac = {}
-for p in range(len(people)):
-    for c in range(len(courses)):
-        ac[(p,c)] = model.NewBoolVar("")
-# person P teaches or attends course C
-pc = {}
-for p in range(len(people)):
-    for c in range(len(courses)):
-        pc[(p,c)] = model.NewBoolVar("")
-# person P attends or teaches course C in slot S
-psc = {}
-for p in range(len(people)):
-    for s in range(len(slots)):
-        for c in range(len(courses)):
-            psc[(p,s,c)] = model.NewBoolVar("")
-# person P occupied (attends or teaches) in slot S
-ps = {}
-for s in range(len(slots)):
-    for p in range(len(people)):
-        ps[(p,s)] = model.NewBoolVar("PS:p%is%i" % (p,s))
-# teacher T teaches on day D
-td = {}
-for d in range(len(days)):
-    for t in range(len(teachers)):
-        td[(t,d)] = model.NewBoolVar("TD:t%id%i" % (t,d))
-# person P is occupied (teaches or attends courses) on day D
-pd = {}
-for d in range(len(days)):
-    for p in range(len(people)):
-        pd[(p,d)] = model.NewBoolVar("")
-# course C takes place in slot S
-cs = []
-for c in range(len(courses)):
-    cs.append(model.NewIntVar(0, len(slots)-1, ""))
-# room R is in venue V
-rv = []
-for r in range(len(rooms)):
-    rv.append(model.NewIntVar(0, len(venues)-1, ""))
-    model.Add(rv[r] == Venues[rooms_venues[rooms[r]]])
-# teacher T teaches in slot S course C in venue V
-tscv = {}
-for t in range(len(teachers)):
-    for s in range(len(slots)):
-        for c in range(len(courses)):
-            for v in range(len(venues)):
-                tscv[(t,s,c,v)] = model.NewBoolVar("")
+# course C2 takes place right after course C1 (in the same day with courses_same)
+courses_after = [
+    ["Collegiate Shag 2", "Shag/Balboa Open Training"],
+    ]
 
-# teacher T teaches in venue V on day D
-# TODO do it wrt. attending courses - cannot teach in Koliste, attend in Mosilana, and teach again in Koliste
-tdv = {}
-for t in range(len(teachers)):
-    for d in range(len(days)):
-        for v in range(len(venues)):
-            tdv[(t,d,v)] = model.NewBoolVar("")
+# community teachers that must teach
+teachers_must_teach = ["Zuzka", "Vojta-N.", "Míša-L.", "Kuba-B."]
+
+# teacher T wants to teach with Ts (replaces the free text answer of the form)
+teach_together = {
+    "Janča": ["Kepo", "Maťo", "Kuba-Š.", "Jarin"], # TODO what about teaching as lead?
+    "Jarin": ["Ilča"],
+    "Ilča": ["Kuba-Š.", "Jarin", "Vojta-S."],
+    "Kuba-B.": ["Janča", "Ilča", "Lili"],
+    "Kuba-Š.": ["Ilča"], # TODO community teachers
+    "Vojta-S.": ["Ilča"],
+    # "ignore list"
+    "Maťo": [],
+    "Ivča": [],
+    "Blaženka": [],
+}
 
-# teacher T teaches course C in slot S iff course C takes place at slot S and is taught by teacher T
-# inferring CTS info
-for s in range(len(slots)):
+# the built-in instance (instance files use the same keys)
+BUILTIN_INSTANCE = {
+    "days": days,
+    "times": times,
+    "form_days": FORM_DAYS,
+    "form_times": FORM_TIMES,
+    "rooms": rooms,
+    "venues": venues,
+    "rooms_venues": rooms_venues,
+    "venues_preferred": venues_preferred,
+    "teachers": TEACHERS,
+    "fake_teachers": FAKE_TEACHERS,
+    "courses_open": courses_open,
+    "courses_solo": courses_solo,
+    "courses_regular": courses_regular,
+    "teacher_names": TEACHER_NAMES,
+    "cr_not": cr_not,
+    "cr_strict": cr_strict,
+    "tc_strict": tc_strict,
+    "courses_different": courses_different,
+    "courses_diffday": courses_diffday,
+    "courses_same": courses_same,
+    "courses_slot": courses_slot,
+    "courses_days": courses_days,
+    "courses_alone": courses_alone,
+    "courses_after": courses_after,
+    "teachers_must_teach": teachers_must_teach,
+    "teach_together": teach_together,
+}
+# an instance comes with its own rules, these are not taken from the built-in one
+INSTANCE_RULES = ["cr_not", "cr_strict", "tc_strict", "courses_different", "courses_diffday", "courses_same",
+    "courses_slot", "courses_days", "courses_alone", "courses_after", "teachers_must_teach", "teach_together"]
+
+INSTANCE = {}
+
+def load_instance(instance=None):
+    # instance: JSON file name or dict replacing parts of the built-in instance
+    global INSTANCE, days, Days, times, day_times, day_slots, slot_day, slot_time, max_times, slots, Slots, FORM_DAYS, FORM_TIMES, FORM_SLOT_LABELS, rooms, Rooms, venues, Venues, venues_preferred
+    global TEACHERS, FAKE_TEACHERS, teachers, teachers_lead, teachers_follow, teachers_core, teachers_community, Teachers, people
+    global rooms_venues, courses_open, courses_solo, courses_regular, courses, Courses, TEACHER_NAMES
+    global cr_not, cr_strict, tc_strict, courses_different, courses_diffday, courses_same, teachers_must_teach, teach_together
+    global courses_slot, courses_days, courses_alone, courses_after
+    if isinstance(instance, str):
+        with open(instance, mode="r") as f:
+            instance = json.load(f)
+    INSTANCE = instance or {}
+
+    def get(key):
+        if key in INSTANCE:
+            return copy.deepcopy(INSTANCE[key])
+        if INSTANCE and key in INSTANCE_RULES:
+            return type(BUILTIN_INSTANCE[key])()
+        return copy.deepcopy(BUILTIN_INSTANCE[key])
+
+    days = get("days")
+    Days = {}
+    for i, D in enumerate(days):
+        Days[D] = i
+    times = get("times")
+    if isinstance(times, dict):
+        # times of every day
+        for D in days:
+            if not times.get(D):
+                error(f"No times of day {D}")
+        day_times = [times[D] for D in days]
+    else:
+        day_times = [times for D in days]
+    # all times in the order of the days, each one after the times before it in some day
+    times = []
+    for Ts in day_times:
+        i = 0
+        for T in Ts:
+            if T not in times:
+                times.insert(i, T)
+            i = times.index(T) + 1
+    slots = [ d + " " + t for (d, Ts) in zip(days, day_times) for t in Ts ]
+    # slots of day D (consecutive), day and time of slot S
+    day_slots = []
+    for Ts in day_times:
+        start = day_slots[-1].stop if day_slots else 0
+        day_slots.append(range(start, start + len(Ts)))
+    slot_day = [d for (d, ss) in enumerate(day_slots) for s in ss]
+    slot_time = [times.index(T) for Ts in day_times for T in Ts]
+    max_times = max(len(Ts) for Ts in day_times)
+    Slots = {}
+    for i, S in enumerate(slots):
+        Slots[S] = i
+    FORM_DAYS = get("form_days")
+    FORM_TIMES = get("form_times")
+    # "day time" labels of the slots in the form, form_times can also be given per form day
+    if isinstance(FORM_TIMES, dict):
+        FORM_SLOT_LABELS = [f"{D} {H}" for D in FORM_DAYS for H in FORM_TIMES.get(D, [])]
+    else:
+        FORM_SLOT_LABELS = [f"{D} {H}" for D in FORM_DAYS for H in FORM_TIMES]
+    if len(FORM_SLOT_LABELS) != len(slots):
+        error(f"The form has {len(FORM_SLOT_LABELS)} slots, the instance {len(slots)}")
+
+    if "venue_rooms" in INSTANCE and "rooms" not in INSTANCE:
+        # rooms generated from the number of rooms of every venue
+        venues = list(INSTANCE["venue_rooms"])
+        rooms = [f"{V}-{i+1}" for (V, n) in INSTANCE["venue_rooms"].items() for i in range(n)]
+        rooms_venues = {f"{V}-{i+1}": V for (V, n) in INSTANCE["venue_rooms"].items() for i in range(n)}
+    else:
+        rooms = get("rooms")
+        venues = get("venues")
+        rooms_venues = get("rooms_venues")
+    Rooms = {}
+    for i, R in enumerate(rooms):
+        Rooms[R] = i
+    Venues = {}
+    for i, V in enumerate(venues):
+        Venues[V] = i
+    venues_preferred = [V for V in get("venues_preferred") if V in Venues]
+
+    TEACHERS = [tuple(t) for t in get("teachers")]
+    FAKE_TEACHERS = get("fake_teachers")
+    teachers = [t[0] for t in TEACHERS]
+    teachers_lead = [t[0] for t in TEACHERS if t[1] == "lead"]
+    teachers_follow = [t[0] for t in TEACHERS if t[1] == "follow"]
+    assert(set(teachers) == set(teachers_lead + teachers_follow))
+    assert(len(set(teachers_lead) & set(teachers_follow)) == 0)
+    teachers_core = [t[0] for t in TEACHERS if not t[2]]
+    teachers_community = [t[0] for t in TEACHERS if t[2]]
+    debug(f"Core teachers: {teachers_core}")
+    debug(f"Community teachers: {teachers_community}")
+    assert(set(teachers) == set(teachers_core + teachers_community))
+    assert(len(set(teachers_core) & set(teachers_community)) == 0)
+    Teachers = {}
+    for (i, t) in enumerate(teachers):
+        Teachers[t] = i
+    people = teachers
+    TEACHER_NAMES = get("teacher_names")
+
+    courses_open = get("courses_open")
+    courses_solo = get("courses_solo")
+    courses_regular = get("courses_regular")
+    courses = courses_regular + courses_solo + courses_open
+    Courses = {}
+    for (i, c) in enumerate(courses):
+        Courses[c] = i
+
+    cr_not = get("cr_not")
+    cr_strict = get("cr_strict")
+    tc_strict = get("tc_strict")
+    courses_different = get("courses_different")
+    courses_diffday = get("courses_diffday")
+    courses_same = get("courses_same")
+    teachers_must_teach = get("teachers_must_teach")
+    teach_together = get("teach_together")
+    courses_slot = get("courses_slot")
+    courses_days = get("courses_days")
+    courses_alone = get("courses_alone")
+    courses_after = get("courses_after")
+    for (C, S) in courses_slot.items():
+        if S not in Slots:
+            error(f"Unknown slot {S} of course {C}, slots are \"DAY TIME\" of the days and times")
+    for (C, Ds) in courses_days.items():
+        for D in Ds:
+            if D not in Days:
+                error(f"Unknown day {D} of course {C}")
+    build_name_indices()
+
+input_files = []
+previous_file = None
+
+def load_input(filename="input.csv", previous_filename=None):
+    # read the preferences form export(s) (and previous schedule) for the loaded instance
+    global input_files, previous_file
+    import_numpy()
+    input_files = [filename] if isinstance(filename, str) else list(filename)
+    previous_file = previous_filename
+    load_preferences(input_files, previous_filename)
+    build_index_sets()
+    build_analysis_arrays()
+
+
+# INDEX SETS
+
+def build_index_sets():
+    global t_courses, c_teachers, t_slots, p_attend_wish, p_attend, p_courses
+    # --diagnose needs variables for everything the hard rules forbid
+    sparse = SPARSE and not args.diagnose
+    # teacher T can possibly teach course C
+    t_courses = {} # t -> [c]
+    c_teachers = {} # c -> [t]
+    for t in range(len(teachers)):
+        t_courses[t] = []
+    for c in range(len(courses)):
+        c_teachers[c] = []
     for c in range(len(courses)):
-        hit = model.NewBoolVar("") # course C is at slot S
-        model.Add(sum(src[(s,r,c)] for r in range(len(rooms))) == 1).OnlyEnforceIf(hit)
-        model.Add(sum(src[(s,r,c)] for r in range(len(rooms))) == 0).OnlyEnforceIf(hit.Not())
-        model.Add(cs[c] == s).OnlyEnforceIf(hit)
-        model.Add(cs[c] != s).OnlyEnforceIf(hit.Not())
+        C = courses[c]
         for t in range(len(teachers)):
-            model.AddBoolAnd([hit, tc[(t,c)]]).OnlyEnforceIf(tsc[(t,s,c)])
-            model.AddBoolOr([hit.Not(), tc[(t,c)].Not()]).OnlyEnforceIf(tsc[(t,s,c)].Not())
-# inferring TS info
-for s in range(len(slots)):
+            T = teachers[t]
+            if sparse:
+                if C not in ct_possible or T not in ct_possible[C]:
+                    continue
+                if T not in FAKE_TEACHERS and t_util_max.get(T, 0) == 0:
+                    continue
+            t_courses[t].append(c)
+            c_teachers[c].append(t)
+    # teacher T can possibly teach in slot S
+    t_slots = {} # t -> [s]
     for t in range(len(teachers)):
-        model.Add(sum(tsc[(t,s,c)] for c in range(len(courses))) == 1).OnlyEnforceIf(ts[(t,s)])
-        model.Add(sum(tsc[(t,s,c)] for c in range(len(courses))) == 0).OnlyEnforceIf(ts[(t,s)].Not())
-# construct AC info (person P attends course C)
-for p in range(len(people)):
-    if people[p] in input_data:
-        courses_attend = input_data[people[p]]["courses_attend"]
-    else:
-        courses_attend = []
-    for c in range(len(courses)):
-        if [x for x in courses_attend if courses[c].startswith(x)]:
-            model.Add(ac[(p,c)] == 1)
+        T = teachers[t]
+        if sparse and T in ts_pref:
+            t_slots[t] = [s for s in range(len(slots)) if ts_pref[T][s] != 0]
         else:
-            model.Add(ac[(p,c)] == 0)
-# construct PC info (person P attends or teaches course C)
-for p in range(len(people)):
-    for c in range(len(courses)):
-        model.AddBoolOr([tc[(p,c)], ac[(p,c)]]).OnlyEnforceIf(pc[(p,c)])
-        model.AddBoolAnd([tc[(p,c)].Not(), ac[(p,c)].Not()]).OnlyEnforceIf(pc[(p,c)].Not())
-# inferring PSC info - person P attends or teaches course C in slot S
-for s in range(len(slots)):
-    for c in range(len(courses)):
-        hit = model.NewBoolVar("") # course C is at slot S
-        model.Add(cs[c] == s).OnlyEnforceIf(hit)
-        model.Add(cs[c] != s).OnlyEnforceIf(hit.Not())
-        for p in range(len(people)):
-            model.AddBoolAnd([hit, pc[(p,c)]]).OnlyEnforceIf(psc[(p,s,c)])
-            model.AddBoolOr([hit.Not(), pc[(p,c)].Not()]).OnlyEnforceIf(psc[(p,s,c)].Not())
-# inferring PS info - person P attends or teaches course in slot S
-for s in range(len(slots)):
+            t_slots[t] = list(range(len(slots)))
+    # person P wants to attend course C
+    p_attend_wish = {} # p -> set(c)
     for p in range(len(people)):
-        model.Add(sum(psc[(p,s,c)] for c in range(len(courses))) == 1).OnlyEnforceIf(ps[(p,s)])
-        model.Add(sum(psc[(p,s,c)] for c in range(len(courses))) == 0).OnlyEnforceIf(ps[(p,s)].Not())
-# inferring TD info
-for d in range(len(days)):
-    for t in range(len(teachers)):
-        model.Add(sum(ts[(t,s)] for s in range(d*len(times), (d+1)*len(times))) >= 1).OnlyEnforceIf(td[(t,d)])
-        model.Add(sum(ts[(t,s)] for s in range(d*len(times), (d+1)*len(times))) == 0).OnlyEnforceIf(td[(t,d)].Not())
-# inferring PD info
-for d in range(len(days)):
+        p_attend_wish[p] = set()
+        if people[p] in input_data:
+            for x in input_data[people[p]]["courses_attend"]:
+                p_attend_wish[p].update(courses_prefixed(x))
+    # person P can possibly attend course C
+    p_attend = {} # p -> [c]
     for p in range(len(people)):
-        model.Add(sum(ps[(p,s)] for s in range(d*len(times), (d+1)*len(times))) >= 1).OnlyEnforceIf(pd[(p,d)])
-        model.Add(sum(ps[(p,s)] for s in range(d*len(times), (d+1)*len(times))) == 0).OnlyEnforceIf(pd[(p,d)].Not())
-
-# inferring TDV info
-for s in range(len(slots)):
-    for c in range(len(courses)):
-        for v in range(len(venues)):
-            hit = model.NewBoolVar("") # course C is at slot S in venue V
-            model.Add(sum(src[(s,r,c)] for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[v]) == 1).OnlyEnforceIf(hit)
-            model.Add(sum(src[(s,r,c)] for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[v]) == 0).OnlyEnforceIf(hit.Not())
-            for t in range(len(teachers)):
-                model.AddBoolAnd([hit, tc[(t,c)]]).OnlyEnforceIf(tscv[(t,s,c,v)])
-                model.AddBoolOr([hit.Not(), tc[(t,c)].Not()]).OnlyEnforceIf(tscv[(t,s,c,v)].Not())
-for t in range(len(teachers)):
-    for d in range(len(days)):
-        for v in range(len(venues)):
-            model.Add(sum(tscv[(t,s,c,v)] for s in range(d*len(times),(d+1)*len(times)) for c in range(len(courses))) >= 1).OnlyEnforceIf(tdv[(t,d,v)])
-            model.Add(sum(tscv[(t,s,c,v)] for s in range(d*len(times),(d+1)*len(times)) for c in range(len(courses))) == 0).OnlyEnforceIf(tdv[(t,d,v)].Not())
-# inferring CV info
-cv = []
-for c in range(len(courses)):
-    cv.append(model.NewIntVar(0, len(venues)-1, ""))
-    for v in range(len(venues)):
-        hit = model.NewBoolVar("")
-        model.Add(sum(src[(s,r,c)] for s in range(len(slots)) for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[v]) >= 1).OnlyEnforceIf(hit)
-        model.Add(sum(src[(s,r,c)] for s in range(len(slots)) for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[v]) == 0).OnlyEnforceIf(hit.Not())
-        model.Add(cv[c] == v).OnlyEnforceIf(hit)
-        model.Add(cv[c] != v).OnlyEnforceIf(hit.Not())
-
-# number of lessons teacher T teaches
-teach_num = {}
-for t in range(len(teachers)):
-    teach_num[t] = model.NewIntVar(0, len(slots), "Tteach_num:%i" % t)
-    model.Add(teach_num[t] == sum(tc[(t,c)] for c in range(len(courses))))
-# number of slots person P occupies (teaches or attends)
-occupied_num = {}
-for p in range(len(people)):
-    occupied_num[p] = model.NewIntVar(0, len(slots), "")
-    model.Add(occupied_num[p] == sum(ps[(p,s)] for s in range(len(slots))))
-
-# prevent teachers from teaching in two rooms in the same time
-for t in range(len(teachers)):
-    for s in range(len(slots)):
-        model.Add(sum(tsc[(t,s,c)] for c in range(len(courses))) <= 1)
-
-# one course takes place at one time in one room
-for c in range(len(courses)):
-    model.Add(sum(src[(s,r,c)] for s in range(len(slots)) for r in range(len(rooms))) == 1)
-
-# at one time in one room, there is maximum one course
-for s in range(len(slots)):
-    for r in range(len(rooms)):
-        model.Add(sum(src[(s,r,c)] for c in range(len(courses))) <= 1)
-
-# every regular course is taught by two teachers and solo course by one teacher
-for c in range(len(courses)):
-    if courses[c] in courses_regular:
-        model.Add(sum(tc[(Teachers[T],c)] for T in teachers_lead) == 1)
-        model.Add(sum(tc[(Teachers[T],c)] for T in teachers_follow) == 1)
-    elif courses[c] in courses_solo:
-        model.Add(sum(tc[(Teachers[T],c)] for T in teachers) == 1)
-    elif courses[c] in courses_open:
-        model.Add(sum(tc[(Teachers[T],c)] for T in teachers) == 0)
-    else:
-        assert(False)
-
-# SPECIFIC CONSTRAINTS
-
-if False:
-    # unspecified teachers teach arbitrary number of courses
-    for (T, n) in t_util_max.items():
-        model.Add(sum(tc[(Teachers[T],c)] for c in range(len(courses))) <= n)
-else:
-    # unspecified teachers teach no courses
-    for T in teachers:
-        if T not in FAKE_TEACHERS:
-            debug(f"Teacher max: {T} {t_util_max.get(T,-1)}")
-            model.Add(sum(tc[(Teachers[T],c)] for c in range(len(courses))) <= t_util_max.get(T, 0))
-
-# community teachers that must teach
-for T in ["Zuzka", "Vojta-N.", "Míša-L.", "Kuba-B."]:
-    if t_util_max.get(T, 0) >= 1:
-        model.Add(sum(tc[(Teachers[T],c)] for c in range(len(courses))) >= 1)
-    else:
-        warn(f"community teacher {T} should teach, but has not utilization preferences")
-
-if tc_strict:
-    debug("strict assignments present")
-    strict_assignments = []
-    for (T, Cs) in tc_strict.items():
-        t = Teachers[T]
-        for C in Cs:
-            c = Courses[C]
-            strict_assignments.append(tc[(t,c)])
-    model.AddBoolAnd(strict_assignments)
-
-teachers_all = set(range(len(teachers)))
-for (C, Ts) in ct_possible.items():
-    c = Courses[C]
-    teachers_can = []
-    for T in Ts:
-        t = Teachers[T]
-        teachers_can.append(t)
-    teachers_not = teachers_all - set(teachers_can)
-    # no other teacher can teach C
-    model.Add(sum(tc[(t,c)] for t in teachers_not) == 0)
-
-for T1, T2 in tt_not_together:
-    for c in range(len(courses)):
-        model.Add(sum(tc[(t,c)] for t in [Teachers[T1], Teachers[T2]]) < 2)
-
-# TODO: this should be loosened, also wrt. attending
-# teacher T does not teach in two venues in the same day
-for t in range(len(teachers)):
-    for d in range(len(days)):
-        model.Add(sum(tdv[(t,d,v)] for v in range(len(venues))) <= 1)
-
-# strict courses schedule
-# Teachers training must be at Thursday evening
-model.Add(cs[Courses["Teachers Training"]] == 11)
-# nothing else happens in parallel with Teachers Training
-model.Add(sum(src[(11,r,c)] for r in range(len(rooms)) for c in range(len(courses))) == 1)
-# Shag/Balboa open is AFTER Collegiate Shag 2 (combined with courses_same
-model.Add(cs[Courses["Collegiate Shag 2"]]+1 == cs[Courses["Shag/Balboa Open Training"]])
-# PJ training must happen on Tuesday and Thursday
-model.Add(cs[Courses["PJ Group /1"]] >= 3)
-model.Add(cs[Courses["PJ Group /1"]] <= 5)
-model.Add(cs[Courses["PJ Group /2"]] >= 9)
-model.Add(cs[Courses["PJ Group /2"]] <= 11)
-
-# teachers HARD slot preferences
-for T in teachers:
-    if T in ts_pref: # TODO what about people without preferences?
-        for s, v in enumerate(ts_pref[T]):
-            if v == 0:
-                model.Add(ts[(Teachers[T], s)] == 0)
-
-# same courses should not happen in same days and also not in same times
-# it should probably not be a strict limitation, but it is much easier to write
-for Cs in courses_different:
-    daylist = [] # days
-    timelist = [] # times
-    assert(2 <= len(Cs) <= min(len(days), len(times)))
-    for C in Cs:
-        day = model.NewIntVar(0, len(days)-1, "")
-        time = model.NewIntVar(0, len(times)-1, "")
-        model.AddDivisionEquality(day, cs[Courses[C]], len(times))
-        model.AddModuloEquality(time, cs[Courses[C]], len(times))
-        daylist.append(day)
-        timelist.append(time)
-    model.AddAllDifferent(daylist)
-    model.AddAllDifferent(timelist)
-
-# courses that should not happen in same days
-for Cs in courses_diffday:
-    daylist = [] # days
-    assert(2 <= len(Cs) <= len(days))
-    for C in Cs:
-        day = model.NewIntVar(0, len(days)-1, "")
-        model.AddDivisionEquality(day, cs[Courses[C]], len(times))
-        model.AddModuloEquality(time, cs[Courses[C]], len(times))
-        daylist.append(day)
-    model.AddAllDifferent(daylist)
-
-# courses that should follow each other in the same day in the same venue
-for Cs in courses_same:
-    daylist = [] # days
-    timelist = [] # times
-    venuelist = [] # venues
-    assert(2 <= len(Cs) <= len(times))
-    for C in Cs:
-        day = model.NewIntVar(0, len(days)-1, "")
-        time = model.NewIntVar(0, len(times)-1, "")
-        venue = model.NewIntVar(0, len(venues)-1, "")
-        model.AddDivisionEquality(day, cs[Courses[C]], len(times))
-        model.AddModuloEquality(time, cs[Courses[C]], len(times))
-        model.Add(venue == cv[Courses[C]])
-        daylist.append(day)
-        timelist.append(time)
-        venuelist.append(venue)
-    model.AddAllowedAssignments(daylist, [[d] * len(Cs) for d in range(len(days))])
-    model.AddAllowedAssignments(venuelist, [[v] * len(Cs) for v in range(len(venues))])
-    if len(Cs) == len(times):
-        # filling whole day
-        model.AddAllDifferent(timelist)
-    elif len(Cs) == len(times) - 1:
-        # filling 2 out of three slots
-        assert(len(Cs) == 2)
-        model.AddAllowedAssignments(timelist, [ [0,1], [1,0], [1,2], [2,1] ])
-    else:
-        # should not happen
-        assert(False)
-
-for (C, R) in cr_not.items():
-    model.Add(sum(src[(s,Rooms[R],Courses[C])] for s in range(len(slots))) == 0)
-
-for (C, R) in cr_strict.items():
-    model.Add(sum(src[(s,Rooms[R],Courses[C])] for s in range(len(slots))) == 1)
-
-# community teachers must teach max 2 courses
-for T in teachers_community:
-    model.Add(sum(tc[(Teachers[T],c)] for c in range(len(courses))) <= 2)
-# community teachers must teach together with core teachers
-for C in courses_regular:
-    model.Add(sum(tc[(Teachers[T],Courses[C])] for T in teachers_community) <= 1)
-# community teachers cannot teach solo courses
-for C in courses_solo:
-    model.Add(sum(tc[(Teachers[T],Courses[C])] for T in teachers_community) == 0)
-
-
-# Rather specific constraints:
-
-# Damian
-damian = True
-if damian and t_util_max.get("Pavli", 0) >= 2 and t_util_max.get("Tom-K.", 0) >= 1:
-    model.Add(sum(tc[(Teachers["Tom-K."],c)] for c in range(len(courses))) == 1)
-    model.Add(sum(tc[(Teachers["Pavli"],c)] for c in range(len(courses))) == 2)
-    model.Add(sum(tscv[(Teachers["Tom-K."],s,c,Venues["mosilana"])] for s in range(len(slots)) for c in range(len(courses))) == 0)
-    model.Add(sum(tscv[(Teachers["Pavli"],s,c,Venues["mosilana"])] for s in range(len(slots)) for c in range(len(courses))) == 0)
-    damianday = model.NewIntVar(0, len(days)-1, "damianday")
-    for d in range(len(days)):
-        hit = model.NewBoolVar("")
-        model.Add(damianday == d).OnlyEnforceIf(hit)
-        model.Add(damianday != d).OnlyEnforceIf(hit.Not())
-        model.Add(ts[(Teachers["Tom-K."],d*len(times)+0)] == 1).OnlyEnforceIf(hit)
-        model.Add(ts[(Teachers["Pavli"],d*len(times)+1)] == 1).OnlyEnforceIf(hit)
-        model.Add(ts[(Teachers["Pavli"],d*len(times)+2)] == 1).OnlyEnforceIf(hit)
+        p_attend[p] = sorted(p_attend_wish[p]) if sparse else list(range(len(courses)))
+    # person P can possibly teach or attend course C
+    p_courses = {} # p -> [c]
+    for p in range(len(people)):
+        p_courses[p] = sorted(set(t_courses[p]) | set(p_attend[p]))
+    debug(f"Sparse: {sum(len(x) for x in t_courses.values())} teacher-course pairs, {sum(len(x) for x in t_slots.values())} teacher-slot pairs")
 
 # OPTIMIZATION
 
@@ -803,391 +931,1645 @@ PENALTIES = {
     "attend_free": 100,
     "teach_together": 100,
     "faketeachers": 100000,
+    "stability": 100, # only with --previous
+}
+# penalties depending only on who teaches what (phase 1 of --two-phase)
+PENALTIES_ASSIGNMENT = [
+    "utilization",
+    "coursepref_bad",
+    "coursepref_slight",
+    "teach_together",
+    "faketeachers",
+]
+# penalties decided by the assignment and the days and venues of the courses
+# (the master of --decompose, attend_free as the rules leave only teaching the
+# course itself)
+PENALTIES_MASTER = PENALTIES_ASSIGNMENT + ["days", "occupied_days", "mosilana", "attend_free"]
+
+# how penalties are encoded in the model: "reified" (reified linear constraints,
+# abs/division/multiplication equalities) or "compact" (element tables for the
+# squares, clauses and counted literals on existing variables); the other
+# penalties are linear sums already
+ENCODINGS = ["reified", "compact"]
+PENALTIES_ENCODING = {
+    "utilization": "compact",
+    "days": "compact",
+    "occupied_days": "compact",
+    "split": "compact",
+    "attend_free": "compact",
+    "teach_together": "compact",
 }
 
-penalties = {} # penalties data (model variables)
-penalties_analysis = {} # deeper analysis functions for penalties
-
-for (name, coeff) in PENALTIES.items():
-    if coeff == 0:
-        warn(f"Penalties: skipping '{name}'")
-        continue
-    if name == "utilization":
-        # teaching should be as close to preferences as possible
-        penalties_utilization = []
-        for T in t_util_ideal:
-            t = Teachers[T]
-            util_ideal = t_util_ideal[T]
-            MAX_DIFF = 10 # set according to preferences form
-            min_diff = -MAX_DIFF
-            max_diff = MAX_DIFF
-            util_diff = model.NewIntVar(min_diff, max_diff, "")
-            model.Add(util_diff == teach_num[t] - util_ideal)
-            util_diff_abs = model.NewIntVar(0, abs(MAX_DIFF), "")
-            model.AddAbsEquality(util_diff_abs, util_diff)
-            util_diff_abs_sq = model.NewIntVar(0, abs(MAX_DIFF)**2, "")
-            model.AddMultiplicationEquality(util_diff_abs_sq, [util_diff_abs, util_diff_abs])
-            penalties_utilization.append(util_diff_abs_sq)
-        penalties[name] = penalties_utilization
-        def analysis(src, tc):
-            result = []
-            for T in teachers:
-                if T in t_util_ideal:
-                    t = Teachers[T]
-                    util_ideal = t_util_ideal[T]
-                    util_real = sum(tc[(t,c)] for c in range(len(courses)))
-                    if util_real != util_ideal:
-                        debug(f"analysis utilization - {T} wanted {util_ideal}, teaches {util_real}")
-                        result.append(f"{T}/{util_real}r-{util_ideal}i")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "days":
-        # nobody should come more days then necessary
-        penalties_days = []
-        for t in range(len(teachers)):
-            teaches_days = model.NewIntVar(0, len(days), "TD:%i" % t)
-            model.Add(teaches_days == sum(td[(t,d)] for d in range(len(days))))
-            teaches_minus_1 = model.NewIntVar(0, len(days), "Tm1:%i" % t)
-            teaches_some = model.NewBoolVar("Ts:%i" % t)
-            model.Add(teach_num[t] >= 1).OnlyEnforceIf(teaches_some)
-            model.Add(teach_num[t] == 0).OnlyEnforceIf(teaches_some.Not())
-            model.Add(teaches_minus_1 == teach_num[t] - 1).OnlyEnforceIf(teaches_some)
-            model.Add(teaches_minus_1 == 0).OnlyEnforceIf(teaches_some.Not())
-            should_teach_days = model.NewIntVar(0, len(days), "TDs:%i" % t)
-            model.AddDivisionEquality(should_teach_days, teaches_minus_1, len(times)) # -1 to compensate rounding down
-            days_extra = model.NewIntVar(0, len(days), "Tdd:%i" % t)
-            model.Add(days_extra == teaches_days - should_teach_days - 1).OnlyEnforceIf(teaches_some) # -1 to compensate rounding down
-            model.Add(days_extra == 0).OnlyEnforceIf(teaches_some.Not())
-            days_extra_sq = model.NewIntVar(0, len(days)**2, "Tdds:%i" % t)
-            model.AddMultiplicationEquality(days_extra_sq, [days_extra, days_extra])
-            penalties_days.append(days_extra_sq)
-        penalties[name] = penalties_days
-        def analysis(src, tc):
-            result = []
-            for t in range(len(teachers)):
-                cs = []
+# stages of --lexicographic, each stage is minimized with the optimum of the
+# previous ones fixed; penalties not listed form the last stage
+PENALTIES_STAGES = [
+    ["faketeachers"],
+    ["slotpref_bad", "coursepref_bad", "split", "mosilana", "days"],
+]
+
+# PENALTIES ANALYSIS
+# deeper analysis functions for penalties (work on solution values only)
+# a solution is a pair of arrays: src[s,r,c] (course C in slot S and room R)
+# and tc[t,c] (teacher T teaches course C)
+
+def build_analysis_arrays():
+    global util_ideal_array, ts_pref_array, tc_pref_array, pc_attend_array, tc_possible_array
+    # teacher T wants to teach N courses (-1 if unknown)
+    util_ideal_array = np.array([t_util_ideal.get(T, -1) for T in teachers], dtype=int)
+    # teacher T slot preferences (-1 if unknown)
+    ts_pref_array = np.array([ts_pref.get(T, [-1] * len(slots)) for T in teachers], dtype=int).reshape(len(teachers), len(slots))
+    # teacher T preference about teaching course C (-1 if unknown)
+    tc_pref_array = np.array([[tc_pref.get(T, {}).get(C, -1) for C in courses] for T in teachers], dtype=int).reshape(len(teachers), len(courses))
+    tc_pref_array[:, [Courses[C] for C in courses_open]] = -1
+    # person P wants to attend course C
+    pc_attend_array = np.zeros((len(people), len(courses)), dtype=np.int8)
+    for p in range(len(people)):
+        pc_attend_array[p, sorted(p_attend_wish[p])] = 1
+    # teacher T can teach course C (ct_possible)
+    tc_possible_array = np.ones((len(teachers), len(courses)), dtype=bool)
+    for (C, Ts) in ct_possible.items():
+        tc_possible_array[:, Courses[C]] = False
+        tc_possible_array[[Teachers[T] for T in Ts], Courses[C]] = True
+
+def person_slots(src, pc):
+    # number of courses (from pc[p,c]) person P has in slot S
+    return pc.astype(int) @ src.sum(axis=1).T
+
+def per_day(ps):
+    # [p,s] -> [p,d,i] for the i-th time of day D, shorter days are padded with zeros
+    result = np.zeros((ps.shape[0], len(days), max_times), dtype=ps.dtype)
+    for (d, ss) in enumerate(day_slots):
+        result[:, d, :len(ss)] = ps[:, ss.start:ss.stop]
+    return result
+
+def day_time_slot(d, i):
+    # slot of time I on day D, None if the day does not have that time
+    if times[i] not in day_times[d]:
+        return None
+    return day_slots[d].start + day_times[d].index(times[i])
+
+def days_needed(n):
+    # fewest days with N lessons (one per slot), N is at most len(slots)
+    sizes = sorted((len(ss) for ss in day_slots), reverse=True)
+    return next(k for k in range(len(days)+1) if sum(sizes[:k]) >= n)
+
+def analysis_utilization(src, tc):
+    result = []
+    util_real = tc.sum(axis=1)
+    for t in np.flatnonzero((util_ideal_array >= 0) & (util_real != util_ideal_array)):
+        debug(f"analysis utilization - {teachers[t]} wanted {util_ideal_array[t]}, teaches {util_real[t]}")
+        result.append(f"{teachers[t]}/{util_real[t]}r-{util_ideal_array[t]}i")
+    return result
+
+def analysis_days(src, tc):
+    result = []
+    n_courses = tc.sum(axis=1)
+    n_days = per_day(person_slots(src, tc)).any(axis=2).sum(axis=1)
+    for t in np.flatnonzero(n_days > [days_needed(n) for n in n_courses]):
+        result.append(f"{teachers[t]} {n_courses[t]}c/{n_days[t]}d")
+    return result
+
+def analysis_occupied_days(src, tc):
+    result = []
+    occupied = tc | pc_attend_array
+    n_courses = occupied.sum(axis=1)
+    n_days = per_day(person_slots(src, occupied)).any(axis=2).sum(axis=1)
+    for p in np.flatnonzero(n_days > [days_needed(n) for n in n_courses]):
+        result.append(f"{people[p]} {n_courses[p]}c/{n_days[p]}d")
+    return result
+
+def analysis_split(src, tc):
+    result = []
+    taught = per_day(person_slots(src, tc)) >= 1
+    # free times with a lesson before and after them in the same day
+    before = np.logical_or.accumulate(taught, axis=2)
+    after = np.logical_or.accumulate(taught[:,:,::-1], axis=2)[:,:,::-1]
+    n = (before[:,:,:-2] & ~taught[:,:,1:-1] & after[:,:,2:]).sum(axis=(1,2))
+    for t in np.flatnonzero(n):
+        result.append(f"{teachers[t]}/{n[t]}")
+    return result
+
+def analysis_slotpref(src, tc, name, value, other_values):
+    # slots with preference value taught by teachers who also have better slots
+    result = []
+    bad = (person_slots(src, tc) >= 1) & (ts_pref_array == value)
+    for t in np.flatnonzero(bad.any(axis=1)):
+        prefs = set(ts_pref_array[t])
+        if not any({value, v} <= prefs for v in other_values):
+            continue
+        bad_slots = np.flatnonzero(bad[t])
+        debug(f"analysis {name} - teacher {teachers[t]} courses {np.flatnonzero(tc[t]).tolist()} bad_slots {bad_slots.tolist()}")
+        result.append(f"{teachers[t]}/{len(bad_slots)}-{','.join([str(s) for s in bad_slots])}")
+    return result
+
+def analysis_slotpref_bad(src, tc):
+    return analysis_slotpref(src, tc, "slotpref_bad", 1, [2, 3])
+
+def analysis_slotpref_slight(src, tc):
+    return analysis_slotpref(src, tc, "slotpref_slight", 2, [3])
+
+def analysis_coursepref(src, tc, name, value, required_values):
+    # taught courses with preference value by teachers who strongly prefer some courses over others
+    result = []
+    bad = (tc == 1) & (tc_pref_array == value)
+    for t in np.flatnonzero(bad.any(axis=1)):
+        T = teachers[t]
+        spv = set(tc_pref[T].values())
+        if not all(r <= spv for r in required_values):
+            continue
+        courses_bad = [courses[c] for c in np.flatnonzero(bad[t])]
+        debug(f"analysis {name} - teacher {T} courses {courses_bad}")
+        result.append(f"{T}/{len(courses_bad)}")
+    return result
+
+def analysis_coursepref_bad(src, tc):
+    return analysis_coursepref(src, tc, "coursepref_bad", 1, [{1,2}, {1,3}])
+
+def analysis_coursepref_slight(src, tc):
+    return analysis_coursepref(src, tc, "coursepref_slight", 2, [{2,3}])
+
+def analysis_teach_together(src, tc):
+    result = []
+    for T in [T for T in input_data if input_data[T]["teach_together"]]:
+        t = Teachers[T]
+        teachers_prefered = [Teachers[To] for To in input_data[T]["teach_together"]]
+        # courses of T taught together with some prefered teacher
+        success = tc[t] & tc[teachers_prefered].any(axis=0)
+        debug(f"analysis teach_together: teacher {T} success_courses {[courses[c] for c in np.flatnonzero(success)]}")
+        if not success.any():
+            result.append(f"{T}")
+    return result
+
+def analysis_stability(src, tc):
+    result = []
+    for (c, (s, r, prev_ts)) in previous.items():
+        if (s is not None and r is not None) and not src[(s,r,c)]:
+            result.append(f"{courses[c]}/moved")
+        if [t for t in prev_ts if not tc[(t,c)]]:
+            result.append(f"{courses[c]}/teachers")
+    return result
+
+penalties_analysis = {
+    "utilization": analysis_utilization,
+    "days": analysis_days,
+    "occupied_days": analysis_occupied_days,
+    "split": analysis_split,
+    "slotpref_bad": analysis_slotpref_bad,
+    "slotpref_slight": analysis_slotpref_slight,
+    "coursepref_bad": analysis_coursepref_bad,
+    "coursepref_slight": analysis_coursepref_slight,
+    "teach_together": analysis_teach_together,
+    "stability": analysis_stability,
+}
+
+# SCHEDULE VERIFIER
+# independent check of a schedule (solution arrays, no model needed): every
+# hard rule of construct_model() (violations named like the rules of
+# --diagnose) and the exact value of every penalty
+
+def courses_attend_free():
+    # course C -> teachers who want to attend it (attend_free)
+    result = {}
+    for T in input_data:
+        for C in input_data[T]["courses_attend"]:
+            if C in Courses:
+                result.setdefault(C, []).append(T)
+    return result
+
+def verify_schedule(src, tc):
+    # (violated rules, penalties as solution_values() returns them)
+    violations = []
+    placed = src.sum(axis=(0,1)) == 1
+    def check(ok, name, cc=()):
+        # rules on the placement of courses CC only hold for placed courses
+        if not ok and placed[list(cc)].all():
+            violations.append(name)
+
+    for c in np.flatnonzero(~placed):
+        violations.append(f"{courses[c]} takes place once (found {src[:,:,c].sum()} times)")
+    c_slot = src.sum(axis=1).argmax(axis=0)
+    c_room = src.sum(axis=0).argmax(axis=0)
+    c_day = np.array(slot_day)[c_slot]
+    c_time = np.array(slot_time)[c_slot]
+    c_pos = c_slot - np.array([day_slots[d].start for d in c_day]) # position within the day
+    c_venue = np.array([Venues[rooms_venues[R]] for R in rooms])[c_room]
+    n = tc.sum(axis=1) # courses of teacher T
+    ts_num = person_slots(src, tc) # courses of teacher T in slot S
+    ts = ts_num >= 1
+
+    # clashes
+    for (s, r) in zip(*np.nonzero(src.sum(axis=2) > 1)):
+        violations.append(f"one course in {rooms[r]} at {slots[s]}")
+    for (t, s) in zip(*np.nonzero(ts_num > 1)):
+        violations.append(f"{teachers[t]} teaches one course at {slots[s]}")
+    # (the model counts teaching and wished attendance of a person together)
+    ps_num = person_slots(src, tc | pc_attend_array)
+    for (p, s) in zip(*np.nonzero((ps_num > 1) & (ts_num <= 1))):
+        violations.append(f"{people[p]} teaches or attends one course at {slots[s]}")
+
+    # course teachers
+    lead = tc[[Teachers[T] for T in teachers_lead]].sum(axis=0)
+    follow = tc[[Teachers[T] for T in teachers_follow]].sum(axis=0)
+    community = tc[[Teachers[T] for T in teachers_community]].sum(axis=0)
+    c_num = tc.sum(axis=0)
+    for C in courses_regular:
+        c = Courses[C]
+        check(lead[c] == 1 and follow[c] == 1, f"{C} has its teachers")
+        check(community[c] <= 1, f"{C} has a core teacher")
+    for C in courses_solo:
+        c = Courses[C]
+        check(c_num[c] == 1, f"{C} has its teachers")
+        check(community[c] == 0, f"{C} has no community teacher")
+    for C in courses_open:
+        check(c_num[Courses[C]] == 0, f"{C} has its teachers")
+
+    # teachers
+    for T in teachers:
+        if T not in FAKE_TEACHERS:
+            check(n[Teachers[T]] <= t_util_max.get(T, 0), f"{T} teaches at most {t_util_max.get(T, 0)} courses")
+    for T in teachers_must_teach:
+        if t_util_max.get(T, 0) >= 1:
+            check(n[Teachers[T]] >= 1, f"{T} must teach")
+    for T in teachers_community:
+        check(n[Teachers[T]] <= 2, f"{T} teaches at most 2 courses (community teacher)")
+    for (T, Cs) in tc_strict.items():
+        for C in Cs:
+            check(tc[Teachers[T], Courses[C]], f"{T} teaches {C} (strict assignment)")
+    for (t, c) in zip(*np.nonzero(tc & ~tc_possible_array)):
+        if (teachers[t], courses[c]) in tc_forbidden:
+            violations.append(f"{teachers[t]} does not teach {courses[c]} (course preference 0)")
+        else:
+            violations.append(f"{teachers[t]} cannot teach {courses[c]} (teachers of the course)")
+    for (T1, T2) in tt_not_together:
+        check(not (tc[Teachers[T1]] & tc[Teachers[T2]]).any(), f"{T1} and {T2} do not teach together")
+    for (t, s) in zip(*np.nonzero(ts & (ts_pref_array == 0))):
+        violations.append(f"{teachers[t]} cannot teach {slots[s]} (slot preference 0)")
+    # teacher T teaches on day D in venue V
+    cdv = np.zeros((len(courses), len(days), len(venues)), dtype=int)
+    cdv[placed, c_day[placed], c_venue[placed]] = 1
+    tdv = (tc.astype(int) @ cdv.reshape(len(courses), -1)).reshape(len(teachers), len(days), len(venues)) >= 1
+    for t in np.flatnonzero((tdv.sum(axis=2) > 1).any(axis=1)):
+        violations.append(f"{teachers[t]} teaches in one venue a day")
+
+    # course placement
+    for (C, S) in courses_slot.items():
+        check(c_slot[Courses[C]] == Slots[S], f"{C} is at {S}", [Courses[C]])
+    for (C, Ds) in courses_days.items():
+        check(days[c_day[Courses[C]]] in Ds, f"{C} is on {' or '.join(Ds)}", [Courses[C]])
+    for C in courses_alone:
+        check(src[c_slot[Courses[C]]].sum() == 1, f"nothing in parallel with {C}", [Courses[C]])
+    for (C1, C2) in courses_after:
+        check(c_slot[Courses[C1]] + 1 == c_slot[Courses[C2]] and c_day[Courses[C1]] == c_day[Courses[C2]], f"{C2} follows {C1}", [Courses[C1], Courses[C2]])
+    for Cs in courses_different:
+        cc = [Courses[C] for C in Cs]
+        check(len(set(c_day[cc])) == len(cc), f"{', '.join(Cs)} are on different days", cc)
+        check(len(set(c_time[cc])) == len(cc), f"{', '.join(Cs)} are at different times", cc)
+    for Cs in courses_diffday:
+        cc = [Courses[C] for C in Cs]
+        check(len(set(c_day[cc])) == len(cc), f"{', '.join(Cs)} are on different days", cc)
+    for Cs in courses_same:
+        cc = [Courses[C] for C in Cs]
+        check(len(set(c_day[cc])) == 1 and len(set(c_venue[cc])) == 1 and len(set(c_pos[cc])) == len(cc)
+            and c_pos[cc].max() - c_pos[cc].min() <= len(cc) - 1, f"{', '.join(Cs)} follow each other", cc)
+    for (C, R) in cr_not.items():
+        check(c_room[Courses[C]] != Rooms[R], f"{C} is not in {R}", [Courses[C]])
+    for (C, R) in cr_strict.items():
+        check(c_room[Courses[C]] == Rooms[R], f"{C} is in {R}", [Courses[C]])
+
+    # Damian
+    if t_util_max.get("Pavli", 0) >= 2 and t_util_max.get("Tom-K.", 0) >= 1 and "mosilana" in Venues and max_times >= 3:
+        (tom, pavli) = (Teachers["Tom-K."], Teachers["Pavli"])
+        day_ts = per_day(ts)
+        check(n[tom] == 1 and n[pavli] == 2 and not tdv[[tom, pavli], :, Venues["mosilana"]].any()
+            and (day_ts[tom, :, 0] & day_ts[pavli, :, 1] & day_ts[pavli, :, 2]).any(), "Damian")
+
+    # PENALTIES
+    values = {}
+    def extra_days(num, occupied):
+        # squared days over the minimum needed for NUM lessons
+        needed = np.array([days_needed(n) for n in num])
+        return int(((per_day(occupied).any(axis=2).sum(axis=1) - needed)**2).sum())
+    known = util_ideal_array >= 0
+    values["utilization"] = int(((n - util_ideal_array)[known]**2).sum())
+    values["days"] = extra_days(n, ts)
+    ps = ps_num >= 1
+    values["occupied_days"] = extra_days(ps.sum(axis=1), ps)
+    taught = per_day(ts)
+    before = np.logical_or.accumulate(taught, axis=2)
+    after = np.logical_or.accumulate(taught[:,:,::-1], axis=2)[:,:,::-1]
+    values["split"] = int((before[:,:,:-2] & ~taught[:,:,1:-1] & after[:,:,2:]).sum())
+    def has(prefs, v):
+        return (prefs == v).any(axis=1)
+    slot_bad = has(ts_pref_array, 1) & (has(ts_pref_array, 2) | has(ts_pref_array, 3))
+    values["slotpref_bad"] = int((ts & (ts_pref_array == 1))[slot_bad].sum())
+    slot_slight = has(ts_pref_array, 2) & has(ts_pref_array, 3)
+    values["slotpref_slight"] = int((ts & (ts_pref_array == 2))[slot_slight].sum())
+    course_bad = has(tc_pref_array, 1) & has(tc_pref_array, 2) & has(tc_pref_array, 3)
+    values["coursepref_bad"] = int(((tc == 1) & (tc_pref_array == 1))[course_bad].sum())
+    course_slight = has(tc_pref_array, 2) & has(tc_pref_array, 3)
+    values["coursepref_slight"] = int(((tc == 1) & (tc_pref_array == 2))[course_slight].sum())
+    values["faketeachers"] = int(n[[Teachers[T] for T in FAKE_TEACHERS if T in Teachers]].sum())
+    rooms_preferred = [r for r in range(len(rooms)) if rooms_venues[rooms[r]] in venues_preferred]
+    capacity = len(slots) * len(rooms_preferred) - len(courses_alone) * max(len(rooms_preferred) - 1, 0)
+    values["mosilana"] = int(capacity - src[:, rooms_preferred, :].sum())
+    attend = courses_attend_free()
+    values["attend_free"] = 0
+    for (C, Ts) in attend.items():
+        busy = ts[[Teachers[T] for T in Ts], c_slot[Courses[C]]]
+        values["attend_free"] += int(busy.sum())
+        if PENALTIES["attend_free"] != 0:
+            check(not busy.all(), f"not all of {', '.join(Ts)} teach during {C}", [Courses[C]])
+    values["teach_together"] = 0
+    for T in [T for T in input_data if input_data[T]["teach_together"]]:
+        others = [Teachers[To] for To in input_data[T]["teach_together"]]
+        values["teach_together"] += int(not (tc[Teachers[T]] & tc[others].any(axis=0)).any())
+    values["stability"] = 0
+    for (c, (s, r, prev_ts)) in previous.items():
+        values["stability"] += int((s is not None and c_slot[c] != s) or (r is not None and c_room[c] != r))
+        values["stability"] += int(any(not tc[t, c] for t in prev_ts))
+
+    penalties = {}
+    for (name, coeff) in PENALTIES.items():
+        if coeff != 0 and (name != "stability" or previous):
+            penalties[name] = (coeff, values[name])
+    return (violations, penalties)
+
+def check_schedule(result_src, result_tc, result_penalties, what):
+    # warn about violated rules and penalties the verifier computes differently, returns True if none
+    (violations, penalties) = verify_schedule(result_src, result_tc)
+    for name in violations:
+        warn(f"{what}: violated rule: {name}")
+    for (name, value) in penalties.items():
+        if tuple(result_penalties.get(name, ())) != value:
+            warn(f"{what}: penalty {name} is {tuple(result_penalties.get(name, ()))}, verifier computes {value}")
+    return not violations and {name: tuple(value) for (name, value) in result_penalties.items()} == penalties
+
+def verify_file(filename):
+    # --verify: check a schedule written by --output and print its penalties
+    (result_src, result_tc) = schedule_arrays(read_schedule(filename, "Verified schedule"))
+    (violations, penalties) = verify_schedule(result_src, result_tc)
+    print_solution(result_src, result_tc, penalties)
+    for name in violations:
+        print(f"Violated rule: {name}")
+    if violations:
+        error(f"Schedule {filename} violates {len(violations)} rules")
+    print(f"Schedule {filename} satisfies all rules")
+
+# MODEL CACHE
+# the built model together with the variable maps needed to decode solutions,
+# stored under a hash of everything the model is built from
+
+def model_cache_key():
+    h = hashlib.sha256()
+    h.update(ortools.__version__.encode())
+    h.update(repr((args.formulation, SPARSE, args.diagnose, args.symmetry_breaking, [penalty_encoding(name) for name in PENALTIES])).encode())
+    h.update(repr(sorted(PENALTIES.items())).encode()) # coefficients changed in memory
+    h.update(json.dumps(INSTANCE, sort_keys=True).encode())
+    h.update(repr([globals()[name] for name in INSTANCE_RULES]).encode()) # rules changed in memory
+    for filename in [__file__] + input_files + [previous_file]:
+        if filename:
+            with open(filename, mode="rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+def var_indices(d):
+    return {k: x.Index() for (k, x) in d.items()}
+
+def expr_indices(e):
+    # linear expression -> ({variable index: coefficient}, constant)
+    if isinstance(e, int):
+        return ({}, e)
+    (coeffs, constant) = e.GetIntegerVarValueMap()
+    return ({x.Index(): coeff for (x, coeff) in coeffs.items()}, constant)
+
+def save_model(filename):
+    data = {
+        "proto": model.Proto().SerializeToString(),
+        "src": var_indices(src),
+        "tc": var_indices(tc),
+        "ts": var_indices(ts),
+        "cs": [x.Index() for x in cs],
+        "channels": var_indices(channels),
+        "teach_num": var_indices(teach_num),
+        "ps": var_indices(ps),
+        "pd": var_indices(pd),
+        "occupied_num": var_indices(occupied_num),
+        "penalties": {name: [expr_indices(e) for e in l] for (name, l) in penalties.items()},
+        "guards": var_indices(guards),
+    }
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + ".tmp", mode="wb") as f:
+        pickle.dump(data, f)
+    os.replace(filename + ".tmp", filename)
+    debug(f"Model cache: saved {filename}")
+
+def load_model(filename):
+    with open(filename, mode="rb") as f:
+        data = pickle.load(f)
+    m = cp_model.CpModel()
+    m.Proto().ParseFromString(data["proto"])
+    m.RebuildConstantMap()
+    def bool_vars(d):
+        return {k: m.GetBoolVarFromProtoIndex(i) for (k, i) in d.items()}
+    def int_vars(d):
+        return {k: m.GetIntVarFromProtoIndex(i) for (k, i) in d.items()}
+    def expr(coeffs, constant):
+        return sum(coeff * m.GetIntVarFromProtoIndex(i) for (i, coeff) in coeffs.items()) + constant
+    debug(f"Model cache: loaded {filename}")
+    return (m, bool_vars(data["src"]), bool_vars(data["tc"]), bool_vars(data["ts"]),
+        [m.GetIntVarFromProtoIndex(i) for i in data["cs"]], bool_vars(data["channels"]),
+        int_vars(data["teach_num"]), bool_vars(data["ps"]), bool_vars(data["pd"]), int_vars(data["occupied_num"]),
+        {name: [expr(*e) for e in l] for (name, l) in data["penalties"].items()}, bool_vars(data["guards"]))
+
+# RESULT CACHE
+# the best schedule found, its objective, bound and status, stored under a hash
+# of the normalized data the schedule depends on: the loaded calendar, teachers,
+# courses and rules (built-in or from an instance file), the parsed preferences,
+# the previous schedule, the penalties and the options changing what is solved
+# (not the time limit, seed or number of workers, those only change how far the
+# search gets)
+RESULT_KEY_DATA = ["days", "day_times", "rooms", "rooms_venues", "venues_preferred", "TEACHERS", "FAKE_TEACHERS",
+    "courses_regular", "courses_solo", "courses_open", "PENALTIES", "PENALTIES_ASSIGNMENT", "PENALTIES_MASTER", "PENALTIES_STAGES"] + INSTANCE_RULES
+
+def result_cache_key():
+    data = {name: globals()[name] for name in RESULT_KEY_DATA}
+    data["input"] = input_data
+    # what the model is built from (the ct_possible families are not in the instance rules)
+    data["ct_possible"] = {C: sorted(Ts) for (C, Ts) in ct_possible.items()}
+    for name in ["tc_forbidden", "t_util_max", "t_util_ideal", "tt_not_together", "ts_pref", "tc_pref"]:
+        data[name] = globals()[name]
+    data["previous"] = {courses[c]: (s, r, sorted(teachers[t] for t in prev_ts)) for (c, (s, r, prev_ts)) in previous.items()}
+    data["options"] = [args.two_phase, args.reopen, args.lexicographic, bool(args.decompose), args.parameters]
+    h = hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=sorted).encode())
+    return h.hexdigest()
+
+def load_result():
+    # stored result (dict with the schedule) or None
+    filename = os.path.join(args.result_cache, result_cache_key())
+    if not os.path.exists(filename + ".json"):
+        return None
+    with open(filename + ".json", mode="r") as f:
+        result = json.load(f)
+    result["schedule"] = read_schedule(filename + ".csv", "Result cache")
+    if not check_schedule(*schedule_arrays(result["schedule"]), result["penalties"], "Result cache"):
+        warn(f"Result cache: ignoring {filename}, the stored schedule does not verify")
+        return None
+    debug(f"Result cache: loaded {filename} ({result['status']}, objective {result['objective']}, bound {result['bound']})")
+    return result
+
+def save_result(stored, result_src, result_tc, result_penalties, status, bound):
+    # store the better of the new and the STORED result, returns the status stored
+    objective = sum(coeff * value for (coeff, value) in result_penalties.values())
+    if stored is not None:
+        if stored["bound"] is not None:
+            # both bounds hold for the same problem
+            bound = stored["bound"] if bound is None else max(bound, stored["bound"])
+        if stored["objective"] < objective:
+            # keep the stored schedule, only its bound can improve
+            (result_src, result_tc) = schedule_arrays(stored["schedule"])
+            (objective, result_penalties, status) = (stored["objective"], stored["penalties"], stored["status"])
+    if bound is not None and bound >= objective:
+        status = "OPTIMAL"
+    filename = os.path.join(args.result_cache, result_cache_key())
+    os.makedirs(args.result_cache, exist_ok=True)
+    write_schedule(filename + ".csv.tmp", result_src, result_tc)
+    with open(filename + ".json.tmp", mode="w") as f:
+        json.dump({"objective": objective, "bound": bound, "status": status,
+            "penalties": {name: list(value) for (name, value) in result_penalties.items()}}, f, indent=1)
+    os.replace(filename + ".csv.tmp", filename + ".csv")
+    os.replace(filename + ".json.tmp", filename + ".json")
+    debug(f"Result cache: saved {filename} ({status}, objective {objective}, bound {bound})")
+    return status
+
+def schedule_arrays(schedule):
+    # course C -> (slot S, room R, teachers Ts) -> (src, tc) as solution_values() returns them
+    result_src = np.zeros((len(slots), len(rooms), len(courses)), dtype=np.int8)
+    result_tc = np.zeros((len(teachers), len(courses)), dtype=np.int8)
+    for (c, (s, r, ts)) in schedule.items():
+        if s is not None and r is not None:
+            result_src[s, r, c] = 1
+        result_tc[ts, c] = 1
+    return (result_src, result_tc)
+
+# BUILD PROFILING
+# every section of the build calls profile_mark() with its family name; with
+# --profile the time spent and the variables and constraints added (by constraint
+# type) are accumulated per family
+profile_families = {} # family -> {"time", "variables", "constraints", "constraint_types"}
+profile_current = None # (family, start time, #variables, #constraints)
+
+def profile_mark(family):
+    global profile_current
+    if not args.profile:
+        return
+    proto = model.Proto()
+    if profile_current:
+        (name, start, nvars, ncons) = profile_current
+        record = profile_families.setdefault(name, {"time": 0.0, "variables": 0, "constraints": 0, "constraint_types": {}})
+        record["time"] += time.time() - start
+        record["variables"] += len(proto.variables) - nvars
+        record["constraints"] += len(proto.constraints) - ncons
+        types = record["constraint_types"]
+        for i in range(ncons, len(proto.constraints)):
+            kind = proto.constraints[i].WhichOneof("constraint")
+            types[kind] = types.get(kind, 0) + 1
+    profile_current = None
+    if family:
+        profile_current = (family, time.time(), len(proto.variables), len(proto.constraints))
+
+def profile_report(filename, build_time):
+    proto = model.Proto()
+    report = {
+        "build_time": round(build_time, 3),
+        "variables": len(proto.variables),
+        "constraints": len(proto.constraints),
+        "proto_bytes": proto.ByteSize(),
+        "families": [{"family": name, **record, "time": round(record["time"], 3)} for (name, record) in profile_families.items()],
+    }
+    with open(filename, mode="w") as f:
+        json.dump(report, f, indent=2)
+    print("Build profile (family, seconds, variables, constraints):")
+    for r in sorted(report["families"], key=lambda r: -r["time"]):
+        print(f"{r['family']:24} {r['time']:8.3f} {r['variables']:8} {r['constraints']:8}")
+    print(f"Build profile written to {filename}")
+
+def build_model():
+    # build the model from the loaded instance and input (or load it from --model-cache)
+    global model, src, tc, ts, cs, channels, teach_num, ps, pd, occupied_num, penalties, guards, decode_index
+    import_ortools()
+    decode_index = None
+    profile_families.clear()
+    build_start = time.time()
+    model = None
+    if args.model_cache:
+        model_cache_file = os.path.join(args.model_cache, model_cache_key() + ".pickle")
+        if os.path.exists(model_cache_file):
+            (model, src, tc, ts, cs, channels, teach_num, ps, pd, occupied_num, penalties, guards) = load_model(model_cache_file)
+            print(f"Model loaded in {time.time()-build_start:.2f} seconds")
+            if args.profile:
+                warn("model loaded from the cache, there is no build to profile")
+
+    if model is None:
+        construct_model()
+        build_time = time.time() - build_start
+        print(f"Model built in {build_time:.2f} seconds")
+        if args.profile:
+            profile_report(args.profile, build_time)
+        if args.model_cache:
+            save_model(model_cache_file)
+
+    add_previous_hints()
+    return model
+
+def add_previous_hints():
+    # warm start from the previous schedule
+    add_schedule_hints(model, previous)
+
+def add_schedule_hints(m, schedule):
+    # hint model M (built from the loaded data) with a schedule: course C -> (slot S, room R, teachers Ts)
+    for (c, (s, r, prev_ts)) in schedule.items():
+        if s is not None:
+            for i in range(len(slots)):
+                m.AddHint(channels[("slot", c, i)], int(i == s))
+        if r is not None:
+            for i in range(len(rooms)):
+                m.AddHint(channels[("room", c, i)], int(i == r))
+        if src and s is not None and r is not None:
+            for i in range(len(slots)):
+                for j in range(len(rooms)):
+                    m.AddHint(src[(i,j,c)], int((i,j) == (s,r)))
+        if prev_ts:
+            for t in c_teachers[c]:
+                m.AddHint(tc[(t,c)], int(t in prev_ts))
+
+def solution_schedule(result_src, result_tc):
+    # decoded solution -> course C -> (slot S, room R, teachers Ts), as read_schedule() returns
+    schedule = {}
+    for (s,r,c) in zip(*np.nonzero(result_src)):
+        schedule[int(c)] = (int(s), int(r), [int(t) for t in np.flatnonzero(result_tc[:,c])])
+    return schedule
+
+def course_channel(kind, c, i):
+    key = (kind, c, i)
+    if key in channels:
+        return channels[key]
+    # course C is placed exactly once, so each sum below is 0 or 1
+    hit = model.NewBoolVar(f"C{kind}:c{c}i{i}")
+    if kind == "slot":
+        model.Add(hit == sum(src[(i,r,c)] for r in range(len(rooms))))
+    elif kind == "room":
+        model.Add(hit == sum(src[(s,i,c)] for s in range(len(slots))))
+    elif kind == "day":
+        model.Add(hit == sum(course_channel("slot", c, s) for s in day_slots[i]))
+    elif kind == "time":
+        model.Add(hit == sum(course_channel("slot", c, s) for s in range(len(slots)) if slot_time[s] == i))
+    elif kind == "venue":
+        model.Add(hit == sum(course_channel("room", c, r) for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[i]))
+    elif kind == "slot_venue" and src:
+        (s, v) = i
+        model.Add(hit == sum(src[(s,r,c)] for r in range(len(rooms)) if rooms_venues[rooms[r]] == venues[v]))
+    elif kind == "slot_venue":
+        (s, v) = i
+        hit_slot = course_channel("slot", c, s)
+        hit_venue = course_channel("venue", c, v)
+        model.AddBoolAnd([hit_slot, hit_venue]).OnlyEnforceIf(hit)
+        model.AddBoolOr([hit_slot.Not(), hit_venue.Not()]).OnlyEnforceIf(hit.Not())
+    else:
+        assert(False)
+    channels[key] = hit
+    return hit
+
+def course_index(kind, c):
+    # integer view of the one-hot channel (slot number, day number, ...)
+    key = (kind, c)
+    if key not in channels_index:
+        n = channels_size[kind]
+        x = model.NewIntVar(0, n-1, f"C{kind}:c{c}")
+        model.Add(x == sum(i * course_channel(kind, c, i) for i in range(1, n)))
+        channels_index[key] = x
+    return channels_index[key]
+
+def element_var(values, index, m=None):
+    # x == values[index] as an element table (index is restricted to the table) in model M (default: the model)
+    m = model if m is None else m
+    x = m.NewIntVar(min(values), max(values), "")
+    m.AddElement(index, values, x)
+    return x
+
+def extra_days_squared(num, day_lits, m=None):
+    # (days with some lesson - days needed for num lessons)**2 through element tables
+    m = model if m is None else m
+    needed = element_var([days_needed(n) for n in range(len(slots)+1)], num, m)
+    extra = m.NewIntVar(0, len(days), "")
+    m.Add(extra == sum(day_lits) - needed)
+    return element_var([e**2 for e in range(len(days)+1)], extra, m)
+
+def any_literal(lits):
+    # literal true iff some of LITS (None for missing ones) is, None if all are missing
+    lits = [x for x in lits if x is not None]
+    if len(lits) <= 1:
+        return lits[0] if lits else None
+    x = model.NewBoolVar("")
+    model.AddMaxEquality(x, lits)
+    return x
+
+def reified_any(lits):
+    # reified linear version of any_literal()
+    if len(lits) == 1:
+        return lits[0]
+    x = model.NewBoolVar("")
+    model.Add(sum(lits) >= 1).OnlyEnforceIf(x)
+    model.Add(sum(lits) == 0).OnlyEnforceIf(x.Not())
+    return x
+
+def penalty_encoding(name):
+    # PENALTIES_ENCODING of penalty NAME, overridden by --encoding
+    encoding = PENALTIES_ENCODING.get(name, "reified")
+    for option in args.encoding or []:
+        (n, _, e) = option.rpartition("=")
+        if e not in ENCODINGS:
+            error(f"Unknown penalty encoding '{e}', expected one of {ENCODINGS}")
+        if n and n not in PENALTIES:
+            error(f"Unknown penalty '{n}' in --encoding")
+        if n in ["", name]:
+            encoding = e
+    return encoding
+
+# INFEASIBILITY DIAGNOSIS
+# with --diagnose every hard rule is enforced only if its guard literal (one per
+# rule, named after it) is true; the guards are solved as assumptions and the
+# unsat core maps back to the conflicting rules
+guards = {} # rule name -> guard literal
+
+def guard(name):
+    if name not in guards:
+        guards[name] = model.NewBoolVar(f"guard:{name}")
+    return guards[name]
+
+def hard(constraint, name):
+    # hard rule NAME, guarded with --diagnose
+    if args.diagnose:
+        constraint.OnlyEnforceIf(guard(name))
+    return constraint
+
+def add_all_different(exprs, name):
+    # AllDifferent does not support enforcement, pairwise inequalities do
+    if not args.diagnose:
+        return model.AddAllDifferent(exprs)
+    for i in range(len(exprs)):
+        for j in range(i+1, len(exprs)):
+            hard(model.Add(exprs[i] != exprs[j]), name)
+
+def add_all_equal(exprs, domain, name):
+    if not args.diagnose:
+        return model.AddAllowedAssignments(exprs, [[x] * len(exprs) for x in range(domain)])
+    for i in range(1, len(exprs)):
+        hard(model.Add(exprs[0] == exprs[i]), name)
+
+# SYMMETRY BREAKING
+# courses, rooms and placeholder teachers that can be swapped without changing
+# anything else in the model get ordered
+
+# teachers named in construct_model(), never interchangeable
+TEACHERS_SPECIFIC = ["Tom-K.", "Pavli"]
+
+def find_symmetries():
+    # returns (course classes, room groups, placeholder teacher groups), every
+    # course is in exactly one class, groups have at least two members
+    def groups(keys):
+        result = {}
+        for (i, key) in enumerate(keys):
+            result.setdefault(key, []).append(i)
+        return list(result.values())
+
+    def rules_with(x, rules):
+        # indices of rule groups mentioning x
+        return tuple(i for (i, l) in enumerate(rules) if x in l)
+
+    # courses: same kind, teachers, preferences, attendance and rules
+    attend_labels = set(x for T in input_data for x in input_data[T]["courses_attend"])
+    course_keys = []
+    for (c, C) in enumerate(courses):
+        if C in attend_labels:
+            course_keys.append(C) # unique
+            continue
+        course_keys.append((
+            (C in courses_regular, C in courses_solo),
+            tuple(sorted(ct_possible.get(C, []))),
+            tuple(tc_pref_array[:,c]),
+            tuple(pc_attend_array[:,c]),
+            cr_not.get(C),
+            cr_strict.get(C),
+            tuple(T for (T, Cs) in tc_strict.items() if C in Cs),
+            rules_with(C, courses_different),
+            rules_with(C, courses_diffday),
+            rules_with(C, courses_same),
+            courses_slot.get(C),
+            tuple(courses_days.get(C, [])),
+            C in courses_alone,
+            tuple((i, l.index(C)) for (i, l) in enumerate(courses_after) if C in l),
+            (*previous[c][:2], tuple(previous[c][2])) if c in previous else None,
+        ))
+    course_classes = groups(course_keys)
+
+    # rooms: same venue, not named by the rules or by the previous schedule
+    previous_rooms = set(r for (s, r, prev_ts) in previous.values())
+    room_keys = []
+    for (r, R) in enumerate(rooms):
+        if R in cr_not.values() or R in cr_strict.values() or r in previous_rooms:
+            room_keys.append(R)
+        else:
+            room_keys.append(rooms_venues[R])
+    room_groups = [l for l in groups(room_keys) if len(l) >= 2]
+
+    # placeholder teachers of the same role, not named anywhere
+    previous_teachers = set(t for (s, r, prev_ts) in previous.values() for t in prev_ts)
+    named = set(TEACHERS_SPECIFIC) | set(tc_strict) | set(teachers_must_teach) | set(teach_together)
+    named |= set(T for Ts in teach_together.values() for T in Ts)
+    named |= set(T for pair in tt_not_together for T in pair)
+    teacher_keys = []
+    for (t, T) in enumerate(teachers):
+        if T not in FAKE_TEACHERS or T in named or T in input_data or t in previous_teachers:
+            teacher_keys.append(T)
+        else:
+            teacher_keys.append((T in teachers_lead, tuple(C for C in courses if T in ct_possible.get(C, []))))
+    teacher_groups = [l for l in groups(teacher_keys) if len(l) >= 2]
+
+    return (course_classes, room_groups, teacher_groups)
+
+def add_lex_less_equal(a, b):
+    # a <= b lexicographically (lists of linear expressions of the same length)
+    prefix = None # a and b are equal so far
+    for (x, y) in zip(a, b):
+        if prefix is None:
+            model.Add(x <= y)
+        else:
+            model.Add(x <= y).OnlyEnforceIf(prefix)
+        equal = model.NewBoolVar("")
+        model.Add(x == y).OnlyEnforceIf(equal)
+        model.Add(x != y).OnlyEnforceIf(equal.Not())
+        if prefix is None:
+            prefix = equal
+        else:
+            prefix_next = model.NewBoolVar("")
+            model.AddBoolAnd([prefix, equal]).OnlyEnforceIf(prefix_next)
+            model.AddBoolOr([prefix.Not(), equal.Not(), prefix_next])
+            prefix = prefix_next
+
+def add_symmetry_breaking():
+    # the orders below stay valid together: permuting placeholders keeps the
+    # placement, permuting rooms keeps teachers' counts and permuting courses
+    # of a class keeps both and the course classes in every room
+    (course_classes, room_groups, teacher_groups) = find_symmetries()
+    # placeholders: the first ones teach most
+    for group in teacher_groups:
+        debug(f"Symmetry: teachers {[teachers[t] for t in group]}")
+        for (t1, t2) in zip(group, group[1:]):
+            model.Add(teach_num[t1] >= teach_num[t2])
+    # rooms: ordered by the course classes they hold in every slot
+    if args.formulation == "bool":
+        course_class = {}
+        for (i, l) in enumerate(course_classes):
+            for c in l:
+                course_class[c] = i
+        for group in room_groups:
+            debug(f"Symmetry: rooms {[rooms[r] for r in group]}")
+            for (r1, r2) in zip(group, group[1:]):
+                add_lex_less_equal(*[[sum((course_class[c]+1) * src[(s,r,c)] for c in range(len(courses))) for s in range(len(slots))] for r in [r1, r2]])
+    # courses: ordered by slot and room
+    for group in course_classes:
+        if len(group) < 2:
+            continue
+        debug(f"Symmetry: courses {[courses[c] for c in group]}")
+        for (c1, c2) in zip(group, group[1:]):
+            model.Add(cs[c1] * len(rooms) + course_index("room", c1) < cs[c2] * len(rooms) + course_index("room", c2))
+
+def construct_model():
+    global model, src, tc, tsc, ts, ac, pc, psc, ps, td, pd, channels, channels_index, channels_size
+    global cs, cv, tscv, tdv, teach_num, occupied_num, penalties
+    model = cp_model.CpModel()
+    guards.clear()
+
+    # VARIABLES
+    profile_mark("variables")
+
+    # course C takes place in slot S in room R
+    # (the interval formulation places courses through the slot and room channels only)
+    src = {}
+    if args.formulation == "bool":
+        for s in range(len(slots)):
+            for r in range(len(rooms)):
                 for c in range(len(courses)):
-                    if tc[(t,c)]:
-                        cs.append(c)
-                n_courses = sum(tc[(t,c)] for c in range(len(courses)))
-                assert(len(cs) == n_courses)
-                n_days = 0
-                for d in range(len(days)):
-                    if sum(src[(s,r,c)] for s in range(d*len(times), (d+1)*len(times)) for r in range(len(rooms)) for c in cs):
-                        n_days += 1
-                if n_days*len(times) - n_courses >= len(times):
-                    result.append(f"{teachers[t]} {n_courses}c/{n_days}d")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "occupied_days":
-        # nobody should come more days then necessary - including attending courses
-        penalties_occupied_days = []
+                    src[(s,r,c)] = model.NewBoolVar("CSR:s%ir%ic%i" % (s,r,c))
+    # course C is taught by teacher T
+    tc = {}
+    for c in range(len(courses)):
+        for t in c_teachers[c]:
+            tc[(t,c)] = model.NewBoolVar("CT:t%ic%i" % (t,c))
+    # teacher T teaches in slot S course C
+    # (the interval formulation derives TS and PS from the slot channels instead)
+    tsc = {}
+    if args.formulation == "bool":
+        for t in range(len(teachers)):
+            for s in t_slots[t]:
+                for c in t_courses[t]:
+                    tsc[(t,s,c)] = model.NewBoolVar("TS:t%is%ic%i" % (t,s,c))
+    # teacher T teaches in slot S
+    ts = {}
+    for t in range(len(teachers)):
+        for s in t_slots[t]:
+            ts[(t,s)] = model.NewBoolVar("TS:t%is%i" % (t,s))
+    # person P attends course C
+    ac = {}
+    for p in range(len(people)):
+        for c in p_attend[p]:
+            ac[(p,c)] = model.NewBoolVar("")
+    # person P teaches or attends course C
+    pc = {}
+    for p in range(len(people)):
+        for c in p_courses[p]:
+            pc[(p,c)] = model.NewBoolVar("")
+    # person P attends or teaches course C in slot S
+    psc = {}
+    for p in (range(len(people)) if args.formulation == "bool" else []):
+        for c in p_courses[p]:
+            # teaching only is limited to the slots the person can teach in
+            for s in (range(len(slots)) if c in p_attend[p] else t_slots[p]):
+                if c in p_attend[p]:
+                    psc[(p,s,c)] = model.NewBoolVar("")
+                else:
+                    # teaching only - the same literal as TSC
+                    psc[(p,s,c)] = tsc[(p,s,c)]
+    # person P occupied (attends or teaches) in slot S
+    ps = {}
+    for s in range(len(slots)):
         for p in range(len(people)):
-            occupied_days = model.NewIntVar(0, len(days), "")
-            model.Add(occupied_days == sum(pd[(p,d)] for d in range(len(days))))
-            occupied_some = model.NewBoolVar("")
-            model.Add(occupied_num[p] >= 1).OnlyEnforceIf(occupied_some)
-            model.Add(occupied_num[p] == 0).OnlyEnforceIf(occupied_some.Not())
-            occupied_minus_1 = model.NewIntVar(0, len(days), "")
-            model.Add(occupied_minus_1 == occupied_num[p] - 1).OnlyEnforceIf(occupied_some)
-            model.Add(occupied_minus_1 == 0).OnlyEnforceIf(occupied_some.Not())
-            should_occupy_days = model.NewIntVar(0, len(days), "")
-            model.AddDivisionEquality(should_occupy_days, occupied_minus_1, len(times)) # -1 to compensate rounding down
-            occupied_days_extra = model.NewIntVar(0, len(days), "")
-            model.Add(occupied_days_extra == occupied_days - should_occupy_days - 1).OnlyEnforceIf(occupied_some) # -1 to compensate rounding down
-            model.Add(occupied_days_extra == 0).OnlyEnforceIf(occupied_some.Not())
-            occupied_days_extra_sq = model.NewIntVar(0, len(days)**2, "")
-            model.AddMultiplicationEquality(occupied_days_extra_sq, [occupied_days_extra, occupied_days_extra])
-            penalties_occupied_days.append(occupied_days_extra_sq)
-        penalties[name] = penalties_occupied_days
-        def analysis(src, tc):
-            result = []
+            ps[(p,s)] = model.NewBoolVar("PS:p%is%i" % (p,s))
+    # teacher T teaches on day D
+    td = {}
+    for d in range(len(days)):
+        for t in range(len(teachers)):
+            td[(t,d)] = model.NewBoolVar("TD:t%id%i" % (t,d))
+    # person P is occupied (teaches or attends courses) on day D
+    pd = {}
+    for d in range(len(days)):
+        for p in range(len(people)):
+            pd[(p,d)] = model.NewBoolVar("")
+
+    # COURSE PLACEMENT CHANNELS
+    profile_mark("channels")
+    # course C is at slot S / day D / time T / room R / venue V - every literal is
+    # created on first use and then shared by all constraints and penalties
+    channels = {} # (kind, c, i) -> BoolVar
+    channels_index = {} # (kind, c) -> IntVar
+    channels_size = {
+        "slot": len(slots),
+        "day": len(days),
+        "time": len(times),
+        "room": len(rooms),
+        "venue": len(venues),
+        }
+
+    if args.formulation == "interval":
+        # slot and room channels are the primary placement variables
+        for c in range(len(courses)):
+            for s in range(len(slots)):
+                channels[("slot", c, s)] = model.NewBoolVar(f"Cslot:c{c}i{s}")
+            for r in range(len(rooms)):
+                channels[("room", c, r)] = model.NewBoolVar(f"Croom:c{c}i{r}")
+
+    # course C takes place in slot S
+    cs = []
+    for c in range(len(courses)):
+        cs.append(course_index("slot", c))
+    # course C takes place in room R
+    for c in range(len(courses)):
+        for r in range(len(rooms)):
+            course_channel("room", c, r)
+    # room R is in venue V
+    rv = []
+    for r in range(len(rooms)):
+        rv.append(model.NewIntVar(0, len(venues)-1, ""))
+        model.Add(rv[r] == Venues[rooms_venues[rooms[r]]])
+    # teacher T teaches in slot S course C in venue V
+    profile_mark("venue-variables")
+    tscv = {}
+    for (t,s,c) in tsc:
+        for v in range(len(venues)):
+            tscv[(t,s,c,v)] = model.NewBoolVar("")
+
+    # teacher T teaches in venue V on day D
+    # TODO do it wrt. attending courses - cannot teach in Koliste, attend in Mosilana, and teach again in Koliste
+    tdv = {}
+    for t in range(len(teachers)):
+        for d in range(len(days)):
+            for v in range(len(venues)):
+                tdv[(t,d,v)] = model.NewBoolVar("")
+
+    # teacher T teaches course C in slot S iff course C takes place at slot S and is taught by teacher T
+    profile_mark("tsc-inference")
+    # inferring CTS info
+    for s in range(len(slots)):
+        for c in range(len(courses)):
+            hit = course_channel("slot", c, s)
+            for t in c_teachers[c]:
+                if (t,s,c) not in tsc:
+                    continue
+                model.AddBoolAnd([hit, tc[(t,c)]]).OnlyEnforceIf(tsc[(t,s,c)])
+                model.AddBoolOr([hit.Not(), tc[(t,c)].Not()]).OnlyEnforceIf(tsc[(t,s,c)].Not())
+            if SPARSE and not args.diagnose:
+                # teachers that cannot teach at slot S cannot teach course C in S
+                for t in c_teachers[c]:
+                    if (t,s) not in ts:
+                        model.AddBoolOr([hit.Not(), tc[(t,c)].Not()])
+    # inferring TS info
+    profile_mark("ts-inference")
+    if args.formulation == "bool":
+        for t in range(len(teachers)):
+            for s in t_slots[t]:
+                model.Add(sum(tsc[(t,s,c)] for c in t_courses[t]) == 1).OnlyEnforceIf(ts[(t,s)])
+                model.Add(sum(tsc[(t,s,c)] for c in t_courses[t]) == 0).OnlyEnforceIf(ts[(t,s)].Not())
+    elif args.formulation == "interval":
+        # a taught course occupies its slot; the courses of a person do not
+        # overlap (NoOverlap below), so a teacher teaches in as many slots as courses
+        for (t,c) in tc:
+            for s in t_slots[t]:
+                model.AddBoolOr([tc[(t,c)].Not(), course_channel("slot", c, s).Not(), ts[(t,s)]])
+        for t in range(len(teachers)):
+            model.Add(sum(ts[(t,s)] for s in t_slots[t]) == sum(tc[(t,c)] for c in t_courses[t]))
+    # construct AC info (person P attends course C)
+    profile_mark("ac-inference")
+    for p in range(len(people)):
+        for c in p_attend[p]:
+            if c in p_attend_wish[p]:
+                model.Add(ac[(p,c)] == 1)
+            else:
+                model.Add(ac[(p,c)] == 0)
+    # construct PC info (person P attends or teaches course C)
+    profile_mark("pc-inference")
+    for (p,c) in pc:
+        lits = [x[(p,c)] for x in [tc, ac] if (p,c) in x]
+        model.AddBoolOr(lits).OnlyEnforceIf(pc[(p,c)])
+        model.AddBoolAnd([x.Not() for x in lits]).OnlyEnforceIf(pc[(p,c)].Not())
+    # inferring PSC info - person P attends or teaches course C in slot S
+    profile_mark("psc-inference")
+    for s in range(len(slots)):
+        for c in range(len(courses)):
+            hit = course_channel("slot", c, s)
             for p in range(len(people)):
-                occupied_courses = []
-                for c in range(len(courses)):
-                    if tc[(p,c)] or (people[p] in input_data and [x for x in input_data[people[p]]["courses_attend"] if courses[c].startswith(x)]):
-                        occupied_courses.append(c)
-                n_courses = len(occupied_courses)
-                n_days = 0
-                for d in range(len(days)):
-                    if sum(src[(s,r,c)] for s in range(d*len(times), (d+1)*len(times)) for r in range(len(rooms)) for c in occupied_courses):
-                        n_days += 1
-                if n_days*len(times) - n_courses >= len(times):
-                    result.append(f"{people[p]} {n_courses}c/{n_days}d")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "split":
-        # teacher should not wait between lessons
-        penalties_split = []
+                if (p,s,c) not in psc or c not in p_attend[p]:
+                    continue
+                model.AddBoolAnd([hit, pc[(p,c)]]).OnlyEnforceIf(psc[(p,s,c)])
+                model.AddBoolOr([hit.Not(), pc[(p,c)].Not()]).OnlyEnforceIf(psc[(p,s,c)].Not())
+    # inferring PS info - person P attends or teaches course in slot S
+    profile_mark("ps-inference")
+    if args.formulation == "bool":
+        for s in range(len(slots)):
+            for p in range(len(people)):
+                model.Add(sum(psc[(p,s,c)] for c in p_courses[p] if (p,s,c) in psc) == 1).OnlyEnforceIf(ps[(p,s)])
+                model.Add(sum(psc[(p,s,c)] for c in p_courses[p] if (p,s,c) in psc) == 0).OnlyEnforceIf(ps[(p,s)].Not())
+    elif args.formulation == "interval":
+        # as TS: every course of the person occupies its slot, and they do not overlap
+        for p in range(len(people)):
+            for c in p_courses[p]:
+                for s in range(len(slots)):
+                    model.AddBoolOr([pc[(p,c)].Not(), course_channel("slot", c, s).Not(), ps[(p,s)]])
+            model.Add(sum(ps[(p,s)] for s in range(len(slots))) == sum(pc[(p,c)] for c in p_courses[p]))
+    # inferring TD info
+    profile_mark("td-inference")
+    for d in range(len(days)):
+        for t in range(len(teachers)):
+            model.Add(sum(ts[(t,s)] for s in day_slots[d] if (t,s) in ts) >= 1).OnlyEnforceIf(td[(t,d)])
+            model.Add(sum(ts[(t,s)] for s in day_slots[d] if (t,s) in ts) == 0).OnlyEnforceIf(td[(t,d)].Not())
+    # inferring PD info
+    profile_mark("pd-inference")
+    for d in range(len(days)):
+        for p in range(len(people)):
+            model.Add(sum(ps[(p,s)] for s in day_slots[d]) >= 1).OnlyEnforceIf(pd[(p,d)])
+            model.Add(sum(ps[(p,s)] for s in day_slots[d]) == 0).OnlyEnforceIf(pd[(p,d)].Not())
+
+    # inferring TDV info
+    profile_mark("tdv-inference")
+    if args.formulation == "bool":
+        for s in range(len(slots)):
+            for c in range(len(courses)):
+                for v in range(len(venues)):
+                    if not [t for t in c_teachers[c] if (t,s,c,v) in tscv]:
+                        continue
+                    hit = course_channel("slot_venue", c, (s,v))
+                    for t in c_teachers[c]:
+                        if (t,s,c,v) not in tscv:
+                            continue
+                        model.AddBoolAnd([hit, tc[(t,c)]]).OnlyEnforceIf(tscv[(t,s,c,v)])
+                        model.AddBoolOr([hit.Not(), tc[(t,c)].Not()]).OnlyEnforceIf(tscv[(t,s,c,v)].Not())
         for t in range(len(teachers)):
-            days_split = model.NewIntVar(0, len(days), "TDsplit:%i" % t)
-            tsplits = []
             for d in range(len(days)):
-                # tsplit == True iff teacher t teaches just the first and the last course in day d
-                tsubsplits = []
-                for i in range(len(times)):
-                    tsubsplit = model.NewBoolVar("tsubsplit:t%id%ii%i" % (t,d,i))
-                    model.Add(sum(ts[(t,s)] for s in [d*len(times)+i]) == 1).OnlyEnforceIf(tsubsplit)
-                    model.Add(sum(ts[(t,s)] for s in [d*len(times)+i]) == 0).OnlyEnforceIf(tsubsplit.Not())
-                    tsubsplits.append(tsubsplit)
-                tsplit = model.NewBoolVar("tsplit:t%id%i" % (t,d))
-                model.AddBoolAnd([tsubsplits[0], tsubsplits[1].Not(), tsubsplits[2]]).OnlyEnforceIf(tsplit)
-                model.AddBoolOr([tsubsplits[0].Not(), tsubsplits[1], tsubsplits[2].Not()]).OnlyEnforceIf(tsplit.Not())
-                tsplits.append(tsplit)
-            model.Add(days_split == sum(tsplits))
-            penalties_split.append(days_split)
-        penalties[name] = penalties_split
-        def analysis(src, tc):
-            result = []
-            for t in range(len(teachers)):
-                cs = []
-                for c in range(len(courses)):
-                    if tc[(t,c)]:
-                        cs.append(c)
-                n = 0
-                for d in range(len(days)):
-                    if (
-                            sum(src[(d*len(times),r,c)]  for r in range(len(rooms)) for c in cs) >= 1
-                            and sum(src[(d*len(times)+1,r,c)]  for r in range(len(rooms)) for c in cs) == 0
-                            and sum(src[(d*len(times)+2,r,c)]  for r in range(len(rooms)) for c in cs) >= 1
-                            ):
-                        n += 1
-                if n > 0:
-                    result.append(f"{teachers[t]}/{n}")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "slotpref_bad":
-        # slots preferences
-        penalties_slotpref_bad = []
+                for v in range(len(venues)):
+                    model.Add(sum(tscv[(t,s,c,v)] for s in day_slots[d] for c in t_courses[t] if (t,s,c,v) in tscv) >= 1).OnlyEnforceIf(tdv[(t,d,v)])
+                    model.Add(sum(tscv[(t,s,c,v)] for s in day_slots[d] for c in t_courses[t] if (t,s,c,v) in tscv) == 0).OnlyEnforceIf(tdv[(t,d,v)].Not())
+    elif args.formulation == "interval":
+        # only used to forbid teaching (in two venues a day, in Mosilana), so
+        # teaching a course forcing TDV is enough
+        for (t,c) in tc:
+            for d in range(len(days)):
+                for v in range(len(venues)):
+                    model.AddBoolOr([tc[(t,c)].Not(), course_channel("day", c, d).Not(), course_channel("venue", c, v).Not(), tdv[(t,d,v)]])
+    # inferring CV info
+    profile_mark("cv-inference")
+    cv = []
+    for c in range(len(courses)):
+        cv.append(course_index("venue", c))
+
+    # number of lessons teacher T teaches
+    profile_mark("counters")
+    teach_num = {}
+    for t in range(len(teachers)):
+        teach_num[t] = model.NewIntVar(0, len(slots), "Tteach_num:%i" % t)
+        model.Add(teach_num[t] == sum(tc[(t,c)] for c in t_courses[t]))
+    # number of slots person P occupies (teaches or attends)
+    occupied_num = {}
+    for p in range(len(people)):
+        occupied_num[p] = model.NewIntVar(0, len(slots), "")
+        model.Add(occupied_num[p] == sum(ps[(p,s)] for s in range(len(slots))))
+
+    profile_mark("clashes")
+    if args.formulation == "bool":
+        # prevent teachers from teaching in two rooms in the same time
+        for t in range(len(teachers)):
+            for s in range(len(slots)):
+                model.Add(sum(tsc[(t,s,c)] for c in t_courses[t] if (t,s,c) in tsc) <= 1)
+
+        # one course takes place at one time in one room
+        for c in range(len(courses)):
+            model.Add(sum(src[(s,r,c)] for s in range(len(slots)) for r in range(len(rooms))) == 1)
+
+        # at one time in one room, there is maximum one course
+        for s in range(len(slots)):
+            for r in range(len(rooms)):
+                model.Add(sum(src[(s,r,c)] for c in range(len(courses))) <= 1)
+    elif args.formulation == "interval":
+        # one course takes place at one time in one room
+        for c in range(len(courses)):
+            model.AddExactlyOne(course_channel("slot", c, s) for s in range(len(slots)))
+            model.AddExactlyOne(course_channel("room", c, r) for r in range(len(rooms)))
+
+        # every course is a one-slot interval, optional per room and per teacher
+        ci_room = {}
+        for c in range(len(courses)):
+            for r in range(len(rooms)):
+                ci_room[(c,r)] = model.NewOptionalFixedSizeIntervalVar(cs[c], 1, course_channel("room", c, r), f"CIR:c{c}r{r}")
+        ci_person = {}
+        for (p,c) in pc:
+            ci_person[(p,c)] = model.NewOptionalFixedSizeIntervalVar(cs[c], 1, pc[(p,c)], f"CIP:p{p}c{c}")
+
+        # at one time in one room, there is maximum one course
+        for r in range(len(rooms)):
+            model.AddNoOverlap(ci_room[(c,r)] for c in range(len(courses)))
+
+        # people (teachers) teach or attend one course at a time
+        for p in range(len(people)):
+            model.AddNoOverlap(ci_person[(p,c)] for c in p_courses[p])
+
+    # every regular course is taught by two teachers and solo course by one teacher
+    profile_mark("course-teachers")
+    for c in range(len(courses)):
+        name = f"{courses[c]} has its teachers"
+        if courses[c] in courses_regular:
+            hard(model.Add(sum(tc[(Teachers[T],c)] for T in teachers_lead if (Teachers[T],c) in tc) == 1), name)
+            hard(model.Add(sum(tc[(Teachers[T],c)] for T in teachers_follow if (Teachers[T],c) in tc) == 1), name)
+        elif courses[c] in courses_solo:
+            hard(model.Add(sum(tc[(t,c)] for t in c_teachers[c]) == 1), name)
+        elif courses[c] in courses_open:
+            hard(model.Add(sum(tc[(t,c)] for t in c_teachers[c]) == 0), name)
+        else:
+            assert(False)
+
+    # SPECIFIC CONSTRAINTS
+    profile_mark("specific")
+
+    if False:
+        # unspecified teachers teach arbitrary number of courses
+        for (T, n) in t_util_max.items():
+            model.Add(sum(tc[(Teachers[T],c)] for c in t_courses[Teachers[T]]) <= n)
+    else:
+        # unspecified teachers teach no courses
         for T in teachers:
-            if T in ts_pref:
-                prefs = ts_pref[T]
-                if set([1,2]) <= set(prefs) or set([1,3]) <= set(prefs):
-                    # teacher T strongly prefers some slots over others
-                    slots_bad = [s for s in range(len(slots)) if prefs[s] == 1]
-                    penalties_slotpref_bad.append(sum(ts[(Teachers[T],s)] for s in slots_bad))
-        penalties[name] = penalties_slotpref_bad
-        def analysis(src, tc):
-            result = []
+            if T not in FAKE_TEACHERS:
+                debug(f"Teacher max: {T} {t_util_max.get(T,-1)}")
+                hard(model.Add(sum(tc[(Teachers[T],c)] for c in t_courses[Teachers[T]]) <= t_util_max.get(T, 0)),
+                    f"{T} teaches at most {t_util_max.get(T, 0)} courses")
+
+    # community teachers that must teach
+    for T in teachers_must_teach:
+        if t_util_max.get(T, 0) >= 1:
+            hard(model.Add(sum(tc[(Teachers[T],c)] for c in t_courses[Teachers[T]]) >= 1), f"{T} must teach")
+        else:
+            warn(f"community teacher {T} should teach, but has not utilization preferences")
+
+    if tc_strict:
+        debug("strict assignments present")
+        strict_assignments = []
+        for (T, Cs) in tc_strict.items():
+            t = Teachers[T]
+            for C in Cs:
+                c = Courses[C]
+                if (t,c) not in tc:
+                    error(f"Strict assignment not possible: teacher {T} course {C} (try --diagnose)")
+                if args.diagnose:
+                    hard(model.Add(tc[(t,c)] == 1), f"{T} teaches {C} (strict assignment)")
+                strict_assignments.append(tc[(t,c)])
+        if not args.diagnose:
+            model.AddBoolAnd(strict_assignments)
+
+    teachers_all = set(range(len(teachers)))
+    for (C, Ts) in ct_possible.items():
+        c = Courses[C]
+        teachers_can = []
+        for T in Ts:
+            t = Teachers[T]
+            teachers_can.append(t)
+        teachers_not = teachers_all - set(teachers_can)
+        # no other teacher can teach C
+        if args.diagnose:
+            for t in teachers_not:
+                if (t,c) not in tc:
+                    continue # index sets built before --diagnose was set
+                if (teachers[t], C) in tc_forbidden:
+                    hard(model.Add(tc[(t,c)] == 0), f"{teachers[t]} does not teach {C} (course preference 0)")
+                else:
+                    hard(model.Add(tc[(t,c)] == 0), f"{teachers[t]} cannot teach {C} (teachers of the course)")
+        else:
+            model.Add(sum(tc[(t,c)] for t in teachers_not if (t,c) in tc) == 0)
+
+    for T1, T2 in tt_not_together:
+        for c in range(len(courses)):
+            hard(model.Add(sum(tc[(t,c)] for t in [Teachers[T1], Teachers[T2]] if (t,c) in tc) < 2), f"{T1} and {T2} do not teach together")
+
+    # TODO: this should be loosened, also wrt. attending
+    # teacher T does not teach in two venues in the same day
+    for t in range(len(teachers)):
+        for d in range(len(days)):
+            hard(model.Add(sum(tdv[(t,d,v)] for v in range(len(venues))) <= 1), f"{teachers[t]} teaches in one venue a day")
+
+    # strict courses schedule
+    for (C, S) in courses_slot.items():
+        hard(model.Add(cs[Courses[C]] == Slots[S]), f"{C} is at {S}")
+    for (C, Ds) in courses_days.items():
+        # slots of the days as intervals of the slot index
+        domain = cp_model.Domain.FromIntervals([[day_slots[Days[D]].start, day_slots[Days[D]].stop-1] for D in Ds])
+        hard(model.AddLinearExpressionInDomain(cs[Courses[C]], domain), f"{C} is on {' or '.join(Ds)}")
+    for C in courses_alone:
+        # nothing else happens in parallel with C
+        c = Courses[C]
+        for s in range(len(slots)):
+            hit = course_channel("slot", c, s)
+            hard(model.Add(sum(course_channel("slot", c2, s) for c2 in range(len(courses)) if c2 != c) == 0).OnlyEnforceIf(hit), f"nothing in parallel with {C}")
+    for (C1, C2) in courses_after:
+        hard(model.Add(cs[Courses[C1]]+1 == cs[Courses[C2]]), f"{C2} follows {C1}")
+        hard(model.Add(course_index("day", Courses[C1]) == course_index("day", Courses[C2])), f"{C2} follows {C1}")
+
+    # teachers HARD slot preferences
+    for T in teachers:
+        if T in ts_pref: # TODO what about people without preferences?
+            for s, v in enumerate(ts_pref[T]):
+                if v == 0 and (Teachers[T], s) in ts:
+                    hard(model.Add(ts[(Teachers[T], s)] == 0), f"{T} cannot teach {slots[s]} (slot preference 0)")
+
+    # same courses should not happen in same days and also not in same times
+    # it should probably not be a strict limitation, but it is much easier to write
+    for Cs in courses_different:
+        daylist = [] # days
+        timelist = [] # times
+        assert(2 <= len(Cs) <= min(len(days), len(times)))
+        for C in Cs:
+            daylist.append(course_index("day", Courses[C]))
+            timelist.append(course_index("time", Courses[C]))
+        add_all_different(daylist, f"{', '.join(Cs)} are on different days")
+        add_all_different(timelist, f"{', '.join(Cs)} are at different times")
+
+    # courses that should not happen in same days
+    for Cs in courses_diffday:
+        daylist = [] # days
+        assert(2 <= len(Cs) <= len(days))
+        for C in Cs:
+            daylist.append(course_index("day", Courses[C]))
+        add_all_different(daylist, f"{', '.join(Cs)} are on different days")
+
+    # courses that should follow each other in the same day in the same venue
+    for Cs in courses_same:
+        daylist = [] # days
+        slotlist = [] # slots
+        venuelist = [] # venues
+        assert(2 <= len(Cs) <= max_times)
+        for C in Cs:
+            daylist.append(course_index("day", Courses[C]))
+            slotlist.append(cs[Courses[C]])
+            venuelist.append(cv[Courses[C]])
+        name = f"{', '.join(Cs)} follow each other"
+        add_all_equal(daylist, len(days), name)
+        add_all_equal(venuelist, len(venues), name)
+        # different slots of the day within a span of len(Cs) slots, i.e. one block
+        add_all_different(slotlist, name)
+        if len(Cs) < max_times:
+            for s1 in slotlist:
+                for s2 in slotlist:
+                    if s1 is not s2:
+                        hard(model.Add(s1 - s2 <= len(Cs) - 1), name)
+
+    for (C, R) in cr_not.items():
+        hard(model.Add(course_channel("room", Courses[C], Rooms[R]) == 0), f"{C} is not in {R}")
+
+    for (C, R) in cr_strict.items():
+        hard(model.Add(course_channel("room", Courses[C], Rooms[R]) == 1), f"{C} is in {R}")
+
+    # community teachers must teach max 2 courses
+    for T in teachers_community:
+        hard(model.Add(sum(tc[(Teachers[T],c)] for c in t_courses[Teachers[T]]) <= 2), f"{T} teaches at most 2 courses (community teacher)")
+    # community teachers must teach together with core teachers
+    for C in courses_regular:
+        hard(model.Add(sum(tc[(Teachers[T],Courses[C])] for T in teachers_community if (Teachers[T],Courses[C]) in tc) <= 1), f"{C} has a core teacher")
+    # community teachers cannot teach solo courses
+    for C in courses_solo:
+        hard(model.Add(sum(tc[(Teachers[T],Courses[C])] for T in teachers_community if (Teachers[T],Courses[C]) in tc) == 0), f"{C} has no community teacher")
+
+
+    # Rather specific constraints:
+
+    # Damian
+    profile_mark("damian")
+    damian = True
+    if damian and t_util_max.get("Pavli", 0) >= 2 and t_util_max.get("Tom-K.", 0) >= 1 and "mosilana" in Venues and max_times >= 3:
+        hard(model.Add(sum(tc[(Teachers["Tom-K."],c)] for c in t_courses[Teachers["Tom-K."]]) == 1), "Damian")
+        hard(model.Add(sum(tc[(Teachers["Pavli"],c)] for c in t_courses[Teachers["Pavli"]]) == 2), "Damian")
+        for T in ["Tom-K.", "Pavli"]:
+            if args.formulation == "bool":
+                hard(model.Add(sum(tscv[(Teachers[T],s,c,Venues["mosilana"])] for s in range(len(slots)) for c in range(len(courses)) if (Teachers[T],s,c,Venues["mosilana"]) in tscv) == 0), "Damian")
+            else:
+                hard(model.Add(sum(tdv[(Teachers[T],d,Venues["mosilana"])] for d in range(len(days))) == 0), "Damian")
+        # on a day with at least three times
+        damian_days = [d for d in range(len(days)) if len(day_slots[d]) >= 3]
+        damianday = model.NewIntVarFromDomain(cp_model.Domain.FromValues(damian_days), "damianday")
+        for d in damian_days:
+            hit = model.NewBoolVar("")
+            model.Add(damianday == d).OnlyEnforceIf(hit)
+            model.Add(damianday != d).OnlyEnforceIf(hit.Not())
+            s = day_slots[d].start
+            hard(model.Add(ts.get((Teachers["Tom-K."],s+0), 0) == 1).OnlyEnforceIf(hit), "Damian")
+            hard(model.Add(ts.get((Teachers["Pavli"],s+1), 0) == 1).OnlyEnforceIf(hit), "Damian")
+            hard(model.Add(ts.get((Teachers["Pavli"],s+2), 0) == 1).OnlyEnforceIf(hit), "Damian")
+
+    # symmetry breaking could cut off the solutions diagnosis looks for
+    if args.symmetry_breaking and not args.diagnose:
+        profile_mark("symmetry")
+        add_symmetry_breaking()
+
+    # PENALTIES
+
+    penalties = {} # penalties data (model variables)
+
+    for (name, coeff) in PENALTIES.items():
+        if coeff == 0:
+            warn(f"Penalties: skipping '{name}'")
+            continue
+        profile_mark(name)
+        encoding = penalty_encoding(name)
+        if name == "utilization":
+            # teaching should be as close to preferences as possible
+            penalties_utilization = []
+            for T in t_util_ideal:
+                t = Teachers[T]
+                util_ideal = t_util_ideal[T]
+                MAX_DIFF = 10 # set according to preferences form
+                if encoding == "compact":
+                    # squared difference for every possible number of courses
+                    util_diff_sq = element_var([(n - util_ideal)**2 for n in range(min(len(slots), util_ideal+MAX_DIFF)+1)], teach_num[t])
+                    penalties_utilization.append(util_diff_sq)
+                    continue
+                min_diff = -MAX_DIFF
+                max_diff = MAX_DIFF
+                util_diff = model.NewIntVar(min_diff, max_diff, "")
+                model.Add(util_diff == teach_num[t] - util_ideal)
+                util_diff_abs = model.NewIntVar(0, abs(MAX_DIFF), "")
+                model.AddAbsEquality(util_diff_abs, util_diff)
+                util_diff_abs_sq = model.NewIntVar(0, abs(MAX_DIFF)**2, "")
+                model.AddMultiplicationEquality(util_diff_abs_sq, [util_diff_abs, util_diff_abs])
+                penalties_utilization.append(util_diff_abs_sq)
+            penalties[name] = penalties_utilization
+        elif name == "days":
+            # nobody should come more days then necessary
+            penalties_days = []
             for t in range(len(teachers)):
-                T = teachers[t]
-                cs = []
-                for c in range(len(courses)):
-                    if tc[(t,c)]:
-                        cs.append(c)
-                bad_slots = []
-                n = 0
+                if encoding == "compact":
+                    penalties_days.append(extra_days_squared(teach_num[t], [td[(t,d)] for d in range(len(days))]))
+                    continue
+                teaches_days = model.NewIntVar(0, len(days), "TD:%i" % t)
+                model.Add(teaches_days == sum(td[(t,d)] for d in range(len(days))))
+                teaches_minus_1 = model.NewIntVar(0, len(slots), "Tm1:%i" % t)
+                teaches_some = model.NewBoolVar("Ts:%i" % t)
+                model.Add(teach_num[t] >= 1).OnlyEnforceIf(teaches_some)
+                model.Add(teach_num[t] == 0).OnlyEnforceIf(teaches_some.Not())
+                model.Add(teaches_minus_1 == teach_num[t] - 1).OnlyEnforceIf(teaches_some)
+                model.Add(teaches_minus_1 == 0).OnlyEnforceIf(teaches_some.Not())
+                should_teach_days = model.NewIntVar(0, len(days), "TDs:%i" % t)
+                model.AddElement(teaches_minus_1, [days_needed(n+1)-1 for n in range(len(slots))], should_teach_days) # -1 as with rounding down
+                days_extra = model.NewIntVar(0, len(days), "Tdd:%i" % t)
+                model.Add(days_extra == teaches_days - should_teach_days - 1).OnlyEnforceIf(teaches_some) # -1 to compensate rounding down
+                model.Add(days_extra == 0).OnlyEnforceIf(teaches_some.Not())
+                days_extra_sq = model.NewIntVar(0, len(days)**2, "Tdds:%i" % t)
+                model.AddMultiplicationEquality(days_extra_sq, [days_extra, days_extra])
+                penalties_days.append(days_extra_sq)
+            penalties[name] = penalties_days
+        elif name == "occupied_days":
+            # nobody should come more days then necessary - including attending courses
+            penalties_occupied_days = []
+            for p in range(len(people)):
+                if encoding == "compact":
+                    penalties_occupied_days.append(extra_days_squared(occupied_num[p], [pd[(p,d)] for d in range(len(days))]))
+                    continue
+                occupied_days = model.NewIntVar(0, len(days), "")
+                model.Add(occupied_days == sum(pd[(p,d)] for d in range(len(days))))
+                occupied_some = model.NewBoolVar("")
+                model.Add(occupied_num[p] >= 1).OnlyEnforceIf(occupied_some)
+                model.Add(occupied_num[p] == 0).OnlyEnforceIf(occupied_some.Not())
+                occupied_minus_1 = model.NewIntVar(0, len(slots), "")
+                model.Add(occupied_minus_1 == occupied_num[p] - 1).OnlyEnforceIf(occupied_some)
+                model.Add(occupied_minus_1 == 0).OnlyEnforceIf(occupied_some.Not())
+                should_occupy_days = model.NewIntVar(0, len(days), "")
+                model.AddElement(occupied_minus_1, [days_needed(n+1)-1 for n in range(len(slots))], should_occupy_days) # -1 as with rounding down
+                occupied_days_extra = model.NewIntVar(0, len(days), "")
+                model.Add(occupied_days_extra == occupied_days - should_occupy_days - 1).OnlyEnforceIf(occupied_some) # -1 to compensate rounding down
+                model.Add(occupied_days_extra == 0).OnlyEnforceIf(occupied_some.Not())
+                occupied_days_extra_sq = model.NewIntVar(0, len(days)**2, "")
+                model.AddMultiplicationEquality(occupied_days_extra_sq, [occupied_days_extra, occupied_days_extra])
+                penalties_occupied_days.append(occupied_days_extra_sq)
+            penalties[name] = penalties_occupied_days
+        elif name == "split":
+            # teacher should not wait between lessons: every free time with a lesson
+            # before and after it in the same day (with three times a day, teaching
+            # just the first and the last one)
+            penalties_split = []
+            for t in range(len(teachers)):
+                if encoding == "compact":
+                    for d in range(len(days)):
+                        # clauses on TS literals, "some lesson before/after" literals for more than three times
+                        day_ts = [ts.get((t,s)) for s in day_slots[d]]
+                        for i in range(1, len(day_ts)-1):
+                            (first, middle, last) = (any_literal(day_ts[:i]), day_ts[i], any_literal(day_ts[i+1:]))
+                            if first is None or last is None:
+                                continue
+                            tsplit = model.NewBoolVar("tsplit:t%id%ii%i" % (t,d,i))
+                            lits = [first, middle.Not(), last] if middle is not None else [first, last]
+                            model.AddBoolAnd(lits).OnlyEnforceIf(tsplit)
+                            model.AddBoolOr([x.Not() for x in lits] + [tsplit])
+                            penalties_split.append(tsplit)
+                    continue
+                days_split = model.NewIntVar(0, sum(max(len(ss)-2, 0) for ss in day_slots), "TDsplit:%i" % t)
+                tsplits = []
+                for d in range(len(days)):
+                    tsubsplits = []
+                    for (i, s) in enumerate(day_slots[d]):
+                        tsubsplit = model.NewBoolVar("tsubsplit:t%id%ii%i" % (t,d,i))
+                        model.Add(sum(ts[k] for k in [(t,s)] if k in ts) == 1).OnlyEnforceIf(tsubsplit)
+                        model.Add(sum(ts[k] for k in [(t,s)] if k in ts) == 0).OnlyEnforceIf(tsubsplit.Not())
+                        tsubsplits.append(tsubsplit)
+                    for i in range(1, len(day_slots[d])-1):
+                        # tsplit == True iff teacher t teaches before and after time i in day d, but not in i
+                        (before, after) = (reified_any(tsubsplits[:i]), reified_any(tsubsplits[i+1:]))
+                        tsplit = model.NewBoolVar("tsplit:t%id%ii%i" % (t,d,i))
+                        model.AddBoolAnd([before, tsubsplits[i].Not(), after]).OnlyEnforceIf(tsplit)
+                        model.AddBoolOr([before.Not(), tsubsplits[i], after.Not()]).OnlyEnforceIf(tsplit.Not())
+                        tsplits.append(tsplit)
+                model.Add(days_split == sum(tsplits))
+                penalties_split.append(days_split)
+            penalties[name] = penalties_split
+        elif name == "slotpref_bad":
+            # slots preferences
+            penalties_slotpref_bad = []
+            for T in teachers:
                 if T in ts_pref:
                     prefs = ts_pref[T]
                     if set([1,2]) <= set(prefs) or set([1,3]) <= set(prefs):
-                        for s in range(len(slots)):
-                            if ts_pref[T][s] == 1:
-                                if sum(src[(s,r,c)] for r in range(len(rooms)) for c in cs) >= 1:
-                                    bad_slots.append(s)
-                                    n += 1
-                if bad_slots:
-                    debug(f"analysis slotpref_bad - teacher {T} courses {cs} bad_slots {bad_slots}")
-                    result.append(f"{T}/{n}-{','.join([str(s) for s in bad_slots])}")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "slotpref_slight":
-        # slots preferences
-        penalties_slotpref_slight = []
-        for T in teachers:
-            if T in ts_pref:
-                prefs = ts_pref[T]
-                if set([2,3]) <= set(prefs):
-                    # teacher T slightly prefers some slots over others
-                    slots_bad = [s for s in range(len(slots)) if prefs[s] == 2]
-                    penalties_slotpref_slight.append(sum(ts[(Teachers[T],s)] for s in slots_bad))
-        penalties[name] = penalties_slotpref_slight
-        def analysis(src, tc):
-            result = []
-            for t in range(len(teachers)):
-                T = teachers[t]
-                cs = []
-                for c in range(len(courses)):
-                    if tc[(t,c)]:
-                        cs.append(c)
-                bad_slots = []
-                n = 0
+                        # teacher T strongly prefers some slots over others
+                        slots_bad = [s for s in range(len(slots)) if prefs[s] == 1]
+                        penalties_slotpref_bad.append(sum(ts[(Teachers[T],s)] for s in slots_bad))
+            penalties[name] = penalties_slotpref_bad
+        elif name == "slotpref_slight":
+            # slots preferences
+            penalties_slotpref_slight = []
+            for T in teachers:
                 if T in ts_pref:
                     prefs = ts_pref[T]
                     if set([2,3]) <= set(prefs):
-                        for s in range(len(slots)):
-                            if ts_pref[T][s] == 2:
-                                if sum(src[(s,r,c)] for r in range(len(rooms)) for c in cs) >= 1:
-                                    bad_slots.append(s)
-                                    n += 1
-                if bad_slots:
-                    debug(f"analysis slotpref_slight - teacher {T} courses {cs} bad_slots {bad_slots}")
-                    result.append(f"{T}/{n}-{','.join([str(s) for s in bad_slots])}")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "coursepref_bad":
-        # slots preferences
-        penalties_coursepref = []
-        for T in teachers:
-            if T in tc_pref:
-                spv = set(tc_pref[T].values())
-                if set([1,2]) <= spv and set([1,3]) <= spv:
-                    # teacher T strongly prefers some courses over others
-                    courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 1]
-                    penalties_coursepref.append(sum(tc[(Teachers[T],Courses[C])] for C in courses_bad))
-        penalties[name] = penalties_coursepref
-        def analysis(src, tc):
-            result = []
-            for t in range(len(teachers)):
-                T = teachers[t]
-                courses_bad = []
+                        # teacher T slightly prefers some slots over others
+                        slots_bad = [s for s in range(len(slots)) if prefs[s] == 2]
+                        penalties_slotpref_slight.append(sum(ts[(Teachers[T],s)] for s in slots_bad))
+            penalties[name] = penalties_slotpref_slight
+        elif name == "coursepref_bad":
+            # slots preferences
+            penalties_coursepref = []
+            for T in teachers:
                 if T in tc_pref:
                     spv = set(tc_pref[T].values())
                     if set([1,2]) <= spv and set([1,3]) <= spv:
                         # teacher T strongly prefers some courses over others
-                        courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 1 and tc[(t,Courses[C])]]
-                if courses_bad:
-                    debug(f"analysis coursepref_bad - teacher {T} courses {courses_bad}")
-                    result.append(f"{T}/{len(courses_bad)}")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "coursepref_slight":
-        # slots preferences
-        penalties_coursepref = []
-        for T in teachers:
-            if T in tc_pref:
-                if set([2,3]) <= set(tc_pref[T].values()):
-                    # teacher T strongly prefers some courses over others
-                    courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 2]
-                    penalties_coursepref.append(sum(tc[(Teachers[T],Courses[C])] for C in courses_bad))
-        penalties[name] = penalties_coursepref
-        def analysis(src, tc):
-            result = []
-            for t in range(len(teachers)):
-                T = teachers[t]
-                courses_bad = []
+                        courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 1]
+                        penalties_coursepref.append(sum(tc[(Teachers[T],Courses[C])] for C in courses_bad if (Teachers[T],Courses[C]) in tc))
+            penalties[name] = penalties_coursepref
+        elif name == "coursepref_slight":
+            # slots preferences
+            penalties_coursepref = []
+            for T in teachers:
                 if T in tc_pref:
                     if set([2,3]) <= set(tc_pref[T].values()):
                         # teacher T strongly prefers some courses over others
-                        courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 2 and tc[(t,Courses[C])]]
-                if courses_bad:
-                    debug(f"analysis coursepref_slight teacher {T} courses {courses_bad}")
-                    result.append(f"{T}/{len(courses_bad)}")
-            return result
-        penalties_analysis[name] = analysis
-    elif name == "faketeachers":
-        penalties_faketeachers = []
-        # fake teachers
-        for T in FAKE_TEACHERS:
-            if T in teachers:
-                penalties_faketeachers.append(sum(tc[(Teachers[T],c)] for c in range(len(courses))))
-        penalties[name] = penalties_faketeachers
-    elif name == "mosilana": # penalty for not using koliste
-        util_koliste = model.NewIntVar(0, 2*len(slots), "") # utilization of Koliste
-        model.Add(util_koliste == sum(src[(s,r,c)] for s in range(len(slots)) for r in range(len(rooms)) if rooms_venues[rooms[r]] == "koliste" for c in range(len(courses))))
-        free_koliste = model.NewIntVar(0, 2*len(slots), "") # free slots in Koliste
-        model.Add(free_koliste == 2*len(slots)-util_koliste-1) # -1 for Teachers Training
-        penalties[name] = [free_koliste]
-    elif name == "attend_free": # penalty if interested in attending cannot attend (they teach something else in the same time)
-        # courses that some teachers would like to attend
-        courses_attend = [input_data[T]["courses_attend"] for T in input_data]
-        courses_attend = [item for sl in courses_attend for item in sl] # flatten sublists
-        courses_attend = list(set(courses_attend)) # unique course names
-        debug(f"attend_free: courses_attend {courses_attend}")
-        for C in courses_attend:
-            debug(f"attend_free: courses {C}")
-            teachers_attend = []
-            for T in input_data:
-                if C in input_data[T]["courses_attend"]:
-                    teachers_attend.append(T)
-            debug(f"attend_free: teachers_attend {teachers_attend}")
-            #t = Teachers[T]
+                        courses_bad = [C for C in courses_regular+courses_solo if tc_pref[T].get(C, -1) == 2]
+                        penalties_coursepref.append(sum(tc[(Teachers[T],Courses[C])] for C in courses_bad if (Teachers[T],Courses[C]) in tc))
+            penalties[name] = penalties_coursepref
+        elif name == "faketeachers":
+            penalties_faketeachers = []
+            # fake teachers
+            for T in FAKE_TEACHERS:
+                if T in teachers:
+                    penalties_faketeachers.append(sum(tc[(Teachers[T],c)] for c in t_courses[Teachers[T]]))
+            penalties[name] = penalties_faketeachers
+        elif name == "mosilana": # penalty for not using the preferred venues (koliste)
+            rooms_preferred = [r for r in range(len(rooms)) if rooms_venues[rooms[r]] in venues_preferred]
+            capacity = len(slots) * len(rooms_preferred)
+            # the other preferred rooms are empty while a course takes place alone
+            capacity -= len(courses_alone) * max(len(rooms_preferred) - 1, 0)
+            util_preferred = model.NewIntVar(0, capacity+len(courses_alone), "") # utilization of the preferred venues
+            model.Add(util_preferred == sum(course_channel("room", c, r) for r in rooms_preferred for c in range(len(courses))))
+            free_preferred = model.NewIntVar(0, capacity, "") # free slots in the preferred venues
+            model.Add(free_preferred == capacity-util_preferred)
+            penalties[name] = [free_preferred]
+        elif name == "attend_free": # penalty if interested in attending cannot attend (they teach something else in the same time)
+            # courses that some teachers would like to attend
+            courses_attend = [input_data[T]["courses_attend"] for T in input_data]
+            courses_attend = [item for sl in courses_attend for item in sl] # flatten sublists
+            courses_attend = list(set(courses_attend)) # unique course names
+            debug(f"attend_free: courses_attend {courses_attend}")
             penalties_attend_free = []
-            for s in range(len(slots)):
-                hit = model.NewBoolVar("")
-                model.Add(cs[Courses[C]] == s).OnlyEnforceIf(hit)
-                model.Add(cs[Courses[C]] != s).OnlyEnforceIf(hit.Not())
-                penalty_slot = model.NewIntVar(0, len(teachers_attend)-1, "") # penalty for the slot
-                model.Add(penalty_slot == sum(ts[(Teachers[T],s)] for T in teachers_attend)).OnlyEnforceIf(hit)
-                model.Add(penalty_slot == 0).OnlyEnforceIf(hit.Not())
-                penalties_attend_free.append(penalty_slot)
-        penalties[name] = penalties_attend_free
-    elif name == "teach_together": # penalty if interested in teaching with Ts but teaches with noone
-        penalties_teach_together = []
-        # teachers with teach_together preferences
-        Ts = [T for T in input_data if input_data[T]["teach_together"]]
-        for T in Ts:
-            debug(f"teach_together: {T} + {input_data[T]['teach_together']}")
-            t = Teachers[T]
-            success_list = []
-            for c in range(len(courses)):
-                hit_self = model.NewBoolVar("")
-                hit_other = model.NewBoolVar("")
-                success = model.NewBoolVar("")
-                model.Add(tc[(t,c)] == 1).OnlyEnforceIf(hit_self)
-                model.Add(tc[(t,c)] == 0).OnlyEnforceIf(hit_self.Not())
-                model.Add(sum(tc[(Teachers[To],c)] for To in input_data[T]["teach_together"]) >= 1).OnlyEnforceIf(hit_other)
-                model.Add(sum(tc[(Teachers[To],c)] for To in input_data[T]["teach_together"]) == 0).OnlyEnforceIf(hit_other.Not())
-                model.AddBoolAnd([hit_self, hit_other]).OnlyEnforceIf(success)
-                model.AddBoolOr([hit_self.Not(), hit_other.Not()]).OnlyEnforceIf(success.Not())
-                success_list.append(success)
-            nobody = model.NewBoolVar("")
-            model.Add(sum(success_list) == 0).OnlyEnforceIf(nobody)
-            model.Add(sum(success_list) >= 1).OnlyEnforceIf(nobody.Not())
-            penalties_teach_together.append(nobody)
-        penalties[name] = penalties_teach_together
-        def analysis(src, tc):
-            result = []
+            for C in courses_attend:
+                debug(f"attend_free: courses {C}")
+                teachers_attend = []
+                for T in input_data:
+                    if C in input_data[T]["courses_attend"]:
+                        teachers_attend.append(T)
+                debug(f"attend_free: teachers_attend {teachers_attend}")
+                for s in range(len(slots)):
+                    hit = course_channel("slot", Courses[C], s)
+                    if encoding == "compact":
+                        # one literal per attending teacher teaching in the slot of the course
+                        lits = []
+                        for T in teachers_attend:
+                            if (Teachers[T],s) not in ts:
+                                continue
+                            x = model.NewBoolVar("")
+                            model.AddBoolAnd([hit, ts[(Teachers[T],s)]]).OnlyEnforceIf(x)
+                            model.AddBoolOr([hit.Not(), ts[(Teachers[T],s)].Not(), x])
+                            lits.append(x)
+                        if lits and len(lits) == len(teachers_attend):
+                            # at most all but one of them (bound of the reified penalty)
+                            model.AddBoolOr([x.Not() for x in lits])
+                        penalties_attend_free += lits
+                        continue
+                    penalty_slot = model.NewIntVar(0, len(teachers_attend)-1, "") # penalty for the slot
+                    model.Add(penalty_slot == sum(ts[(Teachers[T],s)] for T in teachers_attend if (Teachers[T],s) in ts)).OnlyEnforceIf(hit)
+                    model.Add(penalty_slot == 0).OnlyEnforceIf(hit.Not())
+                    penalties_attend_free.append(penalty_slot)
+            penalties[name] = penalties_attend_free
+        elif name == "teach_together": # penalty if interested in teaching with Ts but teaches with noone
+            penalties_teach_together = []
+            # teachers with teach_together preferences
             Ts = [T for T in input_data if input_data[T]["teach_together"]]
             for T in Ts:
-                debug(f"analysis teach_together: teacher {T}")
+                debug(f"teach_together: {T} + {input_data[T]['teach_together']}")
                 t = Teachers[T]
-                teachers_prefered = [Teachers[To] for To in input_data[T]["teach_together"]]
-                debug(f"analysis teach_together: teachers_prefered {teachers_prefered}")
-                teach_courses = [c for c in range(len(courses)) if tc[(t,c)]]
-                debug(f"analysis teach_together: teach_courses {teach_courses}")
-                success_courses = []
-                for c in teach_courses:
-                    if sum(tc[to,c] for to in teachers_prefered) >= 1:
-                        success_courses.append(c)
-                #success_courses = [c for c in teach_courses for to in teachers_prefered if sum([(to,c)]) >= 1]
-                debug(f"analysis teach_together: success_courses {[courses[x] for x in success_courses]}")
-                if not success_courses:
-                    result.append(f"{T}")
-            return result
-        penalties_analysis[name] = analysis
-
-penalties_values = []
-for (name, l) in penalties.items():
-    penalties_values.append(PENALTIES[name] * sum(l))
-
-model.Minimize(sum(penalties_values))
-
-print(model.ModelStats())
-print()
+                if encoding == "compact":
+                    # success == T teaches C together with some of Ts, clauses on TC literals
+                    success_list = []
+                    for c in t_courses[t]:
+                        others = [tc[(Teachers[To],c)] for To in input_data[T]["teach_together"] if (Teachers[To],c) in tc]
+                        if not others:
+                            continue
+                        success = model.NewBoolVar("")
+                        model.AddImplication(success, tc[(t,c)])
+                        model.AddBoolOr(others).OnlyEnforceIf(success)
+                        for x in others:
+                            model.AddBoolOr([tc[(t,c)].Not(), x.Not(), success])
+                        success_list.append(success)
+                    nobody = model.NewBoolVar("")
+                    for success in success_list:
+                        model.AddImplication(success, nobody.Not())
+                    model.AddBoolOr(success_list + [nobody])
+                    penalties_teach_together.append(nobody)
+                    continue
+                success_list = []
+                for c in t_courses[t]:
+                    hit_self = model.NewBoolVar("")
+                    hit_other = model.NewBoolVar("")
+                    success = model.NewBoolVar("")
+                    model.Add(tc[(t,c)] == 1).OnlyEnforceIf(hit_self)
+                    model.Add(tc[(t,c)] == 0).OnlyEnforceIf(hit_self.Not())
+                    model.Add(sum(tc[(Teachers[To],c)] for To in input_data[T]["teach_together"] if (Teachers[To],c) in tc) >= 1).OnlyEnforceIf(hit_other)
+                    model.Add(sum(tc[(Teachers[To],c)] for To in input_data[T]["teach_together"] if (Teachers[To],c) in tc) == 0).OnlyEnforceIf(hit_other.Not())
+                    model.AddBoolAnd([hit_self, hit_other]).OnlyEnforceIf(success)
+                    model.AddBoolOr([hit_self.Not(), hit_other.Not()]).OnlyEnforceIf(success.Not())
+                    success_list.append(success)
+                nobody = model.NewBoolVar("")
+                model.Add(sum(success_list) == 0).OnlyEnforceIf(nobody)
+                model.Add(sum(success_list) >= 1).OnlyEnforceIf(nobody.Not())
+                penalties_teach_together.append(nobody)
+            penalties[name] = penalties_teach_together
+        elif name == "stability": # penalty for changes against the previous schedule
+            if not previous:
+                debug("stability: no previous schedule")
+                continue
+            penalties_stability = []
+            for (c, (s, r, prev_ts)) in previous.items():
+                # course C moved to another slot or room
+                moved = model.NewBoolVar("")
+                kept = [course_channel(kind, c, i) for (kind, i) in [("slot", s), ("room", r)] if i is not None]
+                for x in kept:
+                    model.AddImplication(x.Not(), moved)
+                # (exact, so that intermediate solutions report real changes)
+                model.AddBoolOr([x.Not() for x in kept]).OnlyEnforceIf(moved)
+                penalties_stability.append(moved)
+                # some of the previous teachers of course C does not teach it anymore
+                if prev_ts:
+                    changed = model.NewBoolVar("")
+                    for t in prev_ts:
+                        if (t,c) in tc:
+                            model.AddImplication(tc[(t,c)].Not(), changed)
+                        else:
+                            model.Add(changed == 1)
+                    if all((t,c) in tc for t in prev_ts):
+                        model.AddBoolOr([tc[(t,c)].Not() for t in prev_ts]).OnlyEnforceIf(changed)
+                    penalties_stability.append(changed)
+            penalties[name] = penalties_stability
+
+    profile_mark("objective")
+    penalties_values = []
+    for (name, l) in penalties.items():
+        penalties_values.append(PENALTIES[name] * sum(l))
+
+    model.Minimize(sum(penalties_values))
+    profile_mark(None)
 
 def print_solution(src, tc, penalties, objective=None, utilization=True):
     if objective:
         print(f"Objective value: {objective}")
-    for s in range(len(slots)):
-        for r in range(len(rooms)):
-            for c in range(len(courses)):
-                if src[(s,r,c)]:
-                    Ts = []
-                    if courses[c] in courses_open:
-                        Ts.append("OPEN\t")
-                    elif courses[c] in courses_solo:
-                        for t in range(len(teachers)):
-                            #if solver.Value(tc[(t,c)]):
-                            if tc[(t,c)]:
-                                Ts.append(teachers[t] + "\t")
-                                break
-                    elif courses[c] in courses_regular:
-                        for t in range(len(teachers)):
-                            if tc[(t,c)]:
-                                Ts.append(teachers[t])
-                    if len(Ts) == 2 and Ts[0] in teachers_follow:
-                        Ts[0], Ts[1] = Ts[1], Ts[2]
-                    print(f"{slots[s]}\t {rooms[r]}\t{'+'.join(Ts)}\t{courses[c]}")
+    for (s,r,c) in zip(*np.nonzero(src)):
+        Ts = []
+        if courses[c] in courses_open:
+            Ts.append("OPEN\t")
+        elif courses[c] in courses_solo:
+            Ts += [teachers[t] + "\t" for t in np.flatnonzero(tc[:,c])[:1]]
+        elif courses[c] in courses_regular:
+            Ts += [teachers[t] for t in np.flatnonzero(tc[:,c])]
+        if len(Ts) == 2 and Ts[0] in teachers_follow:
+            Ts[0], Ts[1] = Ts[1], Ts[0]
+        print(f"{slots[s]}\t {rooms[r]}\t{'+'.join(Ts)}\t{courses[c]}")
     if penalties:
         print("Penalties:")
         total = 0
@@ -1200,73 +2582,997 @@ def print_solution(src, tc, penalties, objective=None, utilization=True):
                 print(f"{name}: {v} * {coeff} = {v*coeff} ({', '.join(penalties_analysis[name](src, tc))})")
     if utilization:
         debug("UTILIZATION:")
-        tn = {}
-        for t in range(len(teachers)):
-            tn[teachers[t]] = sum(tc[t,c] for c in range(len(courses)))
-        for v in sorted(set(tn.values())):
-            print(f"{v}: {', '.join(t for t in tn if tn[t] == v)}")
+        tn = tc.sum(axis=1)
+        for v in np.unique(tn):
+            print(f"{v}: {', '.join(teachers[t] for t in np.flatnonzero(tn == v))}")
     print(f"TOTAL: {total}")
 
 
-class ContinuousSolutionPrinter(cp_model.CpSolverSolutionCallback):
-    def __init__(self):
-        self.count = 0
-        cp_model.CpSolverSolutionCallback.__init__(self)
-
-    def OnSolutionCallback(self):
-        self.count += 1
-        result_src = {}
-        for s in range(len(slots)):
-            for r in range(len(rooms)):
-                for c in range(len(courses)):
-                        result_src[(s,r,c)] = self.Value(src[(s,r,c)])
-        result_tc = {}
-        for t in range(len(teachers)):
-            for c in range(len(courses)):
-                result_tc[(t,c)] = self.Value(tc[(t,c)])
+decode_index = None
+
+def solution_index():
+    # proto variable indices of everything solution_values() decodes (computed once)
+    global decode_index
+    if decode_index is None:
+        tc_keys = sorted(tc)
+        decode_index = {
+            "cs": np.array([cs[c].Index() for c in range(len(courses))], dtype=int),
+            "room": np.array([[channels[("room", c, r)].Index() for r in range(len(rooms))] for c in range(len(courses))], dtype=int),
+            "tc_keys": tuple(np.array(tc_keys, dtype=int).T),
+            "tc": np.array([tc[k].Index() for k in tc_keys], dtype=int),
+            "ps": np.array([[ps[(p,s)].Index() for s in range(len(slots))] for p in range(len(people))], dtype=int),
+            "pd": np.array([[pd[(p,d)].Index() for d in range(len(days))] for p in range(len(people))], dtype=int),
+            "occupied_num": np.array([occupied_num[p].Index() for p in range(len(people))], dtype=int),
+            "penalties": {},
+        }
+        # every penalty as a linear expression over the solution vector
+        for (name, l) in penalties.items():
+            (indices, coeffs, constant) = ([], [], 0)
+            for e in l:
+                (e_coeffs, e_constant) = expr_indices(e)
+                indices += e_coeffs.keys()
+                coeffs += e_coeffs.values()
+                constant += e_constant
+            decode_index["penalties"][name] = (np.array(indices, dtype=int), np.array(coeffs, dtype=int), constant)
+    return decode_index
+
+def solution_values(solution):
+    # extract solution (src, tc, penalties) from a raw solution vector (indexed by proto variable index)
+    x = np.fromiter(solution, dtype=np.int64, count=len(solution))
+    index = solution_index()
+    result_src = np.zeros((len(slots), len(rooms), len(courses)), dtype=np.int8)
+    (c, r) = np.nonzero(x[index["room"]])
+    result_src[x[index["cs"]][c], r, c] = 1
+    result_tc = np.zeros((len(teachers), len(courses)), dtype=np.int8)
+    result_tc[index["tc_keys"]] = x[index["tc"]]
+    result_penalties = {}
+    for (name, (indices, coeffs, constant)) in index["penalties"].items():
+        result_penalties[name] = (PENALTIES[name], int(constant + x[indices] @ coeffs))
+    return (result_src, result_tc, result_penalties)
+
+def print_progress(count, wall_time, objective, solution):
+    result_src, result_tc, result_penalties = solution_values(solution)
+    if VERBOSE:
+        index = solution_index()
+        x = np.fromiter(solution, dtype=np.int64, count=len(solution))
+        (x_ps, x_pd, x_num) = (x[index["ps"]], x[index["pd"]], x[index["occupied_num"]])
         for p in range(len(people)):
             m = f"ps/pd analysis: {people[p]}\t"
             m += " slots "
-            for s in range(len(slots)):
-                if self.Value(ps[(p,s)]):
-                    m += "1"
-                else:
-                    m += "0"
+            m += "".join(map(str, x_ps[p]))
             m += " num "
-            m += f"{self.Value(occupied_num[p])}"
+            m += f"{x_num[p]}"
             m += " days "
-            for d in range(len(days)):
-                if self.Value(pd[(p,d)]):
-                    m += "1"
-                else:
-                    m += "0"
+            m += "".join(map(str, x_pd[p]))
             debug(m)
-        result_penalties = {}
-        for (name, l) in penalties.items():
-            v = sum([self.Value(p) for p in l])
-            coeff = PENALTIES[name]
-            result_penalties[name] = (coeff, v)
-        print(f"No: {self.count}")
-        print(f"Wall time: {self.WallTime()}")
-        #print(f"Branches: {self.NumBranches()}")
-        #print(f"Conflicts: {self.NumConflicts()}")
-        print_solution(result_src, result_tc, result_penalties, self.ObjectiveValue())
-        print()
-
-solver = cp_model.CpSolver()
-#solver.parameters.max_time_in_seconds = 20.0
-status = solver.SolveWithSolutionCallback(model, ContinuousSolutionPrinter())
-statusname = solver.StatusName(status)
-print(f"Solving finished in {solver.WallTime()} seconds with status {status} - {statusname}")
-if statusname not in ["FEASIBLE", "OPTIMAL"]:
-    error(f"Solution NOT found - status {statusname}")
-
-print()
-print(f"Teachers' utilization:")
-for n in range(len(slots)):
-    Ts = []
+    print(f"No: {count}")
+    print(f"Wall time: {wall_time}")
+    print_solution(result_src, result_tc, result_penalties, objective)
+    print()
+
+ContinuousSolutionPrinter = None
+
+def define_solution_printer():
+    # the class derives from OR-Tools, so it is defined once they are imported
+    global ContinuousSolutionPrinter
+    class ContinuousSolutionPrinter(cp_model.CpSolverSolutionCallback):
+        # the solver thread only copies the raw solution, printing happens in a background
+        # thread; with --progress-interval/--progress-improvement only some solutions are
+        # printed, the last one is always printed by finish()
+        def __init__(self):
+            cp_model.CpSolverSolutionCallback.__init__(self)
+            self.count = 0
+            self.callback_time = 0
+            self.pending = None # (count, wall time, objective, solution) waiting to be printed
+            self.due = False # pending should be printed now
+            self.printed_time = None
+            self.printed_objective = None
+            self.finished = False
+            self.condition = threading.Condition()
+            self.thread = threading.Thread(target=self.printer, daemon=True)
+            self.thread.start()
+
+        def OnSolutionCallback(self):
+            start = time.time()
+            self.count += 1
+            wall_time = self.WallTime()
+            objective = self.ObjectiveValue()
+            due = self.printed_time is None \
+                or (wall_time - self.printed_time >= args.progress_interval
+                    and self.printed_objective - objective > args.progress_improvement)
+            with self.condition:
+                self.pending = (self.count, wall_time, objective, self.Response().solution)
+                if due:
+                    self.due = True
+                    self.printed_time = wall_time
+                    self.printed_objective = objective
+                    self.condition.notify()
+            self.callback_time += time.time() - start
+
+        def take(self):
+            (pending, self.pending) = (self.pending, None)
+            return pending
+
+        def printer(self):
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.finished or self.due)
+                    if self.finished:
+                        return
+                    self.due = False
+                    pending = self.take()
+                if pending:
+                    print_progress(*pending)
+
+        def finish(self):
+            # stop the printing thread and print the last solution if it was skipped
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+            self.thread.join()
+            pending = self.take()
+            if pending:
+                print_progress(*pending)
+            debug(f"Solution callback: {self.count} solutions, {self.callback_time:.3f} seconds in the solver thread")
+
+def configure_solver(solver, seed):
+    if args.workers:
+        solver.parameters.num_search_workers = args.workers
+    if args.time_limit:
+        solver.parameters.max_time_in_seconds = args.time_limit
+    solver.parameters.random_seed = seed
+    solver.parameters.log_search_progress = args.log
+    if args.parameters:
+        from google.protobuf import text_format
+        text_format.Merge(args.parameters, solver.parameters)
+
+def portfolio_solve(job):
+    # runs in a forked worker process, so the model built above is shared
+    (seed, workers) = job
+    solver = cp_model.CpSolver()
+    configure_solver(solver, seed)
+    solver.parameters.num_search_workers = workers
+    status = solver.Solve(model)
+    statusname = solver.StatusName(status)
+    if statusname not in ["FEASIBLE", "OPTIMAL"]:
+        return (seed, statusname, None, None, solver.WallTime(), None)
+    return (seed, statusname, solver.ObjectiveValue(), solver.BestObjectiveBound(), solver.WallTime(), solution_values(solver.ResponseProto().solution))
+
+def solve_model(m, name, callback=None, required=True):
+    # returns the solver (None if no solution is found and it is not required)
+    solver = cp_model.CpSolver()
+    configure_solver(solver, args.seed)
+    if callback:
+        status = solver.SolveWithSolutionCallback(m, callback)
+        callback.finish()
+    else:
+        status = solver.Solve(m)
+    statusname = solver.StatusName(status)
+    print(f"{name} finished in {solver.WallTime()} seconds with status {status} - {statusname}")
+    if statusname not in ["FEASIBLE", "OPTIMAL"]:
+        if not required:
+            return None
+        if statusname == "INFEASIBLE" and not args.diagnose:
+            error(f"Solution NOT found - status {statusname} (--diagnose finds the conflicting rules)")
+        error(f"Solution NOT found - status {statusname}")
+    return solver
+
+# total time of a diagnosis without --time-limit (seconds)
+DIAGNOSIS_TIME_LIMIT = 600
+
+def solve_assumptions(m, names, deadline):
+    # solve model M assuming the rules NAMES hold until DEADLINE, returns (status name, sufficient subset of NAMES)
+    m.ClearAssumptions()
+    m.AddAssumptions([guards[name] for name in names])
+    solver = cp_model.CpSolver()
+    configure_solver(solver, args.seed)
+    # with more workers the core is not reduced (every assumption is returned)
+    solver.parameters.num_search_workers = 1
+    solver.parameters.max_time_in_seconds = max(deadline - time.time(), 0)
+    status = solver.Solve(m)
+    statusname = solver.StatusName(status)
+    debug(f"Diagnosis: {len(names)} rules, status {statusname} in {solver.WallTime():.2f} seconds")
+    if statusname != "INFEASIBLE":
+        return (statusname, names)
+    core = set(solver.SufficientAssumptionsForInfeasibility())
+    return (statusname, [name for name in names if guards[name].Index() in core])
+
+def diagnose():
+    # returns a minimal list of rules (guard names) that cannot hold together, [] if all can
+    if not guards:
+        error("Model built without --diagnose, there is nothing to diagnose")
+    # --time-limit is the time of the whole diagnosis
+    deadline = time.time() + (args.time_limit or DIAGNOSIS_TIME_LIMIT)
+    m = model.Clone()
+    m.ClearObjective()
+    m.ClearHints()
+    (statusname, core) = solve_assumptions(m, list(guards), deadline)
+    if statusname != "INFEASIBLE":
+        print(f"Diagnosis: the rules are not in conflict (status {statusname})")
+        return []
+    if not core:
+        print("Diagnosis: the model is infeasible even without the rules, the conflict is in constraints --diagnose does not cover")
+        return []
+    # deletion: drop the rules the rest stays infeasible without
+    minimal = True
+    for name in list(core):
+        if name not in core:
+            continue # dropped with a smaller core
+        if time.time() >= deadline:
+            minimal = False
+            break
+        rest = [n for n in core if n != name]
+        (statusname, smaller) = solve_assumptions(m, rest, deadline)
+        if statusname == "INFEASIBLE":
+            core = smaller or rest
+        elif statusname != "FEASIBLE" and statusname != "OPTIMAL":
+            minimal = False
+    print(f"Conflicting rules{'' if minimal else ' (possibly not minimal, increase --time-limit)'}:")
+    for name in core:
+        print(f"  {name}")
+    return core
+
+def hint_solution(m, solution):
+    # replace the hints of model M with a whole solution
+    m.ClearHints()
+    hint = m.Proto().solution_hint
+    hint.vars.extend(range(len(solution)))
+    hint.values.extend(solution)
+
+def penalties_stages():
+    # PENALTIES_STAGES restricted to the penalties of the model, the rest last
+    stages = [[name for name in names if name in penalties] for names in PENALTIES_STAGES]
+    staged = [name for names in stages for name in names]
+    stages.append([name for name in penalties if name not in staged])
+    return [names for names in stages if names]
+
+def schedule_distance(a, b):
+    # courses in a different slot + differing teacher assignments of two decoded solutions
+    ((src_a, tc_a), (src_b, tc_b)) = (a, b)
+    slots_a = src_a.any(axis=1).argmax(axis=0)
+    slots_b = src_b.any(axis=1).argmax(axis=0)
+    return int((slots_a != slots_b).sum() + (tc_a != tc_b).sum())
+
+def solve_pool(k, distance):
+    # up to K schedules, each at least DISTANCE (see schedule_distance) from the
+    # ones found before; returns [(objective, src, tc, penalties)] ranked by objective
+    for c in range(len(courses)):
+        for s in range(len(slots)):
+            course_channel("slot", c, s)
+    pool_model = model.Clone()
+    pool = []
+    for i in range(k):
+        solver = solve_model(pool_model, f"Pool {i+1}", ContinuousSolutionPrinter(), required=bool(not pool))
+        if solver is None:
+            warn(f"Pool: no other schedule at distance {distance} found, {len(pool)} schedules")
+            break
+        result = solution_values(solver.ResponseProto().solution)
+        pool.append((solver.ObjectiveValue(), *result))
+        # no-good: the next schedules differ from this one enough
+        changes = []
+        for c in range(len(courses)):
+            changes.append(1 - channels[("slot", c, int(solver.Value(cs[c])))])
+        for x in tc.values():
+            changes.append(1 - x if solver.Value(x) else x)
+        pool_model.Add(sum(changes) >= distance)
+        pool_model.ClearHints()
+    pool.sort(key=lambda x: x[0])
+    return pool
+
+def print_pool(pool):
+    print(f"Pool: {len(pool)} schedules")
+    for (i, (objective, result_src, result_tc, result_penalties)) in enumerate(pool):
+        others = [schedule_distance((result_src, result_tc), (x[1], x[2])) for x in pool if x[1] is not result_src]
+        breakdown = " ".join(f"{name}={value}" for (name, (coeff, value)) in result_penalties.items() if value)
+        print(f"{i+1}. objective {objective}, distance to the others at least {min(others, default=0)}: {breakdown}")
+
+# DECOMPOSITION
+# the master is a reduced model of who teaches what and the day and venue of
+# every course: the rules and penalties decided at that level (PENALTIES_MASTER
+# and the teacher part of stability) and the capacities of venue days and of
+# the days of every person; the venue/day blocks then place their courses into
+# slots and rooms in parallel, each a model of its own courses only (the
+# penalties of PENALTIES_BLOCK); blocks of one day sharing a person, a course
+# of courses_alone or Damian are solved together; people still teaching or
+# attending two courses at once are repaired by placing their day again as one
+# block, and verify_schedule() scores the combined schedule
+PENALTIES_BLOCK = ["split", "slotpref_bad", "slotpref_slight", "stability"]
+# master solves of --decompose before falling back to the full model
+DECOMPOSE_ITERATIONS = 5
+
+def venue_rooms(v):
+    return [r for r in range(len(rooms)) if Venues[rooms_venues[rooms[r]]] == v]
+
+def master_model():
+    # returns (model, course C on day D in venue V, teacher T teaches course C, time of course C, course C at time I)
+    m = cp_model.CpModel()
+    D = range(len(days))
+    V = [v for v in range(len(venues)) if venue_rooms(v)]
+    # course C takes place on day D in venue V
+    cdv = {}
+    for c in range(len(courses)):
+        for d in D:
+            for v in V:
+                cdv[(c,d,v)] = m.NewBoolVar("")
+        m.AddExactlyOne(cdv[(c,d,v)] for d in D for v in V)
+    # course C takes place on day D
+    cd = {}
+    for c in range(len(courses)):
+        for d in D:
+            cd[(c,d)] = m.NewBoolVar("")
+            m.Add(cd[(c,d)] == sum(cdv[(c,d,v)] for v in V))
+    # teacher T teaches course C
+    mtc = {}
+    for c in range(len(courses)):
+        for t in c_teachers[c]:
+            if tc_possible_array[t,c]:
+                mtc[(t,c)] = m.NewBoolVar("")
+    t_pairs = {t: [c for c in range(len(courses)) if (t,c) in mtc] for t in range(len(teachers))}
+    # number of courses teacher T teaches
+    num = {}
+    for t in range(len(teachers)):
+        num[t] = m.NewIntVar(0, len(slots), "")
+        m.Add(num[t] == sum(mtc[(t,c)] for c in t_pairs[t]))
+    def teach_num(T):
+        return num[Teachers[T]]
+    # teacher T teaches course C on day D
+    tcd = {}
+    for (t,c) in mtc:
+        for d in D:
+            tcd[(t,c,d)] = m.NewBoolVar("")
+            m.AddBoolAnd([mtc[(t,c)], cd[(c,d)]]).OnlyEnforceIf(tcd[(t,c,d)])
+            m.AddBoolOr([mtc[(t,c)].Not(), cd[(c,d)].Not(), tcd[(t,c,d)]])
+    # teacher T teaches on day D, in venue V
+    td = {}
+    tdv = {}
+    for t in range(len(teachers)):
+        for d in D:
+            td[(t,d)] = m.NewBoolVar("")
+            m.AddMaxEquality(td[(t,d)], [tcd[(t,c,d)] for c in t_pairs[t]] or [0])
+            for v in V:
+                tdv[(t,d,v)] = m.NewBoolVar("")
+                for c in t_pairs[t]:
+                    m.AddBoolOr([mtc[(t,c)].Not(), cdv[(c,d,v)].Not(), tdv[(t,d,v)]])
+            m.Add(sum(tdv[(t,d,v)] for v in V) <= 1)
+
+    # course teachers
+    for c in range(len(courses)):
+        C = courses[c]
+        lits = {T: mtc[(Teachers[T],c)] for T in teachers if (Teachers[T],c) in mtc}
+        if C in courses_regular:
+            m.Add(sum(x for (T, x) in lits.items() if T in teachers_lead) == 1)
+            m.Add(sum(x for (T, x) in lits.items() if T in teachers_follow) == 1)
+            m.Add(sum(x for (T, x) in lits.items() if T in teachers_community) <= 1)
+        elif C in courses_solo:
+            m.Add(sum(lits.values()) == 1)
+            m.Add(sum(x for (T, x) in lits.items() if T in teachers_community) == 0)
+        else:
+            m.Add(sum(lits.values()) == 0)
     for T in teachers:
-        if solver.Value(teach_num[Teachers[T]]) == n:
-            Ts.append(T)
-    if Ts:
-        print(f"{n}: {' '.join(Ts)}")
+        if T not in FAKE_TEACHERS:
+            m.Add(teach_num(T) <= t_util_max.get(T, 0))
+    for T in teachers_must_teach:
+        if t_util_max.get(T, 0) >= 1:
+            m.Add(teach_num(T) >= 1)
+    for T in teachers_community:
+        m.Add(teach_num(T) <= 2)
+    for (T, Cs) in tc_strict.items():
+        for C in Cs:
+            if (Teachers[T],Courses[C]) not in mtc:
+                error(f"Strict assignment not possible: teacher {T} course {C} (try --diagnose)")
+            m.Add(mtc[(Teachers[T],Courses[C])] == 1)
+    for (T1, T2) in tt_not_together:
+        for c in range(len(courses)):
+            m.Add(sum(mtc[(t,c)] for t in [Teachers[T1], Teachers[T2]] if (t,c) in mtc) < 2)
+
+    # capacities: courses of a venue day (a course of courses_alone empties its
+    # time in the other rooms) and courses of a person a day
+    for d in D:
+        for v in V:
+            nrooms = len(venue_rooms(v))
+            m.Add(sum(cdv[(c,d,v)] for c in range(len(courses)))
+                + sum(nrooms*cd[(Courses[C],d)] - cdv[(Courses[C],d,v)] for C in courses_alone) <= len(day_slots[d]) * nrooms)
+    for t in range(len(teachers)):
+        for d in D:
+            available = sum(1 for s in day_slots[d] if ts_pref_array[t, s] != 0)
+            m.Add(sum(tcd[(t,c,d)] for c in t_pairs[t]) <= available)
+    for p in range(len(people)):
+        wish = p_attend_wish[p]
+        if wish:
+            for d in D:
+                m.Add(sum(cd[(c,d)] for c in wish) + sum(tcd[(p,c,d)] for c in t_pairs[p] if c not in wish) <= len(day_slots[d]))
+
+    # course placement
+    for (C, S) in courses_slot.items():
+        m.Add(cd[(Courses[C], slot_day[Slots[S]])] == 1)
+    for (C, Ds) in courses_days.items():
+        m.AddBoolOr([cd[(Courses[C], Days[D])] for D in Ds])
+    for Cs in courses_different + courses_diffday:
+        for d in D:
+            m.Add(sum(cd[(Courses[C],d)] for C in Cs) <= 1)
+    # courses following each other are in one block
+    for Cs in courses_same + courses_after:
+        for (C1, C2) in zip(Cs, Cs[1:]):
+            for d in D:
+                for v in V:
+                    m.Add(cdv[(Courses[C1],d,v)] == cdv[(Courses[C2],d,v)])
+    # times of courses_different are decided here, the blocks keep them
+    ctime = {}
+    for Cs in courses_different:
+        for C in Cs:
+            if Courses[C] not in ctime:
+                ctime[Courses[C]] = m.NewIntVar(0, len(times)-1, "")
+        m.AddAllDifferent(ctime[Courses[C]] for C in Cs)
+    for (C, S) in courses_slot.items():
+        if Courses[C] in ctime:
+            m.Add(ctime[Courses[C]] == slot_time[Slots[S]])
+    # nothing at the time of a course of courses_alone with its slot given
+    for C in courses_alone:
+        if C in courses_slot:
+            (d, i) = (slot_day[Slots[courses_slot[C]]], slot_time[Slots[courses_slot[C]]])
+            for c in ctime:
+                if c != Courses[C]:
+                    m.Add(ctime[c] != i).OnlyEnforceIf(cd[(c,d)])
+    # course C (of courses_different) at time I
+    cat = {}
+    for c in ctime:
+        for i in range(len(times)):
+            cat[(c,i)] = m.NewBoolVar("")
+            m.Add(ctime[c] == i).OnlyEnforceIf(cat[(c,i)])
+            m.Add(ctime[c] != i).OnlyEnforceIf(cat[(c,i)].Not())
+    for i in range(len(times)):
+        for d in D:
+            s = day_time_slot(d, i)
+            if s is None:
+                # the day does not have that time
+                for c in ctime:
+                    m.AddBoolOr([cat[(c,i)].Not(), cd[(c,d)].Not()])
+                continue
+            # the teachers can teach at that time of the day
+            for c in ctime:
+                for t in c_teachers[c]:
+                    if (t,c) in mtc and ts_pref_array[t, s] == 0:
+                        m.AddBoolOr([cat[(c,i)].Not(), tcd[(t,c,d)].Not()])
+            # rooms of a venue and people at that time
+            for v in V:
+                used = []
+                for c in ctime:
+                    used.append(m.NewBoolVar(""))
+                    m.AddBoolOr([cdv[(c,d,v)].Not(), cat[(c,i)].Not(), used[-1]])
+                m.Add(sum(used) <= len(venue_rooms(v)))
+            for p in range(len(people)):
+                busy = []
+                for c in ctime:
+                    lit = cd[(c,d)] if c in p_attend_wish[p] else tcd.get((p,c,d))
+                    if lit is not None:
+                        busy.append(m.NewBoolVar(""))
+                        m.AddBoolOr([lit.Not(), cat[(c,i)].Not(), busy[-1]])
+                if len(busy) > 1:
+                    m.Add(sum(busy) <= 1)
+    for (C, R) in cr_strict.items():
+        v = Venues[rooms_venues[R]]
+        m.AddBoolOr([cdv[(Courses[C],d,v)] for d in D])
+    for (C, R) in cr_not.items():
+        v = Venues[rooms_venues[R]]
+        if venue_rooms(v) == [Rooms[R]]:
+            for d in D:
+                m.Add(cdv[(Courses[C],d,v)] == 0)
+    if t_util_max.get("Pavli", 0) >= 2 and t_util_max.get("Tom-K.", 0) >= 1 and "mosilana" in Venues and max_times >= 3:
+        (tom, pavli) = (Teachers["Tom-K."], Teachers["Pavli"])
+        m.Add(teach_num("Tom-K.") == 1)
+        m.Add(teach_num("Pavli") == 2)
+        for d in D:
+            if Venues["mosilana"] in V:
+                m.Add(tdv[(tom,d,Venues["mosilana"])] == 0)
+                m.Add(tdv[(pavli,d,Venues["mosilana"])] == 0)
+            m.Add(sum(tcd[(pavli,c,d)] for c in t_pairs[pavli]) == 2*sum(tcd[(tom,c,d)] for c in t_pairs[tom]))
+
+    # PENALTIES
+    values = {}
+    values["utilization"] = [element_var([(n - ideal)**2 for n in range(len(slots)+1)], teach_num(T), m)
+        for (T, ideal) in t_util_ideal.items()]
+    values["days"] = [extra_days_squared(teach_num(T), [td[(Teachers[T],d)] for d in D], m) for T in teachers]
+    values["occupied_days"] = []
+    for p in range(len(people)):
+        wish = p_attend_wish[p]
+        pd = []
+        for d in D:
+            x = m.NewBoolVar("")
+            m.AddMaxEquality(x, [cd[(c,d)] for c in wish] + [tcd[(p,c,d)] for c in t_pairs[p] if c not in wish] or [0])
+            pd.append(x)
+        occupied = m.NewIntVar(0, len(slots), "")
+        m.Add(occupied == len(wish) + sum(mtc[(p,c)] for c in t_pairs[p] if c not in wish))
+        values["occupied_days"].append(extra_days_squared(occupied, pd, m))
+    def coursepref(value, required_values):
+        result = []
+        for (T, prefs) in tc_pref.items():
+            if all(r <= set(prefs.values()) for r in required_values):
+                result += [mtc[(Teachers[T],Courses[C])] for (C, v) in prefs.items() if v == value and (Teachers[T],Courses[C]) in mtc]
+        return result
+    values["coursepref_bad"] = coursepref(1, [{1,2}, {1,3}])
+    values["coursepref_slight"] = coursepref(2, [{2,3}])
+    values["faketeachers"] = [teach_num(T) for T in FAKE_TEACHERS if T in Teachers]
+    values["teach_together"] = []
+    for T in [T for T in input_data if input_data[T]["teach_together"]]:
+        t = Teachers[T]
+        success_list = []
+        for c in t_pairs[t]:
+            others = [mtc[(Teachers[To],c)] for To in input_data[T]["teach_together"] if (Teachers[To],c) in mtc]
+            if others:
+                success = m.NewBoolVar("")
+                m.AddImplication(success, mtc[(t,c)])
+                m.AddBoolOr(others).OnlyEnforceIf(success)
+                success_list.append(success)
+        nobody = m.NewBoolVar("")
+        m.AddBoolOr(success_list + [nobody])
+        values["teach_together"].append(nobody)
+    # people attend the courses they wish at a time they do not teach anything
+    # else, only teaching the course itself keeps them from attending
+    values["attend_free"] = []
+    for (C, Ts) in courses_attend_free().items():
+        lits = [mtc[(Teachers[T],Courses[C])] for T in Ts if (Teachers[T],Courses[C]) in mtc]
+        values["attend_free"] += lits
+        if lits and len(lits) == len(Ts) and PENALTIES["attend_free"] != 0:
+            m.AddBoolOr([x.Not() for x in lits])
+    rooms_preferred = [r for r in range(len(rooms)) if rooms_venues[rooms[r]] in venues_preferred]
+    capacity = len(slots) * len(rooms_preferred) - len(courses_alone) * max(len(rooms_preferred) - 1, 0)
+    values["mosilana"] = [capacity - sum(cdv[(c,d,v)] for c in range(len(courses)) for d in D for v in V if venues[v] in venues_preferred)]
+    values["stability"] = []
+    for (c, (s, r, prev_ts)) in previous.items():
+        if prev_ts:
+            changed = m.NewBoolVar("")
+            for t in prev_ts:
+                if (t,c) in mtc:
+                    m.AddImplication(mtc[(t,c)].Not(), changed)
+                else:
+                    m.Add(changed == 1)
+            values["stability"].append(changed)
+    m.Minimize(sum(PENALTIES[name] * sum(values[name]) for name in PENALTIES_MASTER + ["stability"]))
+    return (m, cdv, mtc, ctime, cat)
+
+def block_model(block, block_courses, c_venue, c_teachers_fixed, c_time):
+    # model placing the courses of BLOCK (day, venues) with their venues, teachers and times (some) fixed
+    # returns (model, course C at time I in room R)
+    (d, block_venues) = block
+    m = cp_model.CpModel()
+    day = day_slots[d]
+    slot = lambda i: day[i]
+    # course C takes place at time I of the day in room R
+    x = {}
+    for c in block_courses:
+        C = courses[c]
+        for i in range(len(day)):
+            if c in c_time and c_time[c] != slot_time[slot(i)]:
+                continue
+            if C in courses_slot and Slots[courses_slot[C]] != slot(i):
+                continue
+            if any(ts_pref_array[t, slot(i)] == 0 for t in c_teachers_fixed[c]):
+                continue
+            for r in venue_rooms(c_venue[c]):
+                if cr_not.get(C) == rooms[r] or (C in cr_strict and cr_strict[C] != rooms[r]):
+                    continue
+                x[(c,i,r)] = m.NewBoolVar("")
+        m.AddExactlyOne(x[(c,i,r)] for i in range(len(day)) for r in range(len(rooms)) if (c,i,r) in x)
+    block_rooms = [r for v in block_venues for r in venue_rooms(v)]
+    for i in range(len(day)):
+        for r in block_rooms:
+            m.Add(sum(x[(c,i,r)] for c in block_courses if (c,i,r) in x) <= 1)
+    # course C at time I
+    ct = {}
+    for c in block_courses:
+        for i in range(len(day)):
+            ct[(c,i)] = m.NewBoolVar("")
+            m.Add(ct[(c,i)] == sum(x[(c,i,r)] for r in range(len(rooms)) if (c,i,r) in x))
+    # time of course C
+    ctime = {}
+    for c in block_courses:
+        ctime[c] = m.NewIntVar(0, len(day)-1, "")
+        m.Add(ctime[c] == sum(i*ct[(c,i)] for i in range(len(day))))
+    # people teach or attend one course at a time
+    taught = {t: [c for c in block_courses if t in c_teachers_fixed[c]] for t in range(len(teachers))}
+    for p in range(len(people)):
+        pcs = set(taught[p]) | (p_attend_wish[p] & set(block_courses))
+        if len(pcs) > 1:
+            for i in range(len(day)):
+                m.Add(sum(ct[(c,i)] for c in pcs) <= 1)
+    # teacher T teaches at time I
+    ts = {}
+    for t in [t for t in taught if taught[t]]:
+        for i in range(len(day)):
+            ts[(t,i)] = m.NewBoolVar("")
+            m.Add(ts[(t,i)] == sum(ct[(c,i)] for c in taught[t]))
+
+    for C in courses_alone:
+        c = Courses[C]
+        if c in block_courses:
+            for i in range(len(day)):
+                m.Add(sum(ct[(c2,i)] for c2 in block_courses if c2 != c) == 0).OnlyEnforceIf(ct[(c,i)])
+    for (C1, C2) in courses_after:
+        if Courses[C1] in block_courses:
+            m.Add(ctime[Courses[C1]] + 1 == ctime[Courses[C2]])
+    for Cs in courses_same:
+        if Courses[Cs[0]] in block_courses:
+            m.AddAllDifferent(ctime[Courses[C]] for C in Cs)
+            for C1 in Cs:
+                for C2 in Cs:
+                    if C1 != C2:
+                        m.Add(ctime[Courses[C1]] - ctime[Courses[C2]] <= len(Cs) - 1)
+    if "Tom-K." in Teachers and "Pavli" in Teachers and len(day) >= 3:
+        (tom, pavli) = (Teachers["Tom-K."], Teachers["Pavli"])
+        if taught[tom] and len(taught[pavli]) == 2 and t_util_max.get("Pavli", 0) >= 2 and t_util_max.get("Tom-K.", 0) >= 1 and "mosilana" in Venues:
+            m.Add(ts[(tom,0)] == 1)
+            m.Add(ts[(pavli,1)] == 1)
+            m.Add(ts[(pavli,2)] == 1)
+
+    # PENALTIES (lower bounds, the schedule is scored by verify_schedule())
+    values = {name: [] for name in PENALTIES_BLOCK}
+    for t in range(len(teachers)):
+        if (t,0) not in ts:
+            continue
+        for i in range(1, len(day)-1):
+            (before, after) = (m.NewBoolVar(""), m.NewBoolVar(""))
+            m.AddMaxEquality(before, [ts[(t,j)] for j in range(i)])
+            m.AddMaxEquality(after, [ts[(t,j)] for j in range(i+1, len(day))])
+            split = m.NewBoolVar("")
+            m.AddBoolOr([before.Not(), ts[(t,i)], after.Not(), split])
+            values["split"].append(split)
+        prefs = set(ts_pref_array[t])
+        day_prefs = ts_pref_array[t, day.start:day.stop]
+        if {1,2} <= prefs or {1,3} <= prefs:
+            values["slotpref_bad"] += [ts[(t,i)] for i in range(len(day)) if day_prefs[i] == 1]
+        if {2,3} <= prefs:
+            values["slotpref_slight"] += [ts[(t,i)] for i in range(len(day)) if day_prefs[i] == 2]
+    for (c, (s, r, prev_ts)) in previous.items():
+        if c not in block_courses or (s is None and r is None):
+            continue
+        kept = [x[(c,i,r2)] for (c2,i,r2) in x if c2 == c and (s is None or slot(i) == s) and (r is None or r2 == r)]
+        values["stability"].append(1 - sum(kept))
+    m.Minimize(sum(PENALTIES[name] * sum(values[name]) for name in PENALTIES_BLOCK))
+    return (m, x)
+
+def block_solve(job):
+    # runs in a forked worker process: places the courses of one block
+    (block, block_courses, c_venue, c_teachers_fixed, c_time) = job
+    (m, x) = block_model(block, block_courses, c_venue, c_teachers_fixed, c_time)
+    solver = cp_model.CpSolver()
+    configure_solver(solver, args.seed)
+    status = solver.Solve(m)
+    statusname = solver.StatusName(status)
+    if statusname not in ["FEASIBLE", "OPTIMAL"]:
+        return (block, statusname, solver.WallTime(), None)
+    d = block[0]
+    return (block, statusname, solver.WallTime(), {c: (day_slots[d][i], r) for ((c,i,r), v) in x.items() if solver.Value(v)})
+
+def link_blocks(c_day, c_venue, master_tc):
+    # venue days -> blocks (day, venues) solved together, with their courses
+    parent = {}
+    def find(b):
+        while parent.setdefault(b, b) != b:
+            b = parent[b]
+        return b
+    def union(bs):
+        bs = [find(b) for b in bs]
+        for b in bs[1:]:
+            parent[b] = bs[0]
+    for c in range(len(courses)):
+        find((c_day[c], c_venue[c]))
+    # people teaching or attending in several venues a day
+    for p in range(len(people)):
+        pcs = set(np.flatnonzero(master_tc[p])) | p_attend_wish[p]
+        for d in range(len(days)):
+            union([(d, c_venue[c]) for c in pcs if c_day[c] == d])
+    for C in courses_alone:
+        d = c_day[Courses[C]]
+        union([(d, c_venue[c]) for c in range(len(courses)) if c_day[c] == d])
+    if "Tom-K." in Teachers and "Pavli" in Teachers:
+        cs_damian = np.flatnonzero(master_tc[Teachers["Tom-K."]] | master_tc[Teachers["Pavli"]])
+        for d in range(len(days)):
+            union([(d, c_venue[c]) for c in cs_damian if c_day[c] == d])
+    blocks = {}
+    for c in range(len(courses)):
+        (d, v) = find((c_day[c], c_venue[c]))
+        blocks.setdefault((d, v), []).append(c)
+    return {(d, tuple(sorted(set(c_venue[c] for c in l)))): l for ((d, v), l) in blocks.items()}
+
+def solve_decomposed(processes):
+    # returns the decoded schedule (src, tc, penalties) like solution_values()
+    import_ortools()
+    (m, cdv, mtc, ctime, cat) = master_model()
+    print(f"Master: {len(m.Proto().variables)} variables, {len(m.Proto().constraints)} constraints")
+    for iteration in range(DECOMPOSE_ITERATIONS):
+        solver = solve_model(m, "Master (assignment, days and venues)")
+        print(f"Master objective: {solver.ObjectiveValue()}")
+        hint_solution(m, solver.ResponseProto().solution)
+        master_tc = np.zeros((len(teachers), len(courses)), dtype=np.int8)
+        for ((t,c), x) in mtc.items():
+            master_tc[t,c] = solver.Value(x)
+        (c_day, c_venue) = ({}, {})
+        for ((c,d,v), x) in cdv.items():
+            if solver.Value(x):
+                (c_day[c], c_venue[c]) = (d, v)
+        c_time = {c: solver.Value(x) for (c, x) in ctime.items()}
+        c_teachers_fixed = {c: [int(t) for t in np.flatnonzero(master_tc[:,c])] for c in range(len(courses))}
+        blocks = link_blocks(c_day, c_venue, master_tc)
+        debug(f"Decomposition: {len(blocks)} blocks of {', '.join(str(len(l)) for l in blocks.values())} courses")
+
+        # blocks: slots and rooms, in parallel
+        jobs = [(block, block_courses, c_venue, c_teachers_fixed, c_time) for (block, block_courses) in blocks.items()]
+        placement = {}
+        failed = []
+        import multiprocessing
+        with multiprocessing.get_context("fork").Pool(min(processes, len(jobs))) as pool:
+            for (block, statusname, walltime, result) in pool.imap_unordered(block_solve, jobs):
+                (d, vs) = block
+                print(f"Block {days[d]} {'+'.join(venues[v] for v in vs)}: finished in {walltime} seconds with status {statusname}")
+                if result is None:
+                    failed.append(block)
+                else:
+                    placement.update(result)
+        if not failed:
+            break
+        # the capacities of the master do not cover every rule of the blocks,
+        # the master must not put the same courses with the same teachers there again
+        for block in failed:
+            lits = []
+            for c in blocks[block]:
+                lits.append(cdv[(c, c_day[c], c_venue[c])].Not())
+                lits += [mtc[(t,c)].Not() for t in c_teachers_fixed[c]]
+                if c in ctime:
+                    lits.append(cat[(c, c_time[c])].Not())
+            m.AddBoolOr(lits)
+        m.ClearHints()
+    else:
+        warn(f"Decomposition: blocks cannot be placed after {DECOMPOSE_ITERATIONS} master solves, solving the full model from the last master")
+        build_model()
+        print(model.ModelStats())
+        model.ClearHints()
+        add_schedule_hints(model, {c: (*placement.get(c, (None, None)), c_teachers_fixed[c]) for c in range(len(courses))})
+        solver = solve_model(model, "Full model", ContinuousSolutionPrinter())
+        return solution_values(solver.ResponseProto().solution)
+
+    # repair: people teaching or attending two courses at once in different
+    # blocks (linked blocks should rule it out), their whole day is placed again
+    result_src = np.zeros((len(slots), len(rooms), len(courses)), dtype=np.int8)
+    for (c, (s, r)) in placement.items():
+        result_src[s, r, c] = 1
+    clashes = person_slots(result_src, master_tc | pc_attend_array) > 1
+    for d in sorted(set(slot_day[s] for s in np.flatnonzero(clashes.any(axis=0)))):
+        day_blocks = [block for block in blocks if block[0] == d]
+        block = (d, tuple(sorted(set(v for (_, vs) in day_blocks for v in vs))))
+        block_courses = [c for b in day_blocks for c in blocks[b]]
+        (block, statusname, walltime, result) = block_solve((block, block_courses, c_venue, c_teachers_fixed, c_time))
+        print(f"Repair {days[d]}: finished in {walltime} seconds with status {statusname}")
+        if result is None:
+            error(f"Decomposition: people teaching or attending two courses at once on {days[d]} cannot be repaired")
+        placement.update(result)
+
+    result_src[:] = 0
+    for (c, (s, r)) in placement.items():
+        result_src[s, r, c] = 1
+    (violations, result_penalties) = verify_schedule(result_src, master_tc)
+    if violations:
+        error(f"Decomposition: the combined schedule violates {', '.join(violations)}")
+    print_solution(result_src, master_tc, result_penalties)
+    return (result_src, master_tc, result_penalties)
+
+solve_status = None # (status, bound) of the last solve(), the bound only if the full objective was bounded
+
+def solve():
+    # solve the built model in the mode given by the options, return the decoded solution
+    global solve_status
+    solve_status = ("FEASIBLE", None)
+    if sum(bool(x) for x in [args.portfolio, args.two_phase, args.lexicographic, args.pool, args.decompose]) > 1:
+        error("--portfolio, --two-phase, --lexicographic, --pool and --decompose cannot be combined")
+    if args.reopen and not args.two_phase:
+        error("--reopen requires --two-phase")
+
+    if args.portfolio:
+        seeds = [args.seed + i for i in range(args.portfolio)]
+        # the processes share --workers (all cores by default)
+        workers = max((args.workers or os.cpu_count()) // len(seeds), 1)
+        debug(f"Portfolio: seeds {seeds}, {workers} workers each")
+        best = None
+        import multiprocessing
+        with multiprocessing.get_context("fork").Pool(len(seeds)) as pool:
+            for run in pool.imap_unordered(portfolio_solve, [(seed, workers) for seed in seeds]):
+                (seed, statusname, objective, bound, walltime, result) = run
+                print(f"Portfolio: seed {seed} finished in {walltime} seconds with status {statusname}, objective {objective}, bound {bound}")
+                if result is None:
+                    continue
+                if best is None or objective < best[2]:
+                    best = run
+                if statusname == "OPTIMAL":
+                    # nothing better can be found, stop the other solves
+                    break
+        if best is None:
+            error(f"Solution NOT found - no portfolio solve succeeded")
+        (seed, statusname, objective, bound, walltime, result) = best
+        print(f"Best solution: seed {seed} status {statusname}")
+        solve_status = (statusname, bound)
+        result_src, result_tc, result_penalties = result
+        print_solution(result_src, result_tc, result_penalties, objective)
+        return result
+    elif args.two_phase:
+        # phase 1: who teaches what - all hard constraints, assignment penalties only
+        phase1 = model.Clone()
+        phase1.Minimize(sum(PENALTIES[name] * sum(penalties[name]) for name in PENALTIES_ASSIGNMENT if name in penalties))
+        solver = solve_model(phase1, "Phase 1 (assignment)")
+        print(f"Phase 1 objective: {solver.ObjectiveValue()}")
+        # phase 2: when and where - the assignment is fixed
+        phase2 = model.Clone()
+        for (t,c) in tc:
+            phase2.Add(tc[(t,c)] == solver.Value(tc[(t,c)]))
+        solver = solve_model(phase2, "Phase 2 (timetable)", ContinuousSolutionPrinter())
+        if args.reopen:
+            # phase 3: everything open again, starting from the phase 2 schedule
+            hint_solution(model, solver.ResponseProto().solution)
+            solver = solve_model(model, "Phase 3 (full model)", ContinuousSolutionPrinter())
+            solve_status = (solver.StatusName(), solver.BestObjectiveBound())
+        result_src, result_tc, result_penalties = solution_values(solver.ResponseProto().solution)
+    elif args.lexicographic:
+        staged = model.Clone()
+        stages = penalties_stages()
+        for (i, names) in enumerate(stages):
+            debug(f"Stage {i+1}: {names}")
+            objective = sum(PENALTIES[name] * sum(penalties[name]) for name in names)
+            staged.Minimize(objective)
+            solver = solve_model(staged, f"Stage {i+1} ({', '.join(names)})", ContinuousSolutionPrinter())
+            value = round(solver.ObjectiveValue())
+            if solver.StatusName() != "OPTIMAL":
+                warn(f"Stage {i+1} optimum not proven, keeping its best value {value}")
+            print(f"Stage {i+1} objective: {value}")
+            if i+1 < len(stages):
+                # later stages must not make this one worse, they start from its solution
+                staged.Add(objective <= value)
+                hint_solution(staged, solver.ResponseProto().solution)
+        result_src, result_tc, result_penalties = solution_values(solver.ResponseProto().solution)
+        print(f"Weighted objective: {sum(coeff * value for (coeff, value) in result_penalties.values())}")
+    elif args.decompose:
+        result_src, result_tc, result_penalties = solve_decomposed(args.decompose)
+    elif args.pool:
+        pool = solve_pool(args.pool, args.pool_distance)
+        for (i, (objective, result_src, result_tc, result_penalties)) in enumerate(pool):
+            print()
+            print(f"Pool schedule {i+1}:")
+            print_solution(result_src, result_tc, result_penalties, objective)
+            if args.output:
+                (root, ext) = os.path.splitext(args.output)
+                write_schedule(f"{root}-{i+1}{ext}", result_src, result_tc)
+        print()
+        print_pool(pool)
+        (objective, result_src, result_tc, result_penalties) = pool[0]
+    else:
+        solver = solve_model(model, "Solving", ContinuousSolutionPrinter())
+        solve_status = (solver.StatusName(), solver.BestObjectiveBound())
+        result_src, result_tc, result_penalties = solution_values(solver.ResponseProto().solution)
+    return (result_src, result_tc, result_penalties)
+
+# EXPORT / IMPORT
+# the model can be built on one machine (--export), solved on another
+# (--solve-exported, only OR-Tools needed) and decoded back (--import); the
+# manifest carries the solution_index() of the model and the names it was built
+# with, import checks them against the loaded instance and input
+
+def manifest_names(penalty_names):
+    return {"courses": courses, "teachers": teachers, "slots": slots, "rooms": rooms, "people": people,
+        "penalties": {name: PENALTIES.get(name) for name in penalty_names}}
+
+def export_model(filename):
+    data = model.Proto().SerializeToString()
+    with open(filename, mode="wb") as f:
+        f.write(data)
+    index = solution_index()
+    manifest = {
+        "ortools": ortools.__version__,
+        "model_sha256": hashlib.sha256(data).hexdigest(),
+        "names": manifest_names(penalties),
+        "index": {key: (value.tolist() if key != "tc_keys" else [a.tolist() for a in value]) for (key, value) in index.items() if key != "penalties"},
+        "penalties": {name: [indices.tolist(), coeffs.tolist(), constant] for (name, (indices, coeffs, constant)) in index["penalties"].items()},
+    }
+    with open(filename + ".json", mode="w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    print(f"Model exported to {filename} (manifest {filename}.json)")
+
+def solve_exported(model_filename, response_filename):
+    import_ortools()
+    m = cp_model.CpModel()
+    with open(model_filename, mode="rb") as f:
+        m.Proto().ParseFromString(f.read())
+    solver = cp_model.CpSolver()
+    configure_solver(solver, args.seed)
+    status = solver.Solve(m, cp_model.ObjectiveSolutionPrinter())
+    print(f"Solving finished in {solver.WallTime()} seconds with status {status} - {solver.StatusName(status)}")
+    with open(response_filename, mode="wb") as f:
+        f.write(solver.ResponseProto().SerializeToString())
+    print(f"Response written to {response_filename}")
+
+def import_response(model_filename, response_filename):
+    # decode the response of an exported model, returns (src, tc, penalties) like solve()
+    global decode_index
+    import_ortools()
+    from ortools.sat import cp_model_pb2
+    with open(model_filename + ".json", mode="r") as f:
+        manifest = json.load(f)
+    with open(model_filename, mode="rb") as f:
+        if hashlib.sha256(f.read()).hexdigest() != manifest["model_sha256"]:
+            error(f"Model {model_filename} does not match its manifest")
+    if manifest["names"] != manifest_names(manifest["names"]["penalties"]):
+        error(f"Model {model_filename} was exported with another instance, input or penalties")
+    response = cp_model_pb2.CpSolverResponse()
+    with open(response_filename, mode="rb") as f:
+        response.ParseFromString(f.read())
+    statusname = cp_model_pb2.CpSolverStatus.Name(response.status)
+    print(f"Imported {response_filename} with status {statusname}")
+    if statusname not in ["FEASIBLE", "OPTIMAL"]:
+        error(f"Solution NOT found - status {statusname}")
+    index = manifest["index"]
+    decode_index = {key: np.array(value, dtype=int) for (key, value) in index.items() if key != "tc_keys"}
+    decode_index["tc_keys"] = tuple(np.array(a, dtype=int) for a in index["tc_keys"])
+    decode_index["penalties"] = {name: (np.array(indices, dtype=int), np.array(coeffs, dtype=int), constant)
+        for (name, (indices, coeffs, constant)) in manifest["penalties"].items()}
+    (result_src, result_tc, result_penalties) = solution_values(response.solution)
+    print_solution(result_src, result_tc, result_penalties, response.objective_value)
+    return (result_src, result_tc, result_penalties)
+
+def report(result_src, result_tc):
+    if args.output:
+        write_schedule(args.output, result_src, result_tc)
+
+    print()
+    print(f"Teachers' utilization:")
+    tn = result_tc.sum(axis=1)
+    for n in range(len(slots)):
+        Ts = [teachers[t] for t in np.flatnonzero(tn == n)]
+        if Ts:
+            print(f"{n}: {' '.join(Ts)}")
+
+def main(argv=None):
+    configure(sys.argv[1:] if argv is None else argv)
+    try:
+        if args.solve_exported:
+            solve_exported(*args.solve_exported)
+            return
+        load_instance(args.instance)
+        load_input(args.input, args.previous)
+        if args.verify:
+            verify_file(args.verify)
+            return
+        stored = load_result() if args.result_cache else None
+        plain = not (args.import_response or args.export or args.diagnose or args.pool)
+        if stored is not None and stored["status"] == "OPTIMAL" and plain:
+            print(f"Result cache: proven optimal schedule, objective {stored['objective']}")
+            (result_src, result_tc) = schedule_arrays(stored["schedule"])
+            print_solution(result_src, result_tc, stored["penalties"], stored["objective"])
+            report(result_src, result_tc)
+            return
+        if args.import_response:
+            (result_src, result_tc, result_penalties) = import_response(*args.import_response)
+            check_schedule(result_src, result_tc, result_penalties, "Verifier")
+            report(result_src, result_tc)
+            return
+        # --decompose builds smaller models, the full one only when it falls back to it
+        if not args.decompose or args.export or args.diagnose:
+            build_model()
+            print(model.ModelStats())
+            print()
+        if args.export:
+            export_model(args.export)
+            return
+        if args.diagnose:
+            diagnose()
+            return
+        if stored is not None and not args.decompose:
+            # resume from the stored schedule
+            print(f"Result cache: resuming from a {stored['status']} schedule, objective {stored['objective']}, bound {stored['bound']}")
+            model.ClearHints()
+            add_schedule_hints(model, stored["schedule"])
+        (result_src, result_tc, result_penalties) = solve()
+        check_schedule(result_src, result_tc, result_penalties, "Verifier")
+        if args.result_cache:
+            save_result(stored, result_src, result_tc, result_penalties, *solve_status)
+        report(result_src, result_tc)
+    except ScheduleError:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import swsched as s
+
+INPUT = os.path.join(ROOT, "input.csv")
+# a valid schedule of input.csv
+SCHEDULE = os.path.join(ROOT, "tests", "schedule.csv")
+
+@pytest.fixture
+def schedule(tmp_path):
+    # --result-cache in a temporary directory -> (src, tc, penalties, objective) of SCHEDULE
+    s.configure(["--result-cache", str(tmp_path)])
+    s.load_instance(None)
+    s.load_input(INPUT)
+    (src, tc) = s.schedule_arrays(s.read_schedule(SCHEDULE))
+    (violations, penalties) = s.verify_schedule(src, tc)
+    assert violations == []
+    return (src, tc, penalties, sum(coeff * value for (coeff, value) in penalties.values()))
+
+def worse(penalties):
+    # the same penalties with one more utilization point
+    (coeff, value) = penalties["utilization"]
+    return {**penalties, "utilization": (coeff, value + 1)}
+
+def test_save_load(schedule):
+    (src, tc, penalties, objective) = schedule
+    assert s.load_result() is None
+    assert s.save_result(None, src, tc, penalties, "FEASIBLE", 100) == "FEASIBLE"
+    stored = s.load_result()
+    assert (stored["objective"], stored["bound"], stored["status"]) == (objective, 100, "FEASIBLE")
+    assert s.schedule_arrays(stored["schedule"])[0].tolist() == src.tolist()
+
+def test_better_stored_result_is_kept(schedule):
+    (src, tc, penalties, objective) = schedule
+    s.save_result(None, src, tc, penalties, "FEASIBLE", 100)
+    # a worse result with a better bound: the stored schedule and status stay
+    assert s.save_result(s.load_result(), src, tc, worse(penalties), "UNKNOWN", 200) == "FEASIBLE"
+    stored = s.load_result()
+    assert (stored["objective"], stored["bound"], stored["status"]) == (objective, 200, "FEASIBLE")
+    assert stored["penalties"] == {name: list(value) for (name, value) in penalties.items()}
+    # a worse bound does not replace the stored one
+    s.save_result(s.load_result(), src, tc, worse(penalties), "UNKNOWN", 50)
+    assert s.load_result()["bound"] == 200
+
+def test_better_new_result_replaces(schedule):
+    (src, tc, penalties, objective) = schedule
+    # stored by hand, load_result() would reject the penalties of worse()
+    stored = {"objective": objective + penalties["utilization"][0], "bound": 300, "status": "UNKNOWN",
+        "schedule": s.read_schedule(SCHEDULE), "penalties": worse(penalties)}
+    assert s.save_result(stored, src, tc, penalties, "FEASIBLE", None) == "FEASIBLE"
+    result = s.load_result()
+    assert (result["objective"], result["bound"], result["status"]) == (objective, 300, "FEASIBLE")
+    # a bound reaching the objective proves it optimal
+    assert s.save_result(s.load_result(), src, tc, penalties, "FEASIBLE", objective) == "OPTIMAL"
+    assert s.load_result()["status"] == "OPTIMAL"
+
+def test_invalid_stored_result_is_ignored(schedule):
+    (src, tc, penalties, objective) = schedule
+    s.save_result(None, src, tc, penalties, "FEASIBLE", 100)
+    filename = os.path.join(s.args.result_cache, s.result_cache_key())
+    # a course dropped from the stored schedule
+    with open(filename + ".csv", mode="r") as f:
+        lines = f.readlines()
+    with open(filename + ".csv", mode="w") as f:
+        f.writelines(lines[:-1])
+    assert s.load_result() is None
+    # stored penalties that differ from the schedule
+    s.save_result(None, src, tc, penalties, "FEASIBLE", 100)
+    with open(filename + ".json", mode="r") as f:
+        data = json.load(f)
+    data["penalties"]["utilization"][1] += 1
+    with open(filename + ".json", mode="w") as f:
+        json.dump(data, f)
+    assert s.load_result() is None
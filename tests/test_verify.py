@@ -0,0 +1,124 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import swsched as s
+
+INPUT = os.path.join(ROOT, "input.csv")
+# a valid schedule of input.csv
+SCHEDULE = os.path.join(ROOT, "tests", "schedule.csv")
+# the first solution is enough, the limit only guards against a hung solve
+OPTIONS = ["--workers", "1", "--time-limit", "300", "--parameters", "stop_after_first_solution: true"]
+
+@pytest.fixture(scope="module")
+def solved():
+    # the built-in instance with input.csv -> (src, tc, penalties, objective)
+    s.configure(OPTIONS)
+    s.load_instance(None)
+    s.load_input(INPUT)
+    s.build_model()
+    s.add_schedule_hints(s.model, s.read_schedule(SCHEDULE))
+    solver = s.solve_model(s.model, "Solving")
+    (src, tc, penalties) = s.solution_values(solver.ResponseProto().solution)
+    return (src, tc, penalties, round(solver.ObjectiveValue()))
+
+def test_solved_schedule_verifies(solved):
+    (src, tc, penalties, objective) = solved
+    (violations, verified) = s.verify_schedule(src, tc)
+    assert violations == []
+    assert verified == {name: tuple(value) for (name, value) in penalties.items()}
+    assert sum(coeff * value for (coeff, value) in verified.values()) == objective
+    assert s.check_schedule(src, tc, penalties, "Verifier")
+
+def placements(src):
+    # course c -> (slot, room)
+    return {c: (sl, r) for (sl, r, c) in zip(*np.nonzero(src))}
+
+def room_clash(src):
+    # move a course into the room of another course at the same time and venue
+    for (c1, (s1, r1)) in placements(src).items():
+        for (c2, (s2, r2)) in placements(src).items():
+            if s1 != s2 or r1 == r2 or s.rooms_venues[s.rooms[r1]] != s.rooms_venues[s.rooms[r2]]:
+                continue
+            if s.courses[c2] in s.cr_not or s.courses[c2] in s.cr_strict:
+                continue
+            src[s2, r2, c2] = 0
+            src[s1, r1, c2] = 1
+            return (s1, r1)
+    pytest.fail("no two courses in one venue at the same time")
+
+def venue_move(src, tc, busy_slot):
+    # move a course at the same time into a free room of the other venue, so
+    # that its teachers with other courses that day teach in two venues
+    grouped = set(C for Cs in s.courses_same for C in Cs)
+    pinned = set(s.cr_not) | set(s.cr_strict) | grouped
+    damian = [s.Teachers[T] for T in ["Tom-K.", "Pavli"] if T in s.Teachers]
+    day = {c: s.slot_day[sl] for (c, (sl, r)) in placements(src).items()}
+    for (c, (sl, r)) in placements(src).items():
+        if sl == busy_slot or s.courses[c] in pinned or tc[damian, c].any():
+            continue
+        free = [r2 for r2 in range(len(s.rooms)) if not src[sl, r2].any()
+            and s.rooms_venues[s.rooms[r2]] != s.rooms_venues[s.rooms[r]]]
+        ts = [t for t in np.flatnonzero(tc[:, c])
+            if any(day[c2] == day[c] for c2 in np.flatnonzero(tc[t]) if c2 != c)]
+        if free and ts:
+            src[sl, r, c] = 0
+            src[sl, free[0], c] = 1
+            return [s.teachers[t] for t in ts]
+    pytest.fail("no course to move into the other venue")
+
+def test_tampered_schedule_violations(solved):
+    (src, tc, penalties, objective) = solved
+    src = src.copy()
+    (sl, r) = room_clash(src)
+    moved = venue_move(src, tc, sl)
+    (violations, verified) = s.verify_schedule(src, tc)
+    expected = [f"one course in {s.rooms[r]} at {s.slots[sl]}"] + [f"{T} teaches in one venue a day" for T in moved]
+    assert sorted(violations) == sorted(expected)
+    assert not s.check_schedule(src, tc, penalties, "Verifier")
+
+def run(*argv):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "swsched.py"), "--input", INPUT, *OPTIONS, *argv],
+        cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
+    return result.stdout
+
+def test_export_solve_import(tmp_path):
+    model = str(tmp_path / "model.pb")
+    response = str(tmp_path / "response.pb")
+    output = str(tmp_path / "schedule.csv")
+    run("--export", model, "--previous", SCHEDULE)
+    run("--solve-exported", model, response)
+    out = run("--import", model, response, "--output", output)
+    assert "WARNING: Verifier" not in out
+    assert "satisfies all rules" in run("--verify", output)
+
+def fixed_penalties(encoding):
+    # penalties of the model in ENCODING with src and tc fixed to SCHEDULE
+    # (symmetry breaking could cut the schedule off)
+    s.configure(["--workers", "1", "--time-limit", "300", "--encoding", encoding, "--no-symmetry-breaking"])
+    s.load_instance(None)
+    s.load_input(INPUT)
+    s.build_model()
+    schedule = s.read_schedule(SCHEDULE)
+    s.add_schedule_hints(s.model, schedule)
+    (src, tc) = s.schedule_arrays(schedule)
+    for ((sl, r, c), x) in s.src.items():
+        s.model.Add(x == int(src[sl, r, c]))
+    for ((t, c), x) in s.tc.items():
+        s.model.Add(x == int(tc[t, c]))
+    solver = s.solve_model(s.model, "Solving")
+    assert solver.StatusName() == "OPTIMAL"
+    return s.solution_values(solver.ResponseProto().solution)[2]
+
+def test_encodings_agree():
+    compact = fixed_penalties("compact")
+    reified = fixed_penalties("reified")
+    assert compact == reified
+    (src, tc) = s.schedule_arrays(s.read_schedule(SCHEDULE))
+    assert s.verify_schedule(src, tc)[1] == {name: tuple(value) for (name, value) in compact.items()}
@@ -0,0 +1,125 @@
+import copy
+import json
+import os
+import sys
+import threading
+import http.server
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import swsched as s
+import whatif as w
+
+INPUT = os.path.join(ROOT, "input.csv")
+# a valid schedule of input.csv
+SCHEDULE = os.path.join(ROOT, "tests", "schedule.csv")
+# the first solution is enough, the limit only guards against a hung solve
+OPTIONS = ["--workers", "1", "--time-limit", "300", "--parameters", "stop_after_first_solution: true"]
+
+# Kuba-Š. teaches Solo at that time in SCHEDULE
+UNAVAILABLE = {"op": "unavailable", "teacher": "Kuba-Š.", "slot": "Tue 20:00"}
+# Airsteps 2 is on Tuesday, Collegiate Shag 1 on Monday in SCHEDULE
+SAME = {"op": "same", "courses": ["Airsteps 2", "Collegiate Shag 1"]}
+
+@pytest.fixture
+def daemon():
+    # the state main() leaves, with the schedule of SCHEDULE as the best one
+    s.configure(OPTIONS)
+    s.args.symmetry_breaking = False
+    s.load_instance(None)
+    s.load_input(INPUT)
+    for name in w.RULE_DELTAS.values():
+        w.rules[name] = copy.deepcopy(getattr(s, name))
+    w.built_rules = None
+    w.deltas = []
+    w.build([])
+    (src, tc) = s.schedule_arrays(s.read_schedule(SCHEDULE))
+    (violations, penalties) = s.verify_schedule(src, tc)
+    assert violations == []
+    w.best = w.baseline = (None, src, tc, penalties)
+
+def slot_of(result, C):
+    # slot of course C in a result of solve()
+    return s.slots[result[1].sum(axis=1)[:, s.Courses[C]].argmax()]
+
+def teaches(result, T, C):
+    return bool(result[2][s.Teachers[T], s.Courses[C]])
+
+@pytest.mark.parametrize(("delta", "message"), [
+    ({"op": "max", "teacher": "Jarin"}, "delta 'max' needs 'courses'"),
+    ({"op": "max", "teacher": "Jarin", "courses": "two"}, "'courses' of delta 'max' is \"two\", not a number of courses"),
+    ({"op": "pin", "course": "Solo"}, "delta 'pin' needs 'slot' or 'room'"),
+    ({"op": "pin", "course": "Solo", "room": "attic"}, "unknown room 'attic'"),
+    ({"op": "assign", "teacher": "Jarin"}, "delta 'assign' needs 'course'"),
+    ({"op": "unavailable", "teacher": "Jarin", "slot": "Sun 10:00"}, "unknown slot 'Sun 10:00'"),
+    ({"op": "same", "courses": ["Solo"]}, "'courses' of delta 'same' is [\"Solo\"], not a list of two or more courses"),
+    ({"op": "diffday", "courses": ["Solo", "Nothing"]}, "unknown course 'Nothing'"),
+    ({"op": "move"}, "unknown delta 'move'"),
+    ("pin", "delta \"pin\" is not an object"),
+])
+def test_check_delta(delta, message):
+    s.load_instance(None)
+    with pytest.raises(w.DeltaError) as e:
+        w.check_delta(delta)
+    assert str(e.value) == message
+
+def test_solve_constraint_delta(daemon):
+    model = s.model
+    result = w.solve([UNAVAILABLE])
+    assert not (slot_of(result, "Solo") == "Tuesday 20:00-21:10" and teaches(result, "Kuba-Š.", "Solo"))
+    assert s.verify_schedule(*result[1:3])[0] == []
+    # the delta is added to a copy of the model, which is not rebuilt
+    assert s.model is model and w.built_rules == []
+
+def test_solve_rule_delta(daemon):
+    result = w.solve([SAME])
+    assert w.built_rules == [SAME]
+    assert SAME["courses"] in s.courses_same
+    assert s.verify_schedule(*result[1:3])[0] == []
+    (day1, day2) = (slot_of(result, C).split()[0] for C in SAME["courses"])
+    assert day1 == day2
+
+@pytest.fixture
+def server(daemon):
+    # the daemon on a free port of localhost -> POST function
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), w.Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    def post(path, data=None):
+        request = urllib.request.Request(f"http://127.0.0.1:{httpd.server_port}{path}", data=json.dumps(data or {}).encode(), method="POST")
+        try:
+            with urllib.request.urlopen(request) as f:
+                return (f.status, json.load(f))
+        except urllib.error.HTTPError as e:
+            return (e.code, json.load(e))
+    yield post
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_whatif_and_apply(server):
+    best = w.best
+    for delta in [UNAVAILABLE, SAME]:
+        (code, data) = server("/whatif", {"deltas": [delta]})
+        assert code == 200 and data["deltas"] == []
+        # nothing is kept, the model is built with the applied deltas only
+        assert w.best is best and w.deltas == [] and w.built_rules == []
+    (code, data) = server("/whatif", {"deltas": [{"op": "max", "teacher": "Jarin"}]})
+    assert (code, data) == (400, {"error": "delta 'max' needs 'courses'"})
+
+    (code, data) = server("/apply", {"deltas": [SAME]})
+    assert code == 200 and data["deltas"] == [SAME]
+    assert w.best is not best and w.deltas == [SAME] and w.built_rules == [SAME]
+    (code, data) = server("/apply", {"deltas": [UNAVAILABLE]})
+    assert code == 200 and data["deltas"] == [SAME, UNAVAILABLE]
+    solo = data["schedule"]["Solo"]
+    assert not (solo["slot"] == "Tuesday 20:00-21:10" and solo["teachers"] == ["Kuba-Š."])
+    # a failing delta keeps the applied ones and the model built with them
+    (code, data) = server("/apply", {"deltas": [{"op": "pin", "course": "Solo"}]})
+    assert code == 400 and w.deltas == [SAME, UNAVAILABLE] and w.built_rules == [SAME]
+
+    (code, data) = server("/reset")
+    assert code == 200 and w.best is w.baseline and w.deltas == [] and w.built_rules == []
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# What-if daemon: keeps the loaded instance, the built model and the best
+# schedule of swsched.py in memory and re-solves it with changes (deltas)
+# posted over HTTP on localhost, starting from the current best schedule.
+#
+#   python whatif.py --port 8765 -- --input input.csv --time-limit 30
+#
+#   GET  /schedule                    current schedule and applied deltas
+#   POST /whatif {"deltas": [...]}    solve with the deltas, keep nothing
+#   POST /apply {"deltas": [...]}     solve with the deltas and keep them
+#   POST /reset                       drop all applied deltas
+#
+# deltas:
+#   {"op": "unavailable", "teacher": T, "slot": S}   teacher T cannot teach in slot S
+#   {"op": "pin", "course": C, "slot": S, "room": R} course C in slot S and/or room R
+#   {"op": "assign", "teacher": T, "course": C}      teacher T teaches course C
+#   {"op": "forbid", "teacher": T, "course": C}      teacher T does not teach course C
+#   {"op": "max", "teacher": T, "courses": N}        teacher T teaches at most N courses
+#   {"op": "same", "courses": [C1, C2, ...]}         like courses_same (rebuilds the model)
+#   {"op": "diffday", "courses": [C1, C2, ...]}      like courses_diffday (rebuilds the model)
+# slots are given as in the schedule ("Mon 17:30-18:40") or as in the form ("Mon 17:30")
+
+import sys
+import json
+import copy
+import argparse
+import http.server
+
+import swsched
+
+parser = argparse.ArgumentParser(description="What-if scheduling daemon, other options are passed to swsched.py.")
+parser.add_argument("--host", default="127.0.0.1",
+    help="address to listen on (default: 127.0.0.1)")
+parser.add_argument("--port", type=int, default=8765,
+    help="port to listen on (default: 8765)")
+
+# deltas applied as constraints on a copy of the built model, the others change the rules
+CONSTRAINT_DELTAS = ["unavailable", "pin", "assign", "forbid", "max"]
+RULE_DELTAS = {"same": "courses_same", "diffday": "courses_diffday"}
+# keys every delta needs besides "op" (a pin needs a slot or a room too)
+DELTA_KEYS = {
+    "unavailable": ["teacher", "slot"],
+    "pin": ["course"],
+    "assign": ["teacher", "course"],
+    "forbid": ["teacher", "course"],
+    "max": ["teacher", "courses"],
+    "same": ["courses"],
+    "diffday": ["courses"],
+}
+
+class DeltaError(Exception):
+    pass
+
+rules = {} # rule lists as loaded, see build()
+built_rules = None # rule deltas the current model is built with
+deltas = [] # applied deltas
+best = None # (raw solution of the current model or None, src, tc, penalties)
+baseline = None # best without deltas
+
+def lookup(d, key, name):
+    if key not in d:
+        raise DeltaError(f"unknown {name} '{key}'")
+    return d[key]
+
+def slot_index(S):
+    if S in swsched.slots:
+        return swsched.slots.index(S)
+    if S in swsched.FORM_SLOT_LABELS:
+        return swsched.FORM_SLOT_LABELS.index(S)
+    raise DeltaError(f"unknown slot '{S}'")
+
+def check_delta(delta):
+    # readable errors for deltas that would fail (or do nothing) later
+    if not isinstance(delta, dict):
+        raise DeltaError(f"delta {json.dumps(delta)} is not an object")
+    op = delta.get("op")
+    if op not in DELTA_KEYS:
+        raise DeltaError(f"unknown delta '{op}'")
+    for key in DELTA_KEYS[op]:
+        if key not in delta:
+            raise DeltaError(f"delta '{op}' needs '{key}'")
+    if op == "pin" and "slot" not in delta and "room" not in delta:
+        raise DeltaError("delta 'pin' needs 'slot' or 'room'")
+    if "teacher" in delta:
+        lookup(swsched.Teachers, delta["teacher"], "teacher")
+    if "course" in delta:
+        lookup(swsched.Courses, delta["course"], "course")
+    if op == "max" and (type(delta["courses"]) is not int or delta["courses"] < 0):
+        raise DeltaError(f"'courses' of delta 'max' is {json.dumps(delta['courses'])}, not a number of courses")
+    if op in RULE_DELTAS:
+        Cs = delta["courses"]
+        if not isinstance(Cs, list) or len(Cs) < 2 or len(set(map(str, Cs))) != len(Cs):
+            raise DeltaError(f"'courses' of delta '{op}' is {json.dumps(Cs)}, not a list of two or more courses")
+        for C in Cs:
+            lookup(swsched.Courses, C, "course")
+        limit = swsched.max_times if op == "same" else len(swsched.days)
+        if len(Cs) > limit:
+            raise DeltaError(f"delta '{op}' has {len(Cs)} courses, at most {limit} fit")
+    if "slot" in delta:
+        slot_index(delta["slot"])
+    if "room" in delta:
+        lookup(swsched.Rooms, delta["room"], "room")
+
+def build(rule_deltas):
+    # (re)build the model with the rule deltas, only if they changed
+    global built_rules
+    if built_rules == rule_deltas:
+        return False
+    for (name, value) in rules.items():
+        setattr(swsched, name, copy.deepcopy(value))
+    for delta in rule_deltas:
+        getattr(swsched, RULE_DELTAS[delta["op"]]).append(list(delta["courses"]))
+    swsched.build_model()
+    built_rules = rule_deltas
+    return True
+
+def add_delta(m, delta):
+    # constraint delta -> constraints on model M
+    op = delta["op"]
+    if op == "unavailable":
+        (t, s) = (swsched.Teachers[delta["teacher"]], slot_index(delta["slot"]))
+        if (t,s) in swsched.ts:
+            m.Add(swsched.ts[(t,s)] == 0)
+    elif op == "pin":
+        c = swsched.Courses[delta["course"]]
+        if "slot" in delta:
+            m.Add(swsched.cs[c] == slot_index(delta["slot"]))
+        if "room" in delta:
+            m.Add(swsched.channels[("room", c, swsched.Rooms[delta["room"]])] == 1)
+    elif op in ["assign", "forbid"]:
+        (t, c) = (swsched.Teachers[delta["teacher"]], swsched.Courses[delta["course"]])
+        if (t,c) in swsched.tc:
+            m.Add(swsched.tc[(t,c)] == int(op == "assign"))
+        elif op == "assign":
+            raise DeltaError(f"teacher {delta['teacher']} cannot teach {delta['course']}")
+    elif op == "max":
+        m.Add(swsched.teach_num[swsched.Teachers[delta["teacher"]]] <= int(delta["courses"]))
+
+def solve(all_deltas):
+    # solve with the deltas starting from the best schedule, returns the new best
+    for delta in all_deltas:
+        check_delta(delta)
+    rebuilt = build([d for d in all_deltas if d["op"] in RULE_DELTAS])
+    m = swsched.model.Clone()
+    m.ClearHints()
+    if best[0] is not None and not rebuilt:
+        swsched.hint_solution(m, best[0])
+    else:
+        swsched.add_schedule_hints(m, swsched.solution_schedule(best[1], best[2]))
+    for delta in all_deltas:
+        if delta["op"] in CONSTRAINT_DELTAS:
+            add_delta(m, delta)
+    solver = swsched.solve_model(m, "What-if")
+    solution = solver.ResponseProto().solution
+    return (solution, *swsched.solution_values(solution), solver.StatusName(), solver.ObjectiveValue())
+
+def schedule_rows(result_src, result_tc):
+    rows = {}
+    for (c, (s, r, ts)) in swsched.solution_schedule(result_src, result_tc).items():
+        rows[swsched.courses[c]] = {"slot": swsched.slots[s], "room": swsched.rooms[r],
+            "teachers": [swsched.teachers[t] for t in ts]}
+    return rows
+
+def response(result, status=None, objective=None):
+    (solution, result_src, result_tc, result_penalties) = result
+    rows = schedule_rows(result_src, result_tc)
+    previous_rows = schedule_rows(best[1], best[2])
+    return {
+        "status": status,
+        "objective": objective if objective is not None else sum(coeff * value for (coeff, value) in result_penalties.values()),
+        "penalties": {name: value for (name, (coeff, value)) in result_penalties.items()},
+        "schedule": rows,
+        "changes": {C: {"before": previous_rows.get(C), "after": rows[C]} for C in rows if rows[C] != previous_rows.get(C)},
+        "deltas": deltas,
+    }
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False, indent=1).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/schedule":
+            return self.reply(404, {"error": f"unknown path {self.path}"})
+        self.reply(200, response(best))
+
+    def do_POST(self):
+        global best, deltas
+        if self.path == "/reset":
+            deltas = []
+            build([])
+            best = baseline
+            return self.reply(200, response(best))
+        if self.path not in ["/whatif", "/apply"]:
+            return self.reply(404, {"error": f"unknown path {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "{}")
+            new_deltas = list(request.get("deltas", []))
+            result = solve(deltas + new_deltas)
+        except (ValueError, TypeError, KeyError, DeltaError) as e:
+            build([d for d in deltas if d["op"] in RULE_DELTAS])
+            return self.reply(400, {"error": str(e)})
+        except swsched.ScheduleError as e:
+            # infeasible (or no solution in the time limit), nothing changes
+            build([d for d in deltas if d["op"] in RULE_DELTAS])
+            return self.reply(409, {"error": str(e)})
+        (status, objective) = result[4:]
+        data = response(result[:4], status, objective)
+        if self.path == "/apply":
+            deltas += new_deltas
+            best = result[:4]
+            data["deltas"] = deltas
+        else:
+            # the model stays built with the applied deltas only
+            build([d for d in deltas if d["op"] in RULE_DELTAS])
+        self.reply(200, data)
+
+def main():
+    global best, baseline
+    (options, rest) = parser.parse_known_args()
+    if rest[:1] == ["--"]:
+        rest = rest[1:]
+    swsched.configure(rest)
+    # symmetry breaking orders interchangeable courses, rooms and placeholders,
+    # deltas naming one of them would then cut off valid schedules
+    swsched.args.symmetry_breaking = False
+    try:
+        swsched.load_instance(swsched.args.instance)
+        swsched.load_input(swsched.args.input, swsched.args.previous)
+        for name in RULE_DELTAS.values():
+            rules[name] = copy.deepcopy(getattr(swsched, name))
+        build([])
+        (result_src, result_tc, result_penalties) = swsched.solve()
+    except swsched.ScheduleError:
+        sys.exit(1)
+    # the first what-if is hinted with the decoded schedule
+    best = baseline = (None, result_src, result_tc, result_penalties)
+    server = http.server.HTTPServer((options.host, options.port), Handler)
+    print(f"Listening on http://{options.host}:{options.port}/", flush=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()